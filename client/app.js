@@ -555,6 +555,38 @@ let currentAction = null;
   };
   
   ws.onerror = err => console.error('WS error', err);
+
+  // bumped by stop_audio so clips scheduled with start_in don't start after a barge-in
+  let audioGeneration = 0;
+
+  // Playback acks for main_chat: it waits for playback_ended instead of guessing
+  // when a clip is over. currentClipId is the clip the audio element is playing.
+  let currentClipId = null;
+  const sendAck = (type, clip_id) => {
+    if (clip_id && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ type, clip_id }));
+    }
+  };
+  const endCurrentClip = () => {
+    if (currentClipId) {
+      sendAck('playback_ended', currentClipId);
+      replyMarkers.delete(currentClipId);
+      currentClipId = null;
+    }
+  };
+
+  // Reply streams (AUDIO_REPLY_STREAM=1 in main_chat): one clip for the whole reply and
+  // a reply_marker per chunk saying where it starts; the expression follows the chunk
+  // being heard. clip_id -> markers not reached yet, earliest first.
+  const replyMarkers = new Map();
+  const applyReplyMarkers = () => {
+    const markers = currentClipId && replyMarkers.get(currentClipId);
+    const el = playbackController.el;
+    if (!markers || !el) return;
+    while (markers.length && el.currentTime >= markers[0].offset) {
+      audioMgr.setExpression(markers.shift().expression);
+    }
+  };
   
   ws.onmessage = async ({ data }) => {
     let msg;
@@ -653,7 +685,17 @@ let currentAction = null;
 
     // Original animation commands - now using PlaybackController for mobile compatibility
     if (msg.type === 'start_animation') {
-      const { audio_path, audio_text, audio_duraction, expression = 'neutral' } = msg;
+      const { audio_path, audio_text, audio_duraction, expression = 'neutral', start_in = 0, clip_id = null } = msg;
+      // cues arrive a little ahead of time so the previous clip can finish: fetch the
+      // clip now and start it when it's due
+      if (start_in > 0) {
+        const generation = audioGeneration;
+        const preload = new Audio();
+        preload.preload = 'auto';
+        preload.src = ensureAbsoluteUrl(audio_path);
+        await new Promise(r => setTimeout(r, start_in * 1000));
+        if (generation !== audioGeneration) return;
+      }
       audioMgr.setExpression(expression);
       try {
         // Ensure audio is unlocked (best-effort) and play using PlaybackController
@@ -662,14 +704,48 @@ let currentAction = null;
         } catch (e) {
           console.warn('unlockOnce thrown:', e);
         }
+        // the previous clip (if any) is cut by this one
+        endCurrentClip();
         const ok = await playbackController.playAudioUrl(audio_path);
         if (!ok) console.warn('Playback failed (animation will still run)');
+        const el = playbackController.el;
+        if (el && !el._acksHooked) {
+          el.addEventListener('ended', endCurrentClip);
+          el.addEventListener('error', endCurrentClip);
+          el.addEventListener('timeupdate', applyReplyMarkers);
+          el._acksHooked = true;
+        }
+        if (ok) {
+          currentClipId = clip_id;
+          sendAck('playback_started', clip_id);
+        } else {
+          // nothing will play: don't keep main_chat waiting for this clip
+          sendAck('playback_started', clip_id);
+          sendAck('playback_ended', clip_id);
+        }
         animationMgr.play();
       } catch (e) {
         console.error('Failed to start audio/animation:', e);
       }
     }
 
+    if (msg.type === 'reply_marker') {
+      const { clip_id, offset = 0, expression = 'neutral' } = msg;
+      const markers = replyMarkers.get(clip_id) || [];
+      markers.push({ offset, expression });
+      markers.sort((a, b) => a.offset - b.offset);
+      replyMarkers.set(clip_id, markers);
+      applyReplyMarkers();
+    }
+
+    // Barge-in: the user started talking, cut the current clip
+    if (msg.type === 'stop_audio') {
+      audioGeneration++;
+      endCurrentClip();
+      replyMarkers.clear();
+      animationMgr.stop();
+    }
+
     if (msg.type === 'start_vrma') {
       const {
         animation_url,
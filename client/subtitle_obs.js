@@ -1,5 +1,17 @@
 import { VRM_PATH, WS_URL }       from './config.js';
-import { showSubtitleStreaming } from './subtitles.js';
+import { showSubtitleStreaming, setSubtitleDuration } from './subtitles.js';
+
+// Reply streams (AUDIO_REPLY_STREAM=1): the start_animation of a reply has no text,
+// each chunk's text comes in a reply_marker with its offset in the stream.
+const replyStarts = new Map();     // clip_id -> performance.now() when it starts
+const pendingMarkers = new Map();  // clip_id -> markers received before its start_animation
+let markerTimers = [];
+let subtitleClip = null;           // clip_id of the subtitle on screen
+
+function scheduleMarker(start, { offset = 0, text = '', duration = 0 }) {
+  const delay = Math.max(0, start + offset * 1000 - performance.now());
+  markerTimers.push(setTimeout(() => showSubtitleStreaming(text, duration, "letter"), delay));
+}
 
 // Setup WebSocket
 const ws = new WebSocket(WS_URL);
@@ -12,7 +24,37 @@ ws.onmessage = ({ data }) => {
   }
 
   if (msg.type === 'start_animation') {
-    const { audio_text, audio_duraction } = msg;
-    showSubtitleStreaming(audio_text, audio_duraction, "letter");
+    const { audio_text, audio_duraction, start_in = 0, clip_id = null } = msg;
+    if (audio_text) {
+      showSubtitleStreaming(audio_text, audio_duraction, "letter");
+      subtitleClip = clip_id;
+    }
+    if (clip_id) {
+      const start = performance.now() + start_in * 1000;
+      replyStarts.set(clip_id, start);
+      for (const marker of pendingMarkers.get(clip_id) || []) scheduleMarker(start, marker);
+      pendingMarkers.delete(clip_id);
+    }
+  }
+
+  if (msg.type === 'reply_marker') {
+    const start = replyStarts.get(msg.clip_id);
+    if (start !== undefined) {
+      scheduleMarker(start, msg);
+    } else {
+      pendingMarkers.set(msg.clip_id, [...(pendingMarkers.get(msg.clip_id) || []), msg]);
+    }
+  }
+
+  // a streamed clip is cued with an estimated duration, the real one follows
+  if (msg.type === 'clip_duration' && msg.clip_id && msg.clip_id === subtitleClip) {
+    setSubtitleDuration(msg.duration);
+  }
+
+  if (msg.type === 'stop_audio') {
+    markerTimers.forEach(clearTimeout);
+    markerTimers = [];
+    replyStarts.clear();
+    pendingMarkers.clear();
   }
 };
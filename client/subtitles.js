@@ -1,5 +1,21 @@
 // subtitles.js
 
+let shownAt = 0;
+let hideTimer = null;
+
+const hideAfter = (totalDurationSeconds) => {
+  const container = document.getElementById('subtitle-container');
+  clearTimeout(hideTimer);
+  hideTimer = setTimeout(() => {
+    container.classList.remove('visible');
+  }, Math.max(0, shownAt + totalDurationSeconds * 1000 + 900 - performance.now()));
+};
+
+// the clip's real length came in after its subtitle started (streamed clips)
+export function setSubtitleDuration(totalDurationSeconds) {
+  if (hideTimer !== null) hideAfter(totalDurationSeconds);
+}
+
 export function showSubtitleStreaming(text, totalDurationSeconds, mode = "word") {
   const container = document.getElementById('subtitle-container');
   container.innerHTML = ''; // Clear existing content
@@ -23,7 +39,6 @@ export function showSubtitleStreaming(text, totalDurationSeconds, mode = "word")
   });
 
   // Hide after total duration
-  setTimeout(() => {
-    container.classList.remove('visible');
-  }, totalDurationSeconds * 1000 + 900);
+  shownAt = performance.now();
+  hideAfter(totalDurationSeconds);
 }
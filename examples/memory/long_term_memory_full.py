@@ -4,8 +4,12 @@ import yaml
 import gradio as gr
 import json
 import os
+import sys
 from openai import OpenAI
 from dotenv import load_dotenv
+# shares the history store with the server (run from the repo root like the server)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server"))
+from process.llm_funcs.history_store import HistoryStore
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
@@ -30,16 +34,14 @@ SYSTEM_PROMPT =  [
         }
     ]
 
-# Load/save chat history
+# Chat history: append-only log (chat_history.jsonl), the system prompt always comes from the config
+history = HistoryStore(HISTORY_FILE)
+
 def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
-    return SYSTEM_PROMPT
+    return [dict(m) for m in SYSTEM_PROMPT] + history.tail()
 
-def save_history(history):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=2)
+def append_history(*messages):
+    history.append(*messages)
 
 
 
@@ -68,74 +70,68 @@ def llm_response(user_input):
     messages = load_history()
 
     # Append user message to memory
-    messages.append({
+    user_message = {
         "role": "user",
         "content": [
             {"type": "input_text", "text": user_input}
         ]
-    })
+    }
+    messages.append(user_message)
 
 
     riko_test_response = get_riko_response_no_tool(messages)
 
-    # just append assistant message to regular response. 
-    messages.append({
+    # log the turn (user + assistant message)
+    append_history(user_message, {
     "role": "assistant",
     "content": [
         {"type": "output_text", "text": riko_test_response.output_text}
     ]
     })
-
-    save_history(messages)
     return riko_test_response.output_text
 
+def memory_message(context_memory):
+    """Ephemeral system message carrying this turn's retrieved memories."""
+    return {
+        "role": "system",
+        "content": [
+            {
+                "type": "input_text",
+                "text": f"The following memories may or may not be relevent information from past conversations. If it is not relevent to this conversation, ignore it:\n{context_memory}"
+            }
+        ]
+    }
+
 # respond with Long-term memory 
 def llm_response_with_memory(user_input, context_memory):
 
     messages = load_history()
-    # modify the system prompt here with the context memory 
 
-       # Safely modify the system prompt (assumes it's always first)
-    if messages and messages[0]['role'] == 'system':
-        base_content = char_config['presets']['default']['system_prompt']
-        messages[0]['content'] = [
-            {
-                "type": "input_text",
-                "text": f"{base_content}\n\nThe following memories may or may not be relevent information from past conversations. If it is not relevent to this conversation, ignore it:\n{context_memory}"
-            }
-        ]
-    else:
-        # Fallback in case system prompt is missing for some reason
-        messages.insert(0, {
-            "role": "system",
-            "content": [
-                {
-                    "type": "input_text",
-                    "text": f"{char_config['presets']['default']['system_prompt']}\n\n[Memory]\n{context_memory}"
-                }
-            ]
-        })
+    # The system prompt and the history stay byte-identical from turn to turn, so the
+    # LLM server can reuse its cached prefix. The memories change every turn: they go
+    # in a message right before the new user turn and are never saved to the history.
+    if context_memory:
+        messages.append(memory_message(context_memory))
 
     # Append user message to memory
-    messages.append({
+    user_message = {
         "role": "user",
         "content": [
             {"type": "input_text", "text": user_input}
         ]
-    })
+    }
+    messages.append(user_message)
 
 
     riko_test_response = get_riko_response_no_tool(messages)
 
-    # just append assistant message to regular response. 
-    messages.append({
+    # log the turn (user + assistant message)
+    append_history(user_message, {
     "role": "assistant",
     "content": [
         {"type": "output_text", "text": riko_test_response.output_text}
     ]
     })
-
-    save_history(messages)
     return riko_test_response.output_text
 
 
@@ -1,41 +1,3 @@
-from faster_whisper import WhisperModel
-from process.asr_func.asr_auto_record import record_on_speech, transcribe_audio
-from process.llm_funcs.llm_scr import llm_response, llm_response_with_memory
-from process.tts_func.sovits_ping import sovits_gen, play_audio, get_wav_duration
-from process.tts_func.tts_preprocess import clean_llm_output
-from process.vrm_func.vrm_ping import vrm_talk, vrm_animate
-from process.vrm_func.vrm_states_ping import set_vrm_state
-
-from pathlib import Path
-import os
-import time
-### transcribe audio 
-import uuid
-import soundfile as sf
-import asyncio
-import threading
-import random
-import os
-import time
-import uuid
-import json
-import shutil
-import yaml
-from pathlib import Path
-from openai import OpenAI
-from contextlib import suppress
-from queue import Queue
-from threading import Event, Thread
-from dotenv import load_dotenv
-from pathlib import Path
-
-load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-def get_wav_duration(path):
-    with sf.SoundFile(path) as f:
-        return len(f) / f.samplerate
-
-
 #!/usr/bin/env python3
 """
 Streaming LLM -> chunked TTS -> queued playback script for Riko.
@@ -44,9 +6,10 @@ What it does:
 - Records user speech (uses your record_on_speech)
 - Transcribes (transcribe_audio)
 - Streams LLM text (OpenAI Responses streaming)
-- For each chunk: generate TTS via sovits_gen, copy to public audio dir, enqueue for playback
+- For each chunk: hand it to a synthesis pool (sovits_gen runs concurrently with the LLM stream),
+  write the clip once to the audio store, enqueue for playback in chunk order
 - Playback loop calls vrm_talk and vrm_animate and waits for the audio's duration to avoid overlap
-- At the end of the stream, the full assistant text is appended to the JSON history file
+- At the end of the stream, the turn is appended to the JSONL history log
 
 Fill in or import the helper functions you already have in your project:
 - record_on_speech(output_file, samplerate, channels, silence_threshold, silence_duration, device)
@@ -58,22 +21,44 @@ Fill in or import the helper functions you already have in your project:
 - clean_llm_output(text)
 - get_emotion(text, emotion_model, tokenizer)
 - map_emotion_to_expression(emotion)
-- get_wav_duration(path)
 
 Make sure char_config.yaml contains history_file and model keys (see your example config).
 """
 
 import os
 import time
-import uuid
-import json
-import shutil
-import yaml
-from pathlib import Path
-from openai import OpenAI
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait as futures_wait
 from contextlib import suppress
-from queue import Queue
-from threading import Thread
+from pathlib import Path
+from queue import Queue, Empty
+from threading import Event, Thread, Lock
+
+import yaml
+from dotenv import load_dotenv
+from faster_whisper import WhisperModel
+from openai import BadRequestError, NotFoundError, UnprocessableEntityError
+
+from process.asr_func.asr_auto_record import record_on_speech, transcribe_audio, SpeechDetector
+from process.llm_funcs.llm_backend import get_backend
+from process.llm_funcs.history_store import HistoryStore
+from process.llm_funcs.context_window import ContextWindow, message_text
+from process.llm_funcs.response_cache import ResponseCache
+from process.llm_funcs.text_chunker import TextChunker
+from process.perf_func.timeline import TurnTimeline
+from process.tts_func.sovits_ping import (
+    sovits_gen, sovits_bytes, TTSCancelled, sovits_pool, sovits_set_default_reference,
+)
+from process.tts_func.audio_store import store, wav_duration
+from process.tts_func.audio_post import post_process
+from process.tts_func.reply_stream import ReplyStream
+from process.tts_func.tts_preprocess import clean_llm_output
+from process.tts_func.wav_stream import WavStream
+from process.vrm_func.vrm_ping import vrm_talk, vrm_animate, vrm_stop_audio, vrm_reply_marker, vrm_clip_duration
+from process.vrm_func.vrm_states_ping import set_vrm_state
+from process.vrm_func.playback_events import playback_events
+
+load_dotenv()
 
 # ---------------------------
 # Load config + OpenAI client
@@ -86,8 +71,6 @@ with open(CONFIG_PATH, 'r') as f:
     char_config = yaml.safe_load(f)
 
 HISTORY_FILE = char_config['history_file']
-MODEL = char_config.get('model', 'Qwen2.5-7B-Instruct-Q4_K_M.gguf')
-# MODEL = 'Qwen2.5-7B-Instruct-Q4_K_M.gguf'
 CASE_SYSTEM_PROMPT = "You are a helpful assistant." # override for testing.
 
 SYSTEM_PROMPT = [
@@ -100,92 +83,197 @@ SYSTEM_PROMPT = [
     }
 ]
 
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if not OPENAI_API_KEY:
-    raise EnvironmentError('Please set OPENAI_API_KEY in your environment')
-
-
-OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "http://127.0.0.1:8000/v1")
-client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+# chat LLM (LLM_BACKEND=local|openai|groq, see process/llm_funcs/llm_backend.py)
+llm = get_backend()
+MODEL = llm.model
+
+# Progressive playback: cue the avatar as soon as a clip's WAV header arrives and let
+# server.py stream the rest of the file while SoVITS is still sending it.
+STREAMING_TTS = bool(char_config.get("sovits_ping_config", {}).get("streaming_mode", False))
+AUDIO_STREAM_URL = os.getenv("AUDIO_STREAM_URL", "http://localhost:8001/audio_stream").rstrip("/")
+# One continuous stream per reply (process/tts_func/reply_stream.py): the chunks are
+# appended to a single WAV served like a streamed clip, with one talk cue per reply
+# and a reply_marker cue per chunk. Takes precedence over streaming_mode.
+REPLY_STREAM = os.getenv("AUDIO_REPLY_STREAM", "0").lower() in ("1", "true", "yes")
+
+# Barge-in: keep listening while Riko talks and cut the reply when the user speaks.
+# Off by default - without headphones the mic can pick up Riko's own voice.
+BARGE_IN = os.getenv("BARGE_IN", "0").lower() in ("1", "true", "yes")
+
+# Send each talk cue this many seconds before its clip should start, so the browser
+# has fetched it by the time the previous clip ends (the cue carries start_in).
+CUE_LEAD = float(os.getenv("PLAYBACK_CUE_LEAD", "0.15"))
+# With a client that acks playback, how long past a clip's expected end we wait
+# for its playback_ended before assuming it finished (slow fetch, decoding...).
+ACK_GRACE = float(os.getenv("PLAYBACK_ACK_GRACE", "2.0"))
+# A streamed clip is cued before its length is known: its talk cue carries this
+# estimate (seconds per character of text, for subtitles) and a clip_duration cue
+# follows with the real one once SoVITS is done.
+SECONDS_PER_CHAR = float(os.getenv("TTS_SECONDS_PER_CHAR", "0.065"))
 
 
 # ---------------------------
 # History utilities
 # ---------------------------
 
+# append-only log next to history_file (chat_history.jsonl); the old JSON is imported once
+history = HistoryStore(HISTORY_FILE)
+
+
 def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, 'r') as f:
-            return json.load(f)
-    return SYSTEM_PROMPT.copy()
+    """System prompt + the recent conversation (served from memory after the first call)."""
+    return SYSTEM_PROMPT.copy() + history.tail()
+
+
+def append_history(*messages):
+    """Log the new messages of a turn (a single append, not a rewrite of the file)."""
+    history.append(*messages)
+    # the LLM is idle until the next turn: fold what fell out of the window into the summary
+    context.update_summary_async()
+
 
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
 
-def save_history(history):
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=2)
+
+def summarize_turns(previous_summary, messages):
+    """Fold older messages into the running summary (runs in the context window's thread)."""
+    transcript = "\n".join(f"{m.get('role')}: {message_text(m)}" for m in messages)
+    prompt = (
+        "Update the summary of a conversation between a user and their AI companion.\n"
+        "Keep names, facts about the user, preferences, plans and promises; drop small talk.\n"
+        "Answer with the summary only, in the language of the conversation, under 200 words.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+    return llm.complete(
+        [{"role": "user", "content": prompt}],
+        temperature=0.3,
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+
+
+# system prompt + summary of older turns + the recent turns that fit in CONTEXT_TOKENS
+context = ContextWindow(
+    summarize=summarize_turns,
+    summary_file=history.path.with_name(history.path.stem + ".summary.json"),
+)
+
+
+def build_context(messages):
+    """
+    Messages actually sent to the LLM for this turn.
+
+    `messages` is load_history() plus the new user turn.
+    """
+    return context.build(messages, first_index=history.position())
+
+
+# Warm the LLM server's prompt cache while the user speaks: system prompt + history
+# are prefilled during the listen phase, so once the transcript arrives only the new
+# user turn is left to process. Needs a server that keeps the prompt cache between
+# requests (llama.cpp server: cache_prompt, vLLM: --enable-prefix-caching).
+LLM_PREFILL = os.getenv("LLM_PREFILL", "0").lower() in ("1", "true", "yes")
+
+
+def prefill_prompt():
+    """Send the prompt of the next turn (minus the user turn) in the background."""
+    if LLM_PREFILL:
+        Thread(target=_prefill, args=(load_history(),), daemon=True).start()
+
+
+def _prefill(messages):
+    global LLM_PREFILL
+    start = time.monotonic()
+    try:
+        # one token is the smallest generation every OpenAI-compatible server accepts
+        llm.complete(build_context(messages), max_tokens=1, extra_body={"cache_prompt": True})
+    except (BadRequestError, NotFoundError, UnprocessableEntityError) as e:
+        LLM_PREFILL = False
+        print(f"[prefill] the LLM server refused the prefill request, disabling it: {e}")
+        return
+    except Exception as e:
+        print(f"[prefill] failed: {e}")
+        return
+    print(f"[prefill] prompt cache warmed in {time.monotonic() - start:.2f}s")
+
+# Replies to the character's response_cache_phrases ("salut", "bonne nuit"...) are
+# replayed, audio included, without calling the LLM (off unless response_cache: true).
+response_cache = ResponseCache(
+    enabled=bool(char_config.get("response_cache", False)),
+    phrases=char_config.get("response_cache_phrases") or [],
+)
 
 # ---------------------------
 # Streaming helper
 # ---------------------------
 
-def to_chat_messages(history):
-    out = []
-    for m in history:
-        role = m.get("role", "user")
-        content = m.get("content", "")
-
-        # Riko stocke souvent content sous forme de liste de blocs {"type": "...", "text": "..."}
-        if isinstance(content, list):
-            text = "".join(
-                part.get("text", "")
-                for part in content
-                if isinstance(part, dict)
-            ).strip()
-        else:
-            text = str(content).strip()
-
-        if text:
-            out.append({"role": role, "content": text})
-    return out
-
-
-def stream_text_chunks(messages, min_len=30, max_len=120):
-    chat_messages = to_chat_messages(messages)
-    buffer = ""
-    stream = client.chat.completions.create(
-        model=MODEL,
-        messages=chat_messages,
-        temperature=1.0,
-        top_p=1.0,
-        stream=True,
-        max_tokens=1024,
-    )
-
-    for part in stream:
-        delta = part.choices[0].delta.content
-        if not delta:
-            continue
+def stream_text_chunks(messages, min_len=30, max_len=120, cancel_event=None, timeline=None):
+    chunker = TextChunker(min_len=min_len, max_len=max_len)
 
-        buffer += delta
+    for delta in llm.stream(build_context(messages), cancel_event=cancel_event):
+        if timeline is not None:
+            timeline.mark("llm_first_token")
 
-        # On coupe en morceaux pour TTS (ponctuation ou longueur)
-        if buffer.endswith((".", "?", "!", "…")) and len(buffer) >= min_len:
-            yield buffer.strip()
-            buffer = ""
-        elif len(buffer) >= max_len:
-            yield buffer.strip()
-            buffer = ""
+        for chunk in chunker.feed(delta):
+            if timeline is not None:
+                timeline.mark("first_chunk")
+            yield chunk
 
-    if buffer.strip():
-        yield buffer.strip()
+    if cancel_event is not None and cancel_event.is_set():
+        # barge-in: the backend already dropped the stream, don't flush the tail
+        return
+    if timeline is not None:
+        timeline.mark("llm_done")
+    for chunk in chunker.flush():
+        if timeline is not None:
+            timeline.mark("first_chunk")
+        yield chunk
 
 # ---------------------------
 # Playback worker (single-threaded sequential playback)
 # ---------------------------
 
+class OnAir:
+    """The clip the avatar is playing: when it was scheduled and how long it lasts."""
+
+    def __init__(self, public_audio_path, timeline, start_at, duration, stream=None):
+        self.public_audio_path = public_audio_path
+        self.clip_id = Path(str(public_audio_path)).name
+        self.timeline = timeline
+        self.start_at = start_at  # time.monotonic()
+        self.duration = duration
+        # WavStream still being written: the clip can't end before it's complete
+        self.stream = stream
+
+    @property
+    def open(self) -> bool:
+        return self.stream is not None and not self.stream.done.is_set()
+
+    def end(self):
+        # once the client acks the start, its clock wins over our schedule
+        started = playback_events.started_at(self.clip_id)
+        return (started if started is not None else self.start_at) + self.duration
+
+    def ended_at(self, now):
+        """When the clip ended, or None while it's still playing."""
+        acked = playback_events.ended_at(self.clip_id)
+        if acked is not None:
+            return acked
+        if self.open:
+            return None
+        end = self.end()
+        if now < end:
+            return None
+        if playback_events.active and now < end + ACK_GRACE:
+            # the client is still playing it (late fetch, buffering): wait for its ack
+            return None
+        return end
+
+
 class PlaybackWorker:
     def __init__(self):
-        # queue items are tuples: (public_audio_path (Path), expression (str), assistant_text (str), duration (float))
+        # queue items are tuples: (public_audio_path (Path), expression (str), assistant_text (str), duration (float seconds), timeline)
+        # duration may also be a WavStream for clips that are still being synthesized
         self.q = Queue()
         self.thread = Thread(target=self._run, daemon=True)
         self._running = False
@@ -193,15 +281,24 @@ class PlaybackWorker:
         self.queue_finished_event.set()  # Start as finished (no items)
         # flag to indicate whether the avatar is currently in the "talking" animation state
         self._talking = False
+        # flag set while a chunk is being played (queue may be empty during the last chunk)
+        self._playing = False
+        # put on the queue by interrupt() to cut the current chunk short
+        self._wake = object()
+        # put on the queue for every playback ack from the client, same purpose
+        self._ack = object()
+        playback_events.on_ack = lambda kind: self.q.put(self._ack)
+        # put on the queue when a streamed clip on air is complete
+        self._stream_done = object()
 
     def start(self):
         if not self._running:
             self._running = True
             self.thread.start()
 
-    def enqueue(self, public_audio_path: Path, expression: str, assistant_text: str, duration: float):
+    def enqueue(self, public_audio_path: Path, expression: str, assistant_text: str, duration: float, timeline=None):
         self.queue_finished_event.clear()  # NEW: Mark queue as not finished
-        self.q.put((public_audio_path, expression, assistant_text, duration))
+        self.q.put((public_audio_path, expression, assistant_text, duration, timeline))
 
     def wait_until_finished(self, timeout=None):
         """
@@ -214,77 +311,412 @@ class PlaybackWorker:
             True if queue finished, False if timeout occurred
         """
         return self.queue_finished_event.wait(timeout)
+
+    def is_playing(self):
+        return self._playing
+
+    def interrupt(self):
+        """Drop every queued chunk and stop waiting on the current one (barge-in)."""
+        while True:
+            try:
+                item = self.q.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                # keep the stop sentinel
+                self.q.put(None)
+                break
+            if item not in (self._wake, self._ack, self._stream_done):
+                store.release(item[0])
+        self.q.put(self._wake)
+        if not self._playing:
+            self.queue_finished_event.set()
     
     def _run(self):
+        # Clips are placed on a monotonic timeline: each one starts where the previous
+        # one ends, whatever time the cues took to send, so lateness doesn't pile up
+        # over a long reply. Its cue goes out CUE_LEAD early; until then it waits in
+        # `upcoming`. When the client acks playback, playback_started moves the
+        # timeline and playback_ended is what ends a clip (see OnAir).
+        on_air = None
+        upcoming = deque()
         while True:
-            item = self.q.get()
+            now = time.monotonic()
+            if on_air is not None and on_air.stream is not None and not on_air.open:
+                # streamed clip complete: now we know how long it is
+                self._stream_complete(on_air)
+            if on_air is not None:
+                ended_at = on_air.ended_at(now)
+                if ended_at is not None:
+                    self._clip_ended(on_air, ended_at)
+                    on_air = None
+                    if not upcoming:
+                        self._went_silent()
+            if upcoming and (on_air is None or (not on_air.open and now >= on_air.end() - CUE_LEAD)):
+                start_at = now
+                if on_air is not None:
+                    # back to back: the previous clip counts as done once the next one is cued
+                    start_at = max(now, on_air.end())
+                    self._clip_ended(on_air, start_at)
+                on_air = self._cue(upcoming.popleft(), start_at)
+                continue
+
+            # sleep until the next cue is due or the clip on air should end
+            timeout = None
+            if on_air is not None and on_air.open:
+                # woken by _stream_done; the timeout is only a safety net
+                timeout = 0.5
+            elif on_air is not None:
+                end = on_air.end()
+                if upcoming:
+                    deadline = end - CUE_LEAD
+                else:
+                    deadline = end if now < end else end + ACK_GRACE
+                timeout = max(0.0, deadline - now)
+            try:
+                item = self.q.get(timeout=timeout)
+            except Empty:
+                continue
             if item is None:
                 break
-            public_audio_path, expression, assistant_text, duration = item
+            if item is self._stream_done:
+                continue
+            if item is self._ack:
+                if on_air is None and not upcoming:
+                    self._went_silent()
+                continue
+            if item is self._wake:
+                # barge-in: drop what's waiting and cut whatever is on air now
+                while upcoming:
+                    store.release(upcoming.popleft()[0])
+                if on_air is not None:
+                    self._clip_ended(on_air, time.monotonic())
+                    on_air = None
+                self._went_silent()
+                continue
+            self._playing = True
+            upcoming.append(item)
+
+    def _cue(self, item, start_at) -> OnAir:
+        public_audio_path, expression, assistant_text, duration, timeline = item
+
+        # Start the talking animation once when the first chunk of a sequence begins.
+        # Subsequent chunks won't retrigger the animation (avoids jump/cut).
+        try:
+            if not self._talking:
+                thinking_anim = Path("animations/mixamo") / "Talking.fbx"
+                vrm_animate("start_mixamo", str(thinking_anim))
+                set_vrm_state("talking")
+                self._talking = True
+        except Exception as e:
+            print("vrm_animate (start talking) failed:", e)
+
+        # a streamed clip's length is only known once SoVITS has sent the last byte:
+        # the run loop is woken then, and the client gets the real duration
+        stream = duration if isinstance(duration, WavStream) else None
+        if stream is not None:
+            duration = stream.known_duration()
+            if duration is None:
+                duration = len(assistant_text or "") * SECONDS_PER_CHAR
+            else:
+                stream = None
 
-            # Start the talking animation once when the first chunk of a sequence begins.
-            # Subsequent chunks won't retrigger the animation (avoids jump/cut).
-            try:
-                if not self._talking:
-                    thinking_anim = Path("animations/mixamo") / "Talking.fbx"
-                    vrm_animate("start_mixamo", str(thinking_anim))
-                    set_vrm_state("talking")
-                    self._talking = True
-            except Exception as e:
-                print("vrm_animate (start talking) failed:", e)
+        # Call vrm_talk for every chunk so the client receives the audio cue + metadata
+        store.playing(public_audio_path)
+        clip = OnAir(public_audio_path, timeline, start_at, duration, stream=stream)
+        try:
+            vrm_talk(str(public_audio_path), expression, assistant_text, round(duration, 3),
+                     start_in=round(max(0.0, start_at - time.monotonic()), 3), clip_id=clip.clip_id)
+        except Exception as e:
+            print("vrm_talk failed:", e)
+        if timeline is not None:
+            timeline.mark("first_talk_cue")
+        if stream is not None:
+            stream.add_done_callback(lambda _: self.q.put(self._stream_done))
+        return clip
+
+    def _stream_complete(self, on_air: OnAir):
+        on_air.duration = on_air.stream.duration()
+        on_air.stream = None
+        try:
+            vrm_clip_duration(on_air.clip_id, round(on_air.duration, 3))
+        except Exception as e:
+            print("vrm_clip_duration failed:", e)
 
-            # Call vrm_talk for every chunk so the client receives the audio cue + metadata
-            try:
-                vrm_talk(str(public_audio_path), expression, assistant_text, int(duration))
-            except Exception as e:
-                print("vrm_talk failed:", e)
+    def _clip_ended(self, on_air: OnAir, at):
+        store.played(on_air.public_audio_path)
+        if on_air.timeline is not None:
+            on_air.timeline.mark("playback_end", once=False, at=at)
 
-            # wait for the audio's duration so we don't overlap
-            try:
-                time.sleep(duration)
-            except Exception:
-                # defensive
-                time.sleep(max(0.2, duration))
+    def _went_silent(self):
+        # Nothing on air and nothing waiting: return to idle and clear the talking flag.
+        # This ensures a smooth transition back to idle at the end of the final chunk.
+        self._playing = False
+        if self.q.empty():
+            self.queue_finished_event.set()
+            self._talking = False
+
+    def stop(self):
+        self.q.put(None)
+        self.thread.join()
 
-            # If the queue is empty after finishing this chunk, return to idle and clear talking flag.
-            # This ensures a smooth transition back to idle at the end of the final chunk.
+# ---------------------------
+# Synthesis worker (concurrent TTS, in-order hand-off to playback)
+# ---------------------------
+
+class SynthesisWorker:
+    """
+    Runs sovits_gen for incoming chunks on a small thread pool so the LLM stream
+    never waits on TTS, then hands finished clips to the PlaybackWorker strictly
+    in the order the chunks were submitted.
+
+    With reply_stream, the clips of a reply are appended to one ReplyStream instead,
+    which goes to playback as a single item; end_reply() closes it.
+    """
+
+    def __init__(self, playback: PlaybackWorker, max_workers: int = 2, streaming: bool = False,
+                 reply_stream: bool = False):
+        self.playback = playback
+        self.streaming = streaming
+        self.reply_stream = reply_stream
+        # the ReplyStream of the reply in flight (reply_stream mode)
+        self._reply = None
+        # put on the queue by end_reply()
+        self._end = object()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sovits")
+        # queue items are tuples: (future, expression (str), assistant_text (str), stream (WavStream or None), cancel_event, timeline)
+        self.q = Queue()
+        self.thread = Thread(target=self._run, daemon=True)
+        self._running = False
+        self._pending = 0
+        self._lock = Lock()
+        self.idle_event = Event()
+        self.idle_event.set()
+        # one cancel event per reply; cancel() sets it and starts a fresh one
+        self._cancel_event = Event()
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.thread.start()
+
+    def submit(self, chunk: str, expression: str, timeline=None, audio: bytes = None, on_audio=None):
+        """
+        Queue a chunk for synthesis. `audio` (WAV bytes from the response cache) skips
+        SoVITS; `on_audio(data)` receives the synthesized WAV for the response cache.
+        """
+        with self._lock:
+            self._pending += 1
+            self.idle_event.clear()
+        # playback is "busy" from the moment a chunk is accepted, not when its audio is ready
+        self.playback.queue_finished_event.clear()
+        cancel_event = self._cancel_event
+        if audio is not None and self.reply_stream:
+            stream = None
+            future = Future()
+            future.set_result(audio)
+        elif audio is not None:
+            stream = None
+            future = self.pool.submit(replay_clip, audio)
+        elif self.reply_stream:
+            stream = None
+            future = self.pool.submit(synthesize_chunk_audio, chunk, cancel_event, timeline, on_audio)
+        elif self.streaming:
+            stream = WavStream(store.new_clip().path)
+            future = self.pool.submit(synthesize_chunk_streaming, chunk, stream, cancel_event, timeline, on_audio)
+        else:
+            stream = None
+            future = self.pool.submit(synthesize_chunk, chunk, cancel_event, timeline, on_audio)
+        self.q.put((future, expression, chunk, stream, cancel_event, timeline))
+
+    def end_reply(self):
+        """No more chunks for this reply: in reply_stream mode, close its stream once they're in."""
+        if not self.reply_stream:
+            return
+        with self._lock:
+            self._pending += 1
+            self.idle_event.clear()
+        self.q.put(self._end)
+
+    def cancel(self):
+        """Abort every chunk not yet handed to playback (barge-in)."""
+        self._cancel_event.set()
+        self._cancel_event = Event()
+        # playback may be waiting for the end of the reply stream
+        self._finish_reply(error=TTSCancelled("reply cut"))
+
+    def wait_until_finished(self, timeout=None):
+        """Wait until every submitted chunk has been synthesized and handed to playback."""
+        return self.idle_event.wait(timeout)
+
+    def _run(self):
+        while True:
+            item = self.q.get()
+            if item is None:
+                break
             try:
-                if self.q.empty():
-                    self.queue_finished_event.set()
-                    idle_path = Path("animations/mixamo") / "Idle.fbx"
-                    #vrm_animate("start_mixamo", str(idle_path))
-                    self._talking = False
+                if item is self._end:
+                    self._finish_reply()
+                    continue
+                future, expression, chunk, stream, cancel_event, timeline = item
+                # wait for this chunk, but give up as soon as its reply is cancelled
+                while not future.done() and not cancel_event.is_set():
+                    futures_wait([future], timeout=0.05)
+                if cancel_event.is_set():
+                    if stream is not None:
+                        store.release(stream.path)
+                    elif not future.cancel() and not self.reply_stream:
+                        # already synthesizing: drop the clip once it's written
+                        future.add_done_callback(release_clip)
+                    continue
+                if stream is not None:
+                    # hand over as soon as the header is in; playback waits for the rest
+                    if not stream.wait_ready():
+                        raise stream.error or RuntimeError("SoVITS stream ended without audio")
+                    if timeline is not None:
+                        timeline.mark("tts_first_done")
+                    self.playback.enqueue(f"{AUDIO_STREAM_URL}/{stream.path.name}", expression, chunk, stream, timeline)
+                elif self.reply_stream:
+                    self._append_to_reply(future.result(), expression, chunk, cancel_event, timeline)
+                else:
+                    public_out, duration = future.result()
+                    if timeline is not None:
+                        timeline.mark("tts_first_done")
+                    self.playback.enqueue(public_out, expression, chunk, duration, timeline)
+            except TTSCancelled:
+                pass
             except Exception as e:
-                print("vrm_animate (idle) failed:", e)
+                print("sovits_gen failed for chunk:", e)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if self._pending == 0:
+                        self.idle_event.set()
+                        if self.playback.q.empty() and not self.playback.is_playing():
+                            self.playback.queue_finished_event.set()
+
+    def _append_to_reply(self, data, expression, chunk, cancel_event, timeline):
+        with self._lock:
+            if cancel_event.is_set():
+                return
+            reply = self._reply
+            first = reply is None
+            if first:
+                reply = self._reply = ReplyStream(store.new_clip().path)
+        start = reply.append(data)
+        if start is None:
+            # cut while appending
+            return
+        if first:
+            if timeline is not None:
+                timeline.mark("tts_first_done")
+            # one talk cue for the whole reply; the text goes with the markers
+            self.playback.enqueue(f"{AUDIO_STREAM_URL}/{reply.path.name}", expression, "", reply, timeline)
+        try:
+            vrm_reply_marker(reply.path.name, round(start, 3), chunk, expression, round(wav_duration(data), 3))
+        except Exception as e:
+            print("vrm_reply_marker failed:", e)
+
+    def _finish_reply(self, error=None):
+        with self._lock:
+            reply, self._reply = self._reply, None
+        if reply is None:
+            return
+        reply.finish(error)
+        if reply.info is not None:
+            store.finished(reply.path, reply.duration())
+        else:
+            # nothing was ever cued
+            store.release(reply.path)
 
     def stop(self):
         self.q.put(None)
         self.thread.join()
+        self.pool.shutdown(wait=False, cancel_futures=True)
 
 # ---------------------------
 # Utilities
 # ---------------------------
 
 def ensure_dirs():
-    Path('client/audio').mkdir(parents=True, exist_ok=True)
+    store.ensure_dir()
     Path('audio').mkdir(parents=True, exist_ok=True)
+    # clips copied into audio/ by older versions are cleaned up like any played clip
+    store.adopt('audio')
+
+
+def release_clip(future):
+    """Done-callback for a synthesis future whose reply was cut before playback."""
+    if not future.cancelled() and future.exception() is None:
+        store.release(future.result()[0])
+
+
+def replay_clip(data: bytes):
+    """Write a clip from the response cache and return (audio_url, duration)."""
+    clip = store.put(data)
+    return clip.url, clip.duration
+
 
+def synthesize_chunk(chunk: str, cancel_event=None, timeline=None, on_audio=None):
+    """Generate TTS for one chunk and return (audio_url, duration)."""
+    data = synthesize_chunk_audio(chunk, cancel_event, timeline, on_audio)
+    clip = store.put(data)
+    return clip.url, clip.duration
 
-def copy_to_public(client_path: Path, public_path: Path):
-    # Copy the client audio file to the public folder that vrm_talk expects
-    shutil.copy2(client_path, public_path)
 
-# Fallback duration reader (if you don't have one)
+def synthesize_chunk_audio(chunk: str, cancel_event=None, timeline=None, on_audio=None) -> bytes:
+    """Generate TTS for one chunk and return its WAV bytes, ready to play."""
+    tts_read_text = clean_llm_output(chunk)
 
-def fallback_get_wav_duration(p: Path):
+    # generate TTS (blocking in this worker thread); the clip stays in memory until
+    # the store writes it, and its duration comes from those same bytes
+    started = time.monotonic()
+    data = sovits_bytes(tts_read_text, cancel_event=cancel_event, timeline=timeline)
+    if timeline is not None:
+        timeline.record("tts", time.monotonic() - started)
+    # no dead air between sentences, same level for every chunk
+    data, post = post_process(data)
+    if timeline is not None:
+        timeline.record("silence_trimmed", post.trimmed)
+    if on_audio is not None:
+        on_audio(data)
+    return data
+
+
+def synthesize_chunk_streaming(chunk: str, stream: WavStream, cancel_event=None, timeline=None, on_audio=None):
+    """Generate TTS for one chunk, writing progressively into stream.path."""
+    tts_read_text = clean_llm_output(chunk)
+    started = time.monotonic()
     try:
-        import wave, contextlib
-        with contextlib.closing(wave.open(str(p),'r')) as wf:
-            frames = wf.getnframes()
-            rate = wf.getframerate()
-            return frames / float(rate)
-    except Exception:
-        return 3.0
+        sovits_gen(tts_read_text, output_wav_pth=str(stream.path), stream=stream,
+                   cancel_event=cancel_event, timeline=timeline)
+    except Exception as e:
+        stream.finish(error=e)
+        store.finished(stream.path)
+        raise
+    if timeline is not None:
+        timeline.record("tts", time.monotonic() - started)
+    store.finished(stream.path, stream.known_duration())
+    if on_audio is not None:
+        with suppress(OSError):
+            on_audio(stream.path.read_bytes())
+    return stream
+
+
+def wait_for_reply(synthesis: SynthesisWorker, playback: PlaybackWorker, interrupted: Event, poll=0.05):
+    """Block until the reply has been fully played, or until the user barges in."""
+    while not interrupted.is_set():
+        if synthesis.wait_until_finished(poll) and playback.wait_until_finished(poll):
+            return True
+    return False
+
+def load_whisper_model():
+    from faster_whisper import WhisperModel
+
+    gpu_mode = char_config.get("gpu_acceleration", "cpu")  # dans ton character_config.yaml :contentReference[oaicite:5]{index=5}
+    if gpu_mode.lower() == "cuda":
+        return WhisperModel("small", device="cuda", compute_type="float16")
+    return WhisperModel("small", device="cpu", compute_type="int8")
 
 # ---------------------------
 # Main orchestration
@@ -296,25 +728,73 @@ def main_loop():
     playback = PlaybackWorker()
     playback.start()
 
+    synthesis = SynthesisWorker(
+        playback,
+        # enough workers to keep every SoVITS instance of the pool busy
+        max_workers=int(os.getenv("TTS_WORKERS", str(sovits_pool.capacity))),
+        streaming=STREAMING_TTS and not REPLY_STREAM,
+        reply_stream=REPLY_STREAM,
+    )
+
+    barge_in = Event()
+
+    def interrupt_reply():
+        # runs on the detector's helper thread while the main thread streams the LLM
+        print("\n✋ Barge-in: user is speaking, cutting the reply")
+        barge_in.set()
+        synthesis.cancel()
+        playback.interrupt()
+        try:
+            vrm_stop_audio()
+        except Exception as e:
+            print("vrm_stop_audio failed:", e)
+
+    dev_env = os.getenv("AUDIO_INPUT_DEVICE", "").strip()
+    detector = None
+    if BARGE_IN and os.getenv("ASR_MODE", "speech").lower() != "text":
+        detector = SpeechDetector(
+            on_speech=interrupt_reply,
+            silence_threshold=float(os.getenv("BARGE_IN_THRESHOLD", "0.02")),
+            min_speech=float(os.getenv("BARGE_IN_MIN_SPEECH", "0.3")),
+            device=int(dev_env) if dev_env.isdigit() else None,
+        )
+    synthesis.start()
+    # voice reference registered once per SoVITS instance, not sent with every chunk
+    Thread(target=sovits_set_default_reference, daemon=True).start()
+
     # Load any models or tokenizers you have for emotion detection here
     # whisper_model, emotion_model, tokenizer = load_your_models()
 
-    from faster_whisper import WhisperModel
-
-    gpu_mode = char_config.get("gpu_acceleration", "cpu")  # dans ton character_config.yaml :contentReference[oaicite:5]{index=5}
-    if gpu_mode.lower() == "cuda":
-        whisper_model = WhisperModel("small", device="cuda", compute_type="float16")
-    else:
-        whisper_model = WhisperModel("small", device="cpu", compute_type="int8")
+    text_mode = os.getenv("ASR_MODE", "speech").lower() == "text"
+    whisper_model = None if text_mode else load_whisper_model()
 
+    # latency timeline of the turn in flight, written once its reply is done
+    timeline = None
+    # (recording, reply text) for the response cache, stored if the reply plays to the end
+    cache_candidate = None
 
     while True:
 
         try:
 
             print("\n⏳ Waiting for playback queue to finish...")
-            playback.wait_until_finished()
-            print("✅ Queue finished, ready for input")
+            wait_for_reply(synthesis, playback, barge_in)
+            if detector is not None:
+                detector.stop()
+            if timeline is not None:
+                timeline.interrupted = barge_in.is_set()
+                timeline.write()
+                timeline = None
+            if cache_candidate is not None and not barge_in.is_set():
+                response_cache.put(*cache_candidate)
+            cache_candidate = None
+            if barge_in.is_set():
+                print("✅ Reply interrupted, listening")
+                barge_in.clear()
+            else:
+                print("✅ Queue finished, ready for input")
+            # the LLM is idle while the user speaks: get the prompt prefix cached
+            prefill_prompt()
             # 1) Idle animation + state 
             # try:
             idle_anim = Path("animations/mixamo") / "Idle.fbx"
@@ -333,7 +813,7 @@ def main_loop():
 
             # baisse le seuil (0.02 est souvent trop haut)
             silence_threshold = float(os.getenv("ASR_SILENCE_THRESHOLD", "0.005"))
-            if os.getenv("ASR_MODE","speech").lower() == "text":
+            if text_mode:
                 user_spoken_text = input("Toi: ")
             else:
                 record_on_speech(
@@ -342,8 +822,10 @@ def main_loop():
                     channels=1,
                     silence_threshold=silence_threshold,
                     silence_duration=2,
-                    device=2,
+                    device=device,
                 )
+            # t0 of the turn: the user has stopped speaking
+            timeline = TurnTimeline()
             # record while listening sorry I don't think this works I'll have to work on it later. 
             # set_vrm_state("listening")
 
@@ -357,16 +839,20 @@ def main_loop():
                 pass
 
             # 4) Transcribe
-            user_spoken_text = transcribe_audio(whisper_model, aud_path=conversation_recording)
+            if not text_mode:
+                with timeline.span("transcribe"):
+                    user_spoken_text = transcribe_audio(whisper_model, aud_path=conversation_recording)
+            timeline.mark("transcribed")
 
             # 5) Build messages history
             messages = load_history()
-            messages.append({
+            user_message = {
                 "role": "user",
                 "content": [
                     {"type": "input_text", "text": user_spoken_text}
                 ]
-            })
+            }
+            messages.append(user_message)
 
             # 6) Stream model and generate TTS per chunk
             print("[llm] streaming response...")
@@ -375,65 +861,61 @@ def main_loop():
             # set_vrm_state("talking")
             full_assistant_text = ""
 
-            for chunk in stream_text_chunks(messages):
+            # keep an ear open while Riko answers
+            if detector is not None:
+                detector.start()
+
+            cached = response_cache.lookup(user_spoken_text)
+            if cached is not None:
+                print(f"[response cache] replaying the reply to {cached.key!r}")
+                timeline.mark("response_cache_hit")
+                recording = None
+                chunks = iter(cached.chunks)
+            else:
+                recording = response_cache.record(user_spoken_text)
+                chunks = ((chunk, None) for chunk in stream_text_chunks(messages, cancel_event=barge_in, timeline=timeline))
+
+            for chunk, audio in chunks:
+                if barge_in.is_set():
+                    break
                 print("[chunk]", chunk)
 
                 # accumulate final text
                 full_assistant_text += (chunk + " ")
 
-                # prepare TTS text and emotion
-                tts_read_text = clean_llm_output(chunk)
                 # emotion = get_emotion(chunk, None, None)  # plug your emotion model/tokenizer
                 # expression = map_emotion_to_expression(emotion)
                 # temp implementation
                 emotion = "relaxed"   # or "smug" etc.
                 expression = "relaxed" 
 
-                # create unique filename for this chunk
-                uid = uuid.uuid4().hex
-                filename = f"output_{uid}.wav"
-                client_out = Path('client') / 'audio' / filename
-                public_out = Path('audio') / filename
-                client_out.parent.mkdir(parents=True, exist_ok=True)
-
-                # generate TTS (blocking). Expected to write client_out
-                try:
-                    sovits_gen(tts_read_text, output_wav_pth=str(client_out))
-                except TypeError:
-                    # fallback if your function signature is sovits_gen(text, emotion, output_path)
-                    sovits_gen(tts_read_text, str(client_out))
-
-                # copy to public path expected by VRM bridge
-                copy_to_public(client_out, public_out)
-
-                # determine duration
-                try:
-                    duration = get_wav_duration(public_out)
-                except Exception:
-                    duration = fallback_get_wav_duration(public_out)
-
-                # enqueue for sequential playback
-                playback.enqueue(public_out, expression, chunk, duration)
+                # hand off to the synthesis pool; playback order follows submission order
+                on_audio = recording.add(chunk) if recording is not None else None
+                synthesis.submit(chunk, expression, timeline=timeline, audio=audio, on_audio=on_audio)
+            synthesis.end_reply()
 
             # 7) After streaming ends, append the full assistant message to history and save
             final_text = full_assistant_text.strip()
             print("[llm final]", final_text)
 
-            # append assistant to messages and save history
-            messages.append({
+            # log the turn (user + assistant)
+            append_history(user_message, {
                 "role": "assistant",
                 "content": [
                     {"type": "output_text", "text": final_text}
                 ]
             })
-            save_history(messages)
-
-            # Optionally wait a short moment for queued audio to finish playing before next loop
-            # NOTE: playback worker will ensure queued audio plays sequentially; here we don't block.
-            time.sleep(0.1)
+            if recording is not None and not barge_in.is_set():
+                cache_candidate = (recording, final_text)
 
         except KeyboardInterrupt:
             print("Interrupted by user, stopping.")
+            if timeline is not None:
+                timeline.interrupted = True
+                timeline.write()
+            if detector is not None:
+                detector.stop()
+            synthesis.stop()
             playback.stop()
             break
         except Exception as e:
@@ -5,6 +5,7 @@ import numpy as np
 import soundfile as sf
 import queue
 import sys
+import threading
 from scipy.io.wavfile import read
 from faster_whisper import WhisperModel
 import yaml
@@ -92,6 +93,62 @@ def record_on_speech(output_file="conversation.wav", samplerate=44100, channels=
 
 
 
+class SpeechDetector:
+    """
+    Watches the microphone in the background and calls on_speech() once the input level
+    stays above silence_threshold for min_speech seconds. Used for barge-in while Riko
+    is talking, so the threshold should sit above the level of her voice in the room.
+
+    Args:
+        on_speech (callable): Called once (from a helper thread) per start()/stop() cycle.
+        samplerate (int): Sampling rate in Hz. Default is 16000 (only levels are used).
+        silence_threshold (float): RMS level counted as speech. Default is 0.02.
+        min_speech (float): Seconds of continuous speech before firing. Default is 0.3.
+        device (int or str): Input device ID or name. Default is None (system default).
+    """
+
+    def __init__(self, on_speech, samplerate=16000, silence_threshold=0.02, min_speech=0.3, device=None):
+        self.on_speech = on_speech
+        self.samplerate = samplerate
+        self.silence_threshold = silence_threshold
+        self.min_speech = min_speech
+        self.device = device
+        self._stream = None
+        self._voiced_time = 0.0
+        self._fired = False
+
+    def _callback(self, indata, frames, time, status):
+        if self._fired:
+            return
+        rms = np.sqrt(np.mean(np.square(indata)))
+        if rms > self.silence_threshold:
+            self._voiced_time += frames / self.samplerate
+        else:
+            self._voiced_time = 0.0
+        if self._voiced_time >= self.min_speech:
+            self._fired = True
+            # never block the audio callback with the caller's work
+            threading.Thread(target=self.on_speech, daemon=True).start()
+
+    def start(self):
+        if self._stream is not None:
+            return
+        self._voiced_time = 0.0
+        self._fired = False
+        self._stream = sd.InputStream(samplerate=self.samplerate, device=self.device,
+                                      channels=1, callback=self._callback)
+        self._stream.start()
+
+    def stop(self):
+        if self._stream is None:
+            return
+        try:
+            self._stream.stop()
+            self._stream.close()
+        finally:
+            self._stream = None
+
+
 def record_push_to_talk(model, output_file="conversation.wav", samplerate=44100):
     """
     Simple push-to-talk recorder: record -> save -> transcribe -> return text
@@ -0,0 +1,224 @@
+# context_window.py - what part of the history is sent to the LLM each turn
+#
+# Sending the whole conversation makes the prompt (and the prefill before the first
+# token) grow with every turn. ContextWindow keeps:
+#   system prompt (+ a summary of older turns) + the most recent messages that fit
+#   in CONTEXT_TOKENS
+#
+# - token counts are estimated once per message and cached. With CONTEXT_TOKENIZER
+#   pointing at the model's tokenizer.json (HF `tokenizers`) they are exact, otherwise
+#   ~CHARS_PER_TOKEN characters count as one token.
+# - the window start only moves when the budget is exceeded, and then it jumps so the
+#   window is back to CONTEXT_TRIM of the budget: the prompt prefix stays the same for
+#   several turns, which keeps the server's prompt cache useful.
+# - messages that fall out of the window are folded into a running summary by a
+#   background thread (CONTEXT_SUMMARY=0 to disable). The summary is saved next to the
+#   history log and sent in its own message after the system prompt, so a new summary
+#   leaves the system prompt's cached prefix untouched.
+# - the window start and the end of the summary are positions in the whole conversation
+#   (HistoryStore.position()), not message contents: the same "ok" shows up many times.
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "3000"))
+CONTEXT_TRIM = float(os.getenv("CONTEXT_TRIM", "0.7"))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "")
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))
+CONTEXT_SUMMARY = os.getenv("CONTEXT_SUMMARY", "1").lower() in ("1", "true", "yes")
+# don't call the LLM for fewer dropped messages than this
+SUMMARY_MIN_MESSAGES = int(os.getenv("SUMMARY_MIN_MESSAGES", "8"))
+# per-message overhead of the chat template (<|im_start|>role ... <|im_end|>)
+MESSAGE_OVERHEAD = 4
+
+
+def message_text(message) -> str:
+    """Plain text of a message whose content is a string or a list of {"type", "text"} blocks."""
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict)).strip()
+    return str(content).strip()
+
+
+class TokenCounter:
+    """Token count per text, cached (LRU) so each message is only tokenized once."""
+
+    def __init__(self, tokenizer_path=CONTEXT_TOKENIZER, cache_size=8192):
+        self.tokenizer = None
+        if tokenizer_path:
+            try:
+                from tokenizers import Tokenizer
+                self.tokenizer = Tokenizer.from_file(tokenizer_path)
+            except Exception as e:
+                print(f"[context] can't load tokenizer {tokenizer_path} ({e}), estimating from length")
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            n = self._cache.get(text)
+            if n is not None:
+                self._cache.move_to_end(text)
+                return n
+        if self.tokenizer is not None:
+            n = len(self.tokenizer.encode(text).ids)
+        else:
+            n = int(len(text) / CHARS_PER_TOKEN) + 1
+        with self._lock:
+            self._cache[text] = n
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return n
+
+    def message(self, message) -> int:
+        return self.count(message_text(message)) + MESSAGE_OVERHEAD
+
+
+class ContextWindow:
+    """
+    Build the messages sent to the LLM from the full history.
+
+    `summarize(previous_summary, messages) -> str` is called from a background thread
+    to fold dropped messages into the summary; without it older turns are just dropped.
+    """
+
+    def __init__(self, summarize=None, summary_file=None, budget=CONTEXT_TOKENS, trim=CONTEXT_TRIM,
+                 counter=None, min_summary=SUMMARY_MIN_MESSAGES):
+        self.summarize = summarize if CONTEXT_SUMMARY else None
+        self.summary_file = Path(summary_file) if summary_file else None
+        self.budget = budget
+        self.trim = trim
+        self.counter = counter or TokenCounter()
+        self.min_summary = min_summary
+        # summary of the conversation up to (and including) the message at position `summary_upto`
+        self.summary = ""
+        self.summary_upto = None
+        # position of the first message of the window, kept until the budget forces a move
+        self._window_start = None
+        self._dropped = []
+        self._dropped_upto = None
+        self._lock = threading.Lock()
+        self._worker = None
+        self._load_summary()
+
+    # ---------------------------
+    # Building the prompt
+    # ---------------------------
+
+    def build(self, messages, first_index=0) -> list:
+        """
+        System message(s), the summary in a message of its own, then the recent messages
+        that fit in the budget.
+
+        `first_index` is the position in the whole conversation of the first non-system
+        message (HistoryStore.position() when the messages come from its tail()).
+        """
+        system = [m for m in messages if m.get("role") == "system"]
+        convo = [m for m in messages if m.get("role") != "system"]
+        sizes = [self.counter.message(m) for m in convo]
+        # the last message (the new turn) is the only one the summary can't cover
+        last = first_index + len(convo) - 1
+
+        # one build at a time (main loop and prefill thread): the window start read
+        # here and the one written back below must belong to the same build
+        with self._lock:
+            if self.summary_upto is not None and self.summary_upto >= last:
+                # the history is shorter than what was summarized: it was reset
+                print("[context] the history was reset, dropping the summary")
+                self.summary, self.summary_upto = "", None
+                self._window_start = None
+            summary = self.summary
+            summarized = 0 if self.summary_upto is None else max(0, self.summary_upto + 1 - first_index)
+            window_start = self._window_start
+
+            budget = self.budget - sum(self.counter.message(m) for m in system)
+            if summary:
+                budget -= self.counter.count(summary) + MESSAGE_OVERHEAD
+
+            start = 0 if window_start is None else min(max(0, window_start - first_index), max(len(convo) - 1, 0))
+            # never resend what the summary already covers
+            start = max(start, summarized)
+            if sum(sizes[start:]) > budget:
+                # over budget: move the start so the window is back to `trim` of the budget
+                target, total, start = budget * self.trim, 0, len(convo)
+                while start > 0 and total + sizes[start - 1] <= target:
+                    start -= 1
+                    total += sizes[start]
+                # the window should open on a user turn
+                while start < len(convo) - 1 and convo[start].get("role") != "user":
+                    start += 1
+                # always keep the latest message, even over budget
+                start = min(start, max(len(convo) - 1, 0))
+
+            self._window_start = first_index + start if convo else None
+            # dropped messages the summary doesn't cover yet
+            self._dropped = convo[summarized:start]
+            self._dropped_upto = first_index + start - 1
+
+        # the system prompt stays byte-identical; the summary changes now and then, so
+        # it goes after it and only invalidates the cache from there on
+        out = [dict(m) for m in system]
+        if summary:
+            out.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        return out + convo[start:]
+
+    # ---------------------------
+    # Background summary
+    # ---------------------------
+
+    def update_summary_async(self):
+        """Fold the messages dropped by the last build() into the summary, off the hot path."""
+        if self.summarize is None:
+            return
+        with self._lock:
+            if len(self._dropped) < self.min_summary:
+                return
+            if self._worker is not None and self._worker.is_alive():
+                return
+            dropped, upto, previous = list(self._dropped), self._dropped_upto, self.summary
+            self._worker = threading.Thread(target=self._update_summary, args=(previous, dropped, upto), daemon=True)
+            self._worker.start()
+
+    def _update_summary(self, previous, dropped, upto):
+        try:
+            summary = (self.summarize(previous, dropped) or "").strip()
+        except Exception as e:
+            print(f"[context] summary failed: {e}")
+            return
+        if not summary:
+            return
+        with self._lock:
+            self.summary = summary
+            self.summary_upto = upto
+            self._dropped = []
+        self._save_summary()
+        print(f"[context] summarized {len(dropped)} older messages")
+
+    def _load_summary(self):
+        if self.summary_file is None or not self.summary_file.exists():
+            return
+        try:
+            with open(self.summary_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            upto = data.get("upto")
+            if not isinstance(upto, int):
+                # older format (keyed by message content): start a new summary
+                print(f"[context] {self.summary_file} is in an older format, starting a new summary")
+                return
+            self.summary = data.get("summary", "")
+            self.summary_upto = upto
+        except (OSError, ValueError) as e:
+            print(f"[context] ignoring {self.summary_file}: {e}")
+
+    def _save_summary(self):
+        if self.summary_file is None:
+            return
+        with self._lock:
+            data = {"summary": self.summary, "upto": self.summary_upto}
+        tmp = self.summary_file.with_name(self.summary_file.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.summary_file)
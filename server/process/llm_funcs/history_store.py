@@ -0,0 +1,216 @@
+# history_store.py - append-only conversation log (replaces rewriting chat_history.json)
+#
+# Each message is one JSON line appended to <history_file>.jsonl, so saving a turn
+# costs one small write instead of re-serializing the whole conversation. The last
+# HISTORY_CACHE messages are kept in memory; the file is only read once per process.
+#
+# - appends are a single write() + fsync; a line torn by a crash is dropped (and cut
+#   off the file) on the next start
+# - the system prompt is not logged, it always comes from character_config.yaml
+# - compaction: once the log is bigger than HISTORY_COMPACT_MB, everything but the
+#   last HISTORY_KEEP messages (all of them with HISTORY_KEEP=0) moves to
+#   <history_file>.archive.jsonl and the log is rewritten atomically. If the log is
+#   still big afterwards (or HISTORY_KEEP messages weigh more than the limit), the next
+#   compaction waits until it has doubled, so the whole log is never re-read on every
+#   turn
+# - a compaction first writes <log>.compacting (archive and log sizes before it). If
+#   the process dies before the log was rewritten, the next start cuts the archive back
+#   to its old size, so no message ends up both in the archive and in the log
+# - an existing chat_history.json (the old format) is imported on first use and left
+#   untouched
+# - position(): index of the first cached message in the whole conversation (archive
+#   included). Messages repeat ("ok", "salut"...), so ContextWindow tracks where its
+#   window and summary stop by position, never by content
+import json
+import os
+import threading
+from collections import deque
+from pathlib import Path
+
+HISTORY_CACHE = int(os.getenv("HISTORY_CACHE", "2000"))
+HISTORY_KEEP = int(os.getenv("HISTORY_KEEP", "5000"))
+COMPACT_BYTES = int(float(os.getenv("HISTORY_COMPACT_MB", "20")) * 1024 * 1024)
+
+
+def log_path_for(history_file) -> Path:
+    """chat_history.json -> chat_history.jsonl (a .jsonl path is used as is)."""
+    path = Path(history_file)
+    return path if path.suffix == ".jsonl" else path.with_suffix(".jsonl")
+
+
+class HistoryStore:
+    def __init__(self, history_file, cache_size=HISTORY_CACHE, keep=HISTORY_KEEP, compact_bytes=COMPACT_BYTES):
+        self.legacy_path = Path(history_file)
+        self.path = log_path_for(history_file)
+        self.archive_path = self.path.with_name(self.path.stem + ".archive.jsonl")
+        self.journal_path = self.path.with_name(self.path.name + ".compacting")
+        self.keep = keep
+        self.compact_bytes = compact_bytes
+        # log size that triggers the next compaction
+        self._compact_at = compact_bytes
+        self._tail = deque(maxlen=cache_size)
+        # messages logged so far, archive included
+        self._count = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    # ---------------------------
+    # Reading
+    # ---------------------------
+
+    def _load(self):
+        if self._loaded:
+            return
+        if not self.path.exists() and self.legacy_path != self.path and self.legacy_path.exists():
+            self.import_json(self.legacy_path)
+        if self.journal_path.exists():
+            self._finish_compaction()
+        if self.path.exists():
+            messages = self._read_log()
+            self._tail.extend(messages)
+            self._count = len(messages)
+        if self.archive_path.exists():
+            self._count += self._count_lines(self.archive_path)
+        self._loaded = True
+
+    @staticmethod
+    def _count_lines(path) -> int:
+        n = 0
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                n += block.count(b"\n")
+        return n
+
+    def _read_log(self):
+        messages = []
+        good_bytes = 0
+        with open(self.path, "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # torn final append
+                try:
+                    messages.append(json.loads(raw))
+                except ValueError:
+                    break
+                good_bytes += len(raw)
+        if good_bytes < self.path.stat().st_size:
+            print(f"[history] dropping a torn line at the end of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+        return messages
+
+    def tail(self, n=None) -> list:
+        """The last n messages (all cached ones by default), oldest first, as copies."""
+        with self._lock:
+            self._load()
+            items = list(self._tail)
+        if n is not None:
+            items = items[-n:] if n > 0 else []
+        return json.loads(json.dumps(items))
+
+    def position(self, n=None) -> int:
+        """Index in the whole conversation of the first message tail(n) returns."""
+        with self._lock:
+            self._load()
+            cached = len(self._tail) if n is None else min(max(n, 0), len(self._tail))
+            return self._count - cached
+
+    # ---------------------------
+    # Writing
+    # ---------------------------
+
+    def append(self, *messages):
+        """Append messages to the log (one write, fsync'd) and to the cache."""
+        messages = [m for m in messages if m and m.get("role") != "system"]
+        if not messages:
+            return
+        data = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages).encode("utf-8")
+        with self._lock:
+            self._load()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._tail.extend(messages)
+            self._count += len(messages)
+            size = self.path.stat().st_size
+        if self.compact_bytes and size > self._compact_at:
+            self.compact()
+
+    def import_json(self, json_path):
+        """Import an old chat_history.json (a JSON list of messages) into the log."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            history = json.load(f)
+        messages = [m for m in history if isinstance(m, dict) and m.get("role") != "system"]
+        self._write_atomic(self.path, messages)
+        print(f"[history] imported {len(messages)} messages from {json_path} into {self.path}")
+
+    def compact(self):
+        """Move all but the last `keep` messages to the archive and rewrite the log."""
+        with self._lock:
+            self._load()
+            messages = self._read_log() if self.path.exists() else []
+            # keep=0 archives everything (messages[:-0] would be nothing)
+            split = max(0, len(messages) - max(self.keep, 0))
+            old, recent = messages[:split], messages[split:]
+            if old:
+                archive_bytes = self.archive_path.stat().st_size if self.archive_path.exists() else 0
+                self._write_json_atomic(self.journal_path, {
+                    "archive_bytes": archive_bytes,
+                    "log_bytes": self.path.stat().st_size,
+                })
+                with open(self.archive_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(m, ensure_ascii=False) + "\n" for m in old))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._write_atomic(self.path, recent)
+                self.journal_path.unlink()
+            # what's left is at least HISTORY_KEEP messages: don't look again before it doubles
+            size = self.path.stat().st_size if self.path.exists() else 0
+            self._compact_at = max(self.compact_bytes, 2 * size)
+        if not old:
+            return
+        print(f"[history] compacted {self.path}: {len(old)} messages archived, {len(recent)} kept")
+
+    def _finish_compaction(self):
+        """Clean up after a compaction interrupted by a crash (see compact())."""
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+            archive_bytes, log_bytes = int(journal["archive_bytes"]), int(journal["log_bytes"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # the journal itself is written atomically: this isn't ours, leave the files alone
+            print(f"[history] ignoring {self.journal_path}: {e}")
+            return
+        log_size = self.path.stat().st_size if self.path.exists() else 0
+        if log_size >= log_bytes and self.archive_path.exists():
+            # the log still holds the archived messages: undo the archive append
+            print(f"[history] interrupted compaction, restoring {self.archive_path}")
+            with open(self.archive_path, "r+b") as f:
+                f.truncate(archive_bytes)
+                f.flush()
+                os.fsync(f.fileno())
+        # else the log was rewritten (it only shrinks there): the compaction went through
+        self.journal_path.unlink()
+
+    @staticmethod
+    def _write_json_atomic(path: Path, data):
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _write_atomic(path: Path, messages):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
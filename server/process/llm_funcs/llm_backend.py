@@ -0,0 +1,184 @@
+# llm_backend.py - one streaming interface to the chat LLM for main_chat and llm_scr
+#
+# Every backend speaks the OpenAI chat completions API; LLM_BACKEND picks one:
+#   local   OPENAI_BASE_URL (llama.cpp / llama-cpp-python / vLLM server), the default
+#   openai  api.openai.com with OPENAI_API_KEY
+#   groq    api.groq.com with GROQ_API_KEY
+# LLM_MODEL overrides `model` from character_config.yaml (groq uses GROQ_MODEL).
+# LLM_ROUTE=local,groq,... spreads requests over several endpoints (llm_router.py).
+#
+# History messages are stored in the Responses format ({"type": "input_text", "text": ...}
+# blocks); they are converted to plain chat messages here and nowhere else.
+#
+# stream() yields text deltas; setting cancel_event (or closing the generator) drops
+# the HTTP stream so the server stops generating. With a cancel_event the stream is
+# read in a thread, so a barge-in stops the wait at once even if the server stalls
+# before its first byte or between tokens. LLM_CONNECT_TIMEOUT and LLM_READ_TIMEOUT
+# (max wait for the next token) bound a stuck server.
+import os
+import queue
+import threading
+
+import httpx
+import yaml
+from openai import OpenAI
+
+# the model for local/openai: LLM_MODEL, else `model` from character_config.yaml
+with open('character_config.yaml', 'r') as f:
+    MODEL = os.getenv("LLM_MODEL") or (yaml.safe_load(f) or {}).get("model")
+
+BACKENDS = {
+    "local": {
+        "base_url": os.getenv("OPENAI_BASE_URL", "http://127.0.0.1:8000/v1"),
+        "api_key_env": "OPENAI_API_KEY",
+        "model": MODEL or "Qwen2.5-7B-Instruct-Q4_K_M.gguf",
+    },
+    "openai": {
+        "base_url": "https://api.openai.com/v1",
+        "api_key_env": "OPENAI_API_KEY",
+        "model": MODEL or "gpt-4.1-mini",
+    },
+    "groq": {
+        "base_url": "https://api.groq.com/openai/v1",
+        "api_key_env": "GROQ_API_KEY",
+        "model": os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile"),
+    },
+}
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "local").lower()
+# several endpoints, fastest first with failover and hedging (see llm_router.py)
+LLM_ROUTE = os.getenv("LLM_ROUTE", "")
+TIMEOUT = httpx.Timeout(
+    float(os.getenv("LLM_READ_TIMEOUT", "60")),
+    connect=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+)
+# how often a stream waiting on the server checks its cancel_event
+CANCEL_POLL = 0.05
+# generation defaults shared by every caller
+SAMPLING = {"temperature": 1.0, "top_p": 1.0, "max_tokens": 1024}
+
+
+def to_chat_messages(history):
+    out = []
+    for m in history:
+        role = m.get("role", "user")
+        content = m.get("content", "")
+
+        # Riko stocke souvent content sous forme de liste de blocs {"type": "...", "text": "..."}
+        if isinstance(content, list):
+            text = "".join(
+                part.get("text", "")
+                for part in content
+                if isinstance(part, dict)
+            ).strip()
+        else:
+            text = str(content).strip()
+
+        if text:
+            out.append({"role": role, "content": text})
+    return out
+
+
+class LLMBackend:
+    def __init__(self, name, base_url, api_key, model, timeout=TIMEOUT):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=1)
+
+    def _request(self, messages, overrides):
+        return dict(SAMPLING, model=self.model, messages=to_chat_messages(messages), **overrides)
+
+    def stream(self, messages, cancel_event=None, **overrides):
+        """Yield the reply's text deltas. `messages` may be in chat or Responses format."""
+        if cancel_event is None:
+            yield from self._deltas(messages, None, overrides)
+            return
+
+        events = queue.Queue()
+        stop = threading.Event()
+
+        def run():
+            try:
+                for delta in self._deltas(messages, stop, overrides):
+                    events.put(("delta", delta))
+                events.put(("done", None))
+            except Exception as e:
+                events.put(("error", e))
+
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while not cancel_event.is_set():
+                try:
+                    kind, value = events.get(timeout=CANCEL_POLL)
+                except queue.Empty:
+                    continue
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            # the reader thread drops the connection as soon as the server sends something
+            # (or LLM_READ_TIMEOUT fires); we don't wait for it
+            stop.set()
+
+    def _deltas(self, messages, stop, overrides):
+        stream = self.client.chat.completions.create(stream=True, **self._request(messages, overrides))
+        try:
+            for part in stream:
+                if stop is not None and stop.is_set():
+                    # barge-in: drop the connection so the server stops generating
+                    return
+                delta = part.choices[0].delta.content if part.choices else None
+                if delta:
+                    yield delta
+        finally:
+            stream.close()
+
+    def complete(self, messages, cancel_event=None, **overrides) -> str:
+        """Whole reply as one string (still streamed underneath, so it can be cancelled)."""
+        return "".join(self.stream(messages, cancel_event=cancel_event, **overrides))
+
+
+_backends = {}
+_lock = threading.Lock()
+
+
+def get_backend(name: str = None) -> LLMBackend:
+    """
+    Return the shared backend (LLM_BACKEND by default), creating it once.
+
+    `name` is a key of BACKENDS or the base URL of another OpenAI-compatible server.
+    Without a name and with LLM_ROUTE set, this is an LLMRouter over those endpoints.
+    """
+    if name is None and LLM_ROUTE:
+        return _get_router()
+    name = name or LLM_BACKEND
+    if not name.startswith("http"):
+        name = name.lower()
+    with _lock:
+        if name not in _backends:
+            if name.startswith("http"):
+                # another server like the local one (LAN box, second GPU...)
+                cfg = dict(BACKENDS["local"], base_url=name)
+            elif name in BACKENDS:
+                cfg = BACKENDS[name]
+            else:
+                raise ValueError(f"Unknown LLM backend {name!r} (choose from {', '.join(BACKENDS)} or a URL)")
+            api_key = os.getenv(cfg["api_key_env"])
+            if not api_key:
+                raise EnvironmentError(f"Please set {cfg['api_key_env']} in your environment")
+            _backends[name] = LLMBackend(name, cfg["base_url"], api_key, cfg["model"])
+        return _backends[name]
+
+
+_router = None
+
+
+def _get_router():
+    global _router
+    if _router is None:
+        from process.llm_funcs.llm_router import LLMRouter
+        _router = LLMRouter([get_backend(n.strip()) for n in LLM_ROUTE.split(",") if n.strip()])
+    return _router
@@ -0,0 +1,191 @@
+# llm_router.py - spread turns over several OpenAI-compatible LLM endpoints
+#
+# LLM_ROUTE lists the endpoints, best first: backend names from llm_backend.BACKENDS
+# and/or base URLs of other OpenAI-compatible servers, e.g.
+#     LLM_ROUTE=local,http://192.168.1.20:8000/v1,groq
+# get_backend() then returns an LLMRouter instead of a single backend.
+#
+# - every request records the endpoint's time to first token in a moving average
+#   whose older part fades with age (LLM_TTFT_HALF_LIFE seconds), so one slow sample
+#   doesn't rank an endpoint last for good
+# - requests go to an endpoint that has never answered first (list order), so every
+#   endpoint gets measured; then to the healthy one with the lowest TTFT. An endpoint
+#   not measured for LLM_EXPLORE_AFTER seconds counts as untried again and gets the
+#   next turn, in case it got faster
+# - an endpoint that fails before its first token (unreachable, timeout, HTTP 5xx or
+#   429) is put aside for LLM_COOLDOWN seconds and the next one is tried right away.
+#   Other HTTP errors (400, 404, 422...) come from the request itself: they are raised
+#   as is and the endpoint stays up
+# - hedging (LLM_HEDGE_AFTER seconds, 0 = off): if the first token hasn't arrived by
+#   then, the same request goes to the next endpoint too; the first one to answer
+#   wins and the other stream is closed
+# Once tokens flowed, an error is raised as usual: half a reply can't be replayed.
+import os
+import queue
+import threading
+import time
+
+import httpx
+import openai
+
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_COOLDOWN = float(os.getenv("LLM_COOLDOWN", "30"))
+LLM_TTFT_HALF_LIFE = float(os.getenv("LLM_TTFT_HALF_LIFE", "120"))
+LLM_EXPLORE_AFTER = float(os.getenv("LLM_EXPLORE_AFTER", "600"))
+# weight of the newest TTFT sample in the moving average (more if the average is old)
+TTFT_ALPHA = 0.3
+
+
+def is_endpoint_failure(error) -> bool:
+    """True if the endpoint is down or overloaded, False if the request was refused."""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 429)
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError, TimeoutError, OSError))
+
+
+class Endpoint:
+    """One backend plus its recent latency and health."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.ttft = None          # moving average, seconds; None until it answered once
+        self.measured_at = 0.0    # time.monotonic() of the last sample
+        self.down_until = 0.0
+        self.failures = 0
+
+    @property
+    def name(self):
+        return self.backend.base_url
+
+    def healthy(self, now) -> bool:
+        return now >= self.down_until
+
+    def untried(self, now) -> bool:
+        """Never measured, or not for LLM_EXPLORE_AFTER seconds: worth a turn."""
+        return self.ttft is None or now - self.measured_at > LLM_EXPLORE_AFTER
+
+    def record_ttft(self, seconds, now=None):
+        now = time.monotonic() if now is None else now
+        if self.ttft is None:
+            self.ttft = seconds
+        else:
+            # the older the average, the less it weighs against the new sample
+            keep = (1 - TTFT_ALPHA) * 0.5 ** ((now - self.measured_at) / LLM_TTFT_HALF_LIFE)
+            self.ttft = keep * self.ttft + (1 - keep) * seconds
+        self.measured_at = now
+        self.failures = 0
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.down_until = time.monotonic() + LLM_COOLDOWN
+        print(f"[llm router] {self.name} failed ({error}), skipping it for {LLM_COOLDOWN:.0f}s")
+
+
+class LLMRouter:
+    """Same interface as LLMBackend (stream / complete), over several endpoints."""
+
+    def __init__(self, backends, hedge_after=LLM_HEDGE_AFTER):
+        self.endpoints = [Endpoint(b) for b in backends]
+        self.hedge_after = hedge_after
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return self.endpoints[0].backend.model
+
+    def ranked(self) -> list:
+        """Healthy endpoints: untried ones first (list order), then the fastest; down ones go last."""
+        now = time.monotonic()
+        with self._lock:
+            order = {id(e): i for i, e in enumerate(self.endpoints)}
+            return sorted(
+                self.endpoints,
+                key=lambda e: (not e.healthy(now), not e.untried(now),
+                               0.0 if e.untried(now) else e.ttft, order[id(e)]),
+            )
+
+    # ---------------------------
+    # Streaming
+    # ---------------------------
+
+    def stream(self, messages, cancel_event=None, **overrides):
+        """Yield text deltas from whichever endpoint answers first."""
+        candidates = self.ranked()
+        events = queue.Queue()
+        attempts = []  # (endpoint, cancel Event, started_at)
+        running = set()
+
+        def run(endpoint, stop):
+            try:
+                for delta in endpoint.backend.stream(messages, cancel_event=stop, **overrides):
+                    events.put(("delta", endpoint, delta))
+                events.put(("done", endpoint, None))
+            except Exception as e:
+                events.put(("error", endpoint, e))
+
+        def launch():
+            if not candidates:
+                return False
+            endpoint = candidates.pop(0)
+            stop = threading.Event()
+            attempts.append((endpoint, stop, time.monotonic()))
+            running.add(endpoint)
+            threading.Thread(target=run, args=(endpoint, stop), daemon=True).start()
+            return True
+
+        launch()
+        winner = None
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                timeout = 0.05
+                if winner is None and self.hedge_after > 0 and candidates:
+                    wait_left = attempts[-1][2] + self.hedge_after - time.monotonic()
+                    if wait_left <= 0:
+                        print(f"[llm router] no first token after {self.hedge_after}s, hedging")
+                        launch()
+                        continue
+                    timeout = min(timeout, wait_left)
+                try:
+                    kind, endpoint, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+
+                if winner is not None and endpoint is not winner:
+                    continue  # the loser's leftovers
+                if kind != "delta":
+                    running.discard(endpoint)
+                if kind == "error":
+                    if winner is not None or not is_endpoint_failure(value):
+                        raise value
+                    endpoint.record_failure(value)
+                    # fail over now unless another request is still in flight
+                    if not running and not launch():
+                        raise value
+                    continue
+                if winner is None:
+                    winner = endpoint
+                    self._first_token(winner, attempts, running)
+                if kind == "done":
+                    return
+                yield value
+        finally:
+            for _, stop, _ in attempts:
+                stop.set()
+
+    def _first_token(self, winner, attempts, running):
+        now = time.monotonic()
+        with self._lock:
+            for endpoint, stop, started_at in attempts:
+                if endpoint is winner:
+                    endpoint.record_ttft(now - started_at, now)
+                elif endpoint in running:
+                    # lost the race: it was at least this slow
+                    endpoint.record_ttft(max(now - started_at, endpoint.ttft or 0.0), now)
+                    stop.set()
+        if len(attempts) > 1:
+            print(f"[llm router] {winner.name} answered first")
+
+    def complete(self, messages, cancel_event=None, **overrides) -> str:
+        return "".join(self.stream(messages, cancel_event=cancel_event, **overrides))
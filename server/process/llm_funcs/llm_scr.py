@@ -4,20 +4,21 @@ import yaml
 import gradio as gr
 import json
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
+from process.llm_funcs.history_store import HistoryStore
+from process.llm_funcs.llm_backend import get_backend
 
 with open('character_config.yaml', 'r') as f:
     char_config = yaml.safe_load(f)
 
 
-client = OpenAI(api_key=openai_api_key)
+# same backend as main_chat (LLM_BACKEND, see llm_backend.py)
+llm = get_backend()
 
 # Constants
 HISTORY_FILE = char_config['history_file']
-MODEL = char_config['model']
+MODEL = llm.model
 SYSTEM_PROMPT =  [
         {
             "role": "system",
@@ -30,37 +31,21 @@ SYSTEM_PROMPT =  [
         }
     ]
 
-# Load/save chat history
+# Chat history: append-only log (chat_history.jsonl), the system prompt always comes from the config
+history = HistoryStore(HISTORY_FILE)
+
 def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
-    return SYSTEM_PROMPT
+    return [dict(m) for m in SYSTEM_PROMPT] + history.tail()
 
-def save_history(history):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=2)
+def append_history(*messages):
+    history.append(*messages)
 
 
 
 def get_riko_response_no_tool(messages):
 
-    # Call OpenAI with system prompt + history
-    response = client.responses.create(
-        model=MODEL,
-        input= messages,
-        temperature=1,
-        top_p=1,
-        max_output_tokens=2048,
-        stream=False,
-        text={
-            "format": {
-            "type": "text"
-            }
-        },
-    )
-
-    return response
+    # Call the LLM with system prompt + history, returns the whole reply
+    return llm.complete(messages, max_tokens=2048)
 
 
 def llm_response(user_input):
@@ -68,79 +53,73 @@ def llm_response(user_input):
     messages = load_history()
 
     # Append user message to memory
-    messages.append({
+    user_message = {
         "role": "user",
         "content": [
             {"type": "input_text", "text": user_input}
         ]
-    })
+    }
+    messages.append(user_message)
 
 
     riko_test_response = get_riko_response_no_tool(messages)
 
-    # just append assistant message to regular response. 
-    messages.append({
+    # log the turn (user + assistant message)
+    append_history(user_message, {
     "role": "assistant",
     "content": [
-        {"type": "output_text", "text": riko_test_response.output_text}
+        {"type": "output_text", "text": riko_test_response}
     ]
     })
+    return riko_test_response
 
-    save_history(messages)
-    return riko_test_response.output_text
+def memory_message(context_memory):
+    """Ephemeral system message carrying this turn's retrieved memories."""
+    return {
+        "role": "system",
+        "content": [
+            {
+                "type": "input_text",
+                "text": f"The following memories may or may not be relevent information from past conversations. If it is not relevent to this conversation, ignore it:\n{context_memory}"
+            }
+        ]
+    }
 
 # respond with Long-term memory 
 def llm_response_with_memory(user_input, context_memory):
 
     messages = load_history()
-    # modify the system prompt here with the context memory 
 
-       # Safely modify the system prompt (assumes it's always first)
-    if messages and messages[0]['role'] == 'system':
-        base_content = char_config['presets']['default']['system_prompt']
-        messages[0]['content'] = [
-            {
-                "type": "input_text",
-                "text": f"{base_content}\n\nThe following memories may or may not be relevent information from past conversations. If it is not relevent to this conversation, ignore it:\n{context_memory}"
-            }
-        ]
-    else:
-        # Fallback in case system prompt is missing for some reason
-        messages.insert(0, {
-            "role": "system",
-            "content": [
-                {
-                    "type": "input_text",
-                    "text": f"{char_config['presets']['default']['system_prompt']}\n\n[Memory]\n{context_memory}"
-                }
-            ]
-        })
+    # The system prompt and the history stay byte-identical from turn to turn, so the
+    # LLM server can reuse its cached prefix. The memories change every turn: they go
+    # in a message right before the new user turn and are never saved to the history.
+    if context_memory:
+        messages.append(memory_message(context_memory))
 
     # Append user message to memory
-    messages.append({
+    user_message = {
         "role": "user",
         "content": [
             {"type": "input_text", "text": user_input}
         ]
-    })
+    }
+    messages.append(user_message)
 
 
     riko_test_response = get_riko_response_no_tool(messages)
 
-    # just append assistant message to regular response. 
-    messages.append({
+    # log the turn (user + assistant message)
+    append_history(user_message, {
     "role": "assistant",
     "content": [
-        {"type": "output_text", "text": riko_test_response.output_text}
+        {"type": "output_text", "text": riko_test_response}
     ]
     })
-
-    save_history(messages)
-    return riko_test_response.output_text
+    return riko_test_response
 
 
 
 if __name__ == "__main__":
     print('running main')
-    response = get_riko_response_no_tool("hi riko")
+    response = get_riko_response_no_tool([{"role": "user", "content": "hi riko"}])
     print(response)
\ No newline at end of file
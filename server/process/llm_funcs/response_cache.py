@@ -0,0 +1,168 @@
+# response_cache.py - replay earlier replies to greetings and closings
+#
+# "salut", "ça va ?", "bonne nuit"... come back all the time and each one costs a full
+# LLM generation plus SoVITS. With `response_cache: true` in character_config.yaml,
+# main_chat looks such utterances up here first; on a hit the stored reply (and the
+# audio already synthesized for it) is replayed and the LLM is not called.
+#
+# - only the phrases listed in `response_cache_phrases` are cached: being short
+#   doesn't make an utterance context-free ("oui", "pourquoi ?")
+# - an utterance is matched to a phrase when their normalized forms (lowercase, no
+#   accents or punctuation) are equal, else by character-trigram cosine similarity
+#   (RESPONSE_CACHE_SIMILARITY, for transcription slips like "au revoire"), never when one
+#   has a negation the other doesn't ("je t'aime pas" is not "je t'aime")
+# - entries expire after RESPONSE_CACHE_TTL seconds; at most RESPONSE_CACHE_SIZE
+#   entries and RESPONSE_CACHE_MAX_MB of audio are kept (least recently used first)
+# - in memory only: a restart starts from an empty cache
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.8"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(6 * 3600)))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "200"))
+RESPONSE_CACHE_MAX_BYTES = int(float(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+# words that flip the meaning of an utterance (after normalize(): "n'aime" -> "n aime")
+NEGATIONS = {"ne", "n", "pas", "non", "jamais", "not", "no", "never"}
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def trigrams(text: str) -> Counter:
+    padded = f"  {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def cosine(a: Counter, b: Counter) -> float:
+    dot = sum(n * b[g] for g, n in a.items() if g in b)
+    if not dot:
+        return 0.0
+    return dot / (math.sqrt(sum(n * n for n in a.values())) * math.sqrt(sum(n * n for n in b.values())))
+
+
+def negations(text: str) -> set:
+    return NEGATIONS.intersection(text.split())
+
+
+@dataclass
+class CachedReply:
+    key: str
+    reply: str
+    # (chunk text, WAV bytes or None when the audio wasn't captured)
+    chunks: list
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+    @property
+    def size(self) -> int:
+        return sum(len(audio) for _, audio in self.chunks if audio)
+
+
+class Recording:
+    """Chunks of a reply being generated, with their audio as synthesis completes."""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self._lock = threading.Lock()
+
+    def add(self, chunk: str):
+        """Register the next chunk; returns the callback that receives its WAV bytes."""
+        with self._lock:
+            index = len(self.chunks)
+            self.chunks.append([chunk, None])
+
+        def on_audio(data: bytes):
+            with self._lock:
+                self.chunks[index][1] = data
+        return on_audio
+
+
+class ResponseCache:
+    def __init__(self, enabled=True, phrases=(), similarity=RESPONSE_CACHE_SIMILARITY,
+                 ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        # normalized phrase -> trigrams; the phrase is the cache key
+        self.phrases = {key: trigrams(key) for key in map(normalize, phrases or ()) if key}
+        self.enabled = enabled and bool(self.phrases)
+        if enabled and not self.phrases:
+            print("[response cache] no response_cache_phrases in the character config, cache disabled")
+        self.similarity = similarity
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    def key_for(self, user_text: str):
+        """The cached phrase this utterance stands for, or None if it isn't cacheable."""
+        if not self.enabled:
+            return None
+        text = normalize(user_text)
+        if not text:
+            return None
+        if text in self.phrases:
+            return text
+        vector = trigrams(text)
+        score, phrase = max(((cosine(vector, v), p) for p, v in self.phrases.items()),
+                            key=lambda pair: pair[0], default=(0.0, None))
+        if score < self.similarity or negations(text) != negations(phrase):
+            return None
+        return phrase
+
+    def lookup(self, user_text: str):
+        """The cached reply for this utterance, or None."""
+        key = self.key_for(user_text)
+        if key is None:
+            return None
+        with self._lock:
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry.hits += 1
+            self.entries.move_to_end(entry.key)
+            return entry
+
+    def record(self, user_text: str):
+        """Start recording a reply for this utterance (None if it isn't cacheable)."""
+        key = self.key_for(user_text)
+        return Recording(key) if key is not None else None
+
+    def put(self, recording: Recording, reply: str):
+        """Store a finished reply. Call only for replies that were played to the end."""
+        if recording is None or not reply or not recording.chunks:
+            return
+        with recording._lock:
+            chunks = [(chunk, audio) for chunk, audio in recording.chunks]
+        entry = CachedReply(key=recording.key, reply=reply, chunks=chunks)
+        with self._lock:
+            old = self.entries.pop(entry.key, None)
+            if old is not None:
+                self.total_bytes -= old.size
+            self.entries[entry.key] = entry
+            self.total_bytes += entry.size
+            self._expire()
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                _, dropped = self.entries.popitem(last=False)
+                self.total_bytes -= dropped.size
+
+    def _expire(self):
+        # caller holds the lock
+        now = time.time()
+        for key, entry in list(self.entries.items()):
+            if now - entry.created_at > self.ttl:
+                del self.entries[key]
+                self.total_bytes -= entry.size
@@ -0,0 +1,171 @@
+# text_chunker.py - cuts a streamed LLM reply into pieces small enough for TTS
+import re
+
+SENTENCE_END = ".?!…"
+CLAUSE_END = ",;:—–»"
+OPENERS = "«"
+# closing quotes/brackets that belong to the chunk they follow: .» ." ?)
+CLOSERS = "»\"”’)"
+
+# words that end with a dot without ending the sentence (compared lowercase)
+ABBREVIATIONS = {
+    "m", "mm", "mme", "mmes", "mlle", "mlles", "dr", "pr", "st", "ste",
+    "etc", "cf", "ex", "p", "pp", "env", "av", "apr", "vol", "n°", "art", "chap",
+    "mr", "mrs", "ms", "jr", "sr", "vs", "approx", "min", "max", "fig",
+}
+# these are plain words too ("she said no."): only an abbreviation before what it
+# introduces, a number ("No. 5") or a name ("Me. Dupont")
+ABBREVIATIONS_BEFORE = {
+    "no": lambda next_word: next_word[:1].isdigit(),
+    "me": lambda next_word: next_word[:1].isupper(),
+}
+_LAST_WORD = re.compile(r"(\S+)$")
+
+
+class TextChunker:
+    """
+    Incremental splitter for streamed LLM text.
+
+    feed() takes each delta and returns the chunks that became ready; flush() returns
+    whatever is left once the stream ends. Used by stream_text_chunks and the async engine.
+
+    Policy:
+    - the first chunk is cut at the first sentence *or* clause boundary (comma, ;, :,
+      em dash, French quotes) once it has first_min_len characters, so speech starts early
+    - later chunks only cut on sentence ends, and their target length grows by `growth`
+      per chunk from min_len up to max_len (longer inputs synthesize more efficiently)
+    - past max_len the buffer is cut at the last sentence, then clause, then word boundary
+    - a boundary must be followed by whitespace, so "3.14", "1,5" and "..." aren't split,
+      and dots after known abbreviations, initials ("J. Dupont") or list numbers are ignored
+    - cuts can happen anywhere in the buffer, not only at its end
+    """
+
+    def __init__(self, min_len=30, max_len=120, first_min_len=10, growth=1.6):
+        self.min_len = min_len
+        self.max_len = max_len
+        self.first_min_len = first_min_len
+        self.growth = growth
+        self.buffer = ""
+        self.count = 0
+
+    def feed(self, delta: str) -> list:
+        self.buffer += delta
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            chunk = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:].lstrip()
+            if chunk:
+                chunks.append(chunk)
+                self.count += 1
+        return chunks
+
+    def flush(self) -> list:
+        chunk, self.buffer = self.buffer.strip(), ""
+        if not chunk:
+            return []
+        self.count += 1
+        return [chunk]
+
+    def target_len(self) -> int:
+        if self.count == 0:
+            return self.first_min_len
+        return min(self.max_len, int(self.min_len * self.growth ** (self.count - 1)))
+
+    # ---------------------------
+    # Boundary detection
+    # ---------------------------
+
+    def _find_cut(self):
+        target = self.target_len()
+        first = self.count == 0
+
+        last_sentence = last_clause = None
+        for cut, kind in self._boundaries():
+            length = len(self.buffer[:cut].strip())
+            if length > self.max_len:
+                break
+            if first and length >= target:
+                return cut
+            if kind == "sentence":
+                if length >= target:
+                    return cut
+                if length >= self.min_len:
+                    last_sentence = cut
+            elif length >= self.min_len:
+                last_clause = cut
+
+        if len(self.buffer.strip()) < self.max_len:
+            return None
+
+        # overflow: take the best boundary we have, or at least a word boundary
+        if last_sentence is not None:
+            return last_sentence
+        if last_clause is not None:
+            return last_clause
+        space = self.buffer.rfind(" ", 0, self.max_len)
+        return space if space > 0 else self.max_len
+
+    def _boundaries(self):
+        """Yield (cut_index, "sentence" | "clause") for every confirmed boundary, in order."""
+        buf = self.buffer
+        for i, ch in enumerate(buf):
+            if ch in OPENERS:
+                # « opens a quote: cut before it
+                if i > 0 and buf[i - 1].isspace():
+                    yield i, "clause"
+                continue
+            if ch in SENTENCE_END:
+                kind = "sentence"
+            elif ch in CLAUSE_END:
+                kind = "clause"
+            else:
+                continue
+            cut = self._confirm(i)
+            if cut is None:
+                continue
+            if ch == "." and self._is_abbreviation(i):
+                continue
+            yield cut, kind
+
+    def _confirm(self, i):
+        """Cut index after the punctuation at i, or None if no word break follows it (yet)."""
+        buf = self.buffer
+        j = i + 1
+        while j < len(buf) and buf[j] in CLOSERS:
+            j += 1
+        if j >= len(buf) or not buf[j].isspace():
+            return None
+        # French spacing: "oui. »" - the closer after the space still belongs here
+        k = j
+        while k < len(buf) and buf[k].isspace():
+            k += 1
+        if k >= len(buf):
+            return None
+        if buf[k] in CLOSERS and buf[i] != buf[k]:
+            if k + 1 >= len(buf) or not buf[k + 1].isspace():
+                return None
+            return k + 1
+        return j
+
+    def _is_abbreviation(self, i):
+        match = _LAST_WORD.search(self.buffer, 0, i)
+        if not match:
+            return False
+        word = match.group(1).lstrip("«\"(“")
+        if word.lower() in ABBREVIATIONS:
+            return True
+        if word.lower() in ABBREVIATIONS_BEFORE:
+            # _confirm made sure a word follows the dot
+            next_word = self.buffer[i + 1:].lstrip(CLOSERS).split(None, 1)[0]
+            return ABBREVIATIONS_BEFORE[word.lower()](next_word)
+        # initials: "J. Dupont"
+        if len(word) == 1 and word.isalpha() and word.isupper():
+            return True
+        # list numbering at the start of a line: "1. D'abord"
+        if word.isdigit():
+            start = match.start(1)
+            return start == 0 or self.buffer[start - 1] == "\n"
+        return False
@@ -0,0 +1,83 @@
+# http_session.py - shared keep-alive HTTP sessions for the VRM bridge and SoVITS
+#
+# Every helper used to call requests.post() directly, which opens (and tears down) a
+# new TCP connection per call. These sessions keep connections open between calls
+# and give each backend its own timeouts and retry policy.
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds per backend
+TIMEOUTS = {
+    "vrm": (2.0, 5.0),        # avatar cues: tiny JSON, local server
+    "sovits": (5.0, 300.0),   # synthesis can take a while on long sentences
+}
+
+# Only retry when the request never reached the server (connect errors). A read
+# timeout on /talk or on a synthesis is not retried: the cue may already have played,
+# the GPU already spent. SoVITS gets a single immediate connect retry and no retry on
+# 5xx: the pool (sovits_pool.py) moves the request to another instance instead.
+RETRIES = {
+    "vrm": Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.1, allowed_methods=None),
+    "sovits": Retry(total=1, connect=1, read=0, status=0, backoff_factor=0, allowed_methods=None),
+}
+
+# max keep-alive connections per host (synthesis runs on several worker threads)
+POOL_SIZES = {"vrm": 4, "sovits": 8}
+# hosts per backend, one connection pool each (sovits_ping sets it to the pool size)
+POOL_HOSTS = {"vrm": 1, "sovits": 1}
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def get_session(backend: str) -> requests.Session:
+    """Return the shared session for a backend ("vrm" or "sovits"), creating it once."""
+    session = _sessions.get(backend)
+    if session is not None:
+        return session
+    with _lock:
+        if backend not in _sessions:
+            session = requests.Session()
+            _mount(session, backend)
+            _sessions[backend] = session
+        return _sessions[backend]
+
+
+def _mount(session, backend):
+    adapter = HTTPAdapter(
+        pool_connections=POOL_HOSTS[backend],
+        pool_maxsize=POOL_SIZES[backend],
+        max_retries=RETRIES[backend],
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def set_hosts(backend: str, count: int):
+    """Keep one connection pool per host for `count` hosts (e.g. SoVITS instances)."""
+    with _lock:
+        POOL_HOSTS[backend] = max(1, count)
+        if backend in _sessions:
+            _mount(_sessions[backend], backend)
+
+
+def post(backend: str, url: str, **kwargs) -> requests.Response:
+    """requests.post through the backend's pooled session, with its default timeout."""
+    kwargs.setdefault("timeout", TIMEOUTS[backend])
+    return get_session(backend).post(url, **kwargs)
+
+
+def get(backend: str, url: str, **kwargs) -> requests.Response:
+    """requests.get through the backend's pooled session, with its default timeout."""
+    kwargs.setdefault("timeout", TIMEOUTS[backend])
+    return get_session(backend).get(url, **kwargs)
+
+
+def close_all():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
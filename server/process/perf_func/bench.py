@@ -0,0 +1,369 @@
+# bench.py - end-to-end latency benchmark of main_chat without a GPU
+#
+# Starts the fake LLM and SoVITS servers (fake_backends.py), server.py, and a headless
+# VRM client on /ws, then runs main_chat.py in ASR_MODE=text and types the prompts
+# into it. Every talk cue the headless client receives counts as the start of that
+# clip's playback (plus its start_in), so for each turn it reports:
+#   - time to first audio (prompt sent -> first talk cue)
+#   - gaps between clips (cue of clip N+1 - end of clip N; negative means overlap)
+#   - total turn time (prompt sent -> end of the last clip)
+# plus main_chat's own per-stage timeline (process/perf_func/timeline.py).
+#
+# Run from server/ (server.py must be free to bind port 8001):
+#     python -m process.perf_func.bench --turns 5
+#     python -m process.perf_func.bench --streaming --tokens-per-sec 15 --json out.json
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+
+import requests
+import yaml
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect
+
+from process.perf_func.fake_backends import FakeLLM, FakeSoVITS, make_wav, serve_in_thread
+from process.perf_func.timeline import load_records, percentile, summarize
+from process.tts_func.wav_stream import parse_wav_header
+
+SERVER_DIR = Path(__file__).resolve().parents[2]
+REPO_ROOT = SERVER_DIR.parent
+# main_chat and vrm_ping talk to server.py on this port
+VRM_PORT = 8001
+
+DEFAULT_PROMPTS = [
+    "Salut Riko, ça va ?",
+    "Tu as des conseils pour être en forme ?",
+    "Parle-moi des étoiles.",
+]
+
+
+# ---------------------------
+# Headless VRM client
+# ---------------------------
+
+def clip_duration(audio_path, workdir: Path):
+    """Duration in seconds of a clip named in a talk cue (file path or /audio_stream URL)."""
+    if audio_path.startswith("http"):
+        with requests.get(audio_path, stream=True, timeout=(2, 300)) as r:
+            r.raise_for_status()
+            body = b"".join(r.iter_content(chunk_size=1024 * 16))
+    else:
+        path = workdir / audio_path
+        if not path.exists():
+            path = workdir / "client" / "audio" / Path(audio_path).name
+        body = path.read_bytes()
+    info = parse_wav_header(body)
+    if info is None:
+        raise ValueError(f"no WAV header in {audio_path}")
+    # streamed clips still carry the placeholder sizes, so count the bytes we got
+    data_size = info.data_size if info.data_size is not None else len(body) - info.data_offset
+    return data_size / info.byte_rate
+
+
+class HeadlessClient:
+    """
+    Stands in for the browser: records every message from /ws with its arrival time,
+    and acks playback of each clip as if it played exactly on schedule.
+    """
+
+    def __init__(self, url, workdir: Path):
+        self.url = url
+        self.workdir = workdir
+        self.messages = []  # (monotonic time, message dict, duration future or None)
+        self._cond = threading.Condition()
+        self._probes = ThreadPoolExecutor(max_workers=4)
+        self._ws = None
+        self._thread = None
+
+    def connect(self, timeout=20.0, alive=lambda: True):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._ws = connect(self.url, open_timeout=2)
+                break
+            except (OSError, TimeoutError, WebSocketException):
+                if time.monotonic() > deadline or not alive():
+                    raise RuntimeError(f"server.py did not come up on {self.url}")
+                time.sleep(0.3)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for raw in self._ws:
+                t = time.monotonic()
+                msg = json.loads(raw)
+                probe = None
+                if msg.get("type") == "start_animation":
+                    # fetch the clip like the browser would, off the receive loop
+                    probe = self._probes.submit(clip_duration, msg["audio_path"], self.workdir)
+                    probe.add_done_callback(lambda f, msg=msg, t=t: self._ack(msg, t, f))
+                with self._cond:
+                    self.messages.append((t, msg, probe))
+                    self._cond.notify_all()
+        except WebSocketException:
+            pass
+
+    def _ack(self, msg, received_at, probe):
+        """Send playback_started / playback_ended when the clip would start and end."""
+        clip_id = msg.get("clip_id")
+        if not clip_id or probe.exception() is not None:
+            return
+        start = received_at + msg.get("start_in", 0.0)
+        end = start + probe.result()
+
+        def send(kind, at):
+            time.sleep(max(0.0, at - time.monotonic()))
+            with suppress(WebSocketException):
+                self._ws.send(json.dumps({"type": kind, "clip_id": clip_id}))
+
+        def run():
+            send("playback_started", start)
+            send("playback_ended", end)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def cursor(self):
+        with self._cond:
+            return len(self.messages)
+
+    def wait_for_state(self, state, since=0, timeout=60.0):
+        """Block until a set_state `state` arrives after index `since`; return the messages up to it."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for i in range(since, len(self.messages)):
+                    msg = self.messages[i][1]
+                    if msg.get("type") == "set_state" and msg.get("state") == state:
+                        return self.messages[since:i + 1]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"no set_state {state!r} within {timeout:.0f}s")
+                self._cond.wait(remaining)
+
+    def close(self):
+        if self._ws is not None:
+            self._ws.close()
+        self._probes.shutdown(wait=False)
+
+
+# ---------------------------
+# Metrics
+# ---------------------------
+
+def turn_metrics(sent_at, messages):
+    """TTFA, gaps and turn time for one turn from the messages received after the prompt."""
+    clips = []
+    for t, msg, probe in messages:
+        if probe is not None:
+            # cues can be sent ahead of time; start_in says when the clip is due
+            clips.append((t + msg.get("start_in", 0.0) - sent_at, probe.result(timeout=300)))
+    if not clips:
+        return {"chunks": 0, "ttfa": None, "gaps": [], "turn_time": None, "audio": 0.0}
+    gaps = []
+    for (start, duration), (next_start, _) in zip(clips, clips[1:]):
+        gaps.append(round(next_start - (start + duration), 4))
+    last_start, last_duration = clips[-1]
+    return {
+        "chunks": len(clips),
+        "ttfa": round(clips[0][0], 4),
+        "gaps": gaps,
+        "turn_time": round(last_start + last_duration, 4),
+        "audio": round(sum(d for _, d in clips), 4),
+    }
+
+
+def stats(values):
+    if not values:
+        return "-"
+    return f"p50 {percentile(values, 50):.3f}  p95 {percentile(values, 95):.3f}  max {max(values):.3f}"
+
+
+def print_report(turns, timeline_path: Path):
+    print(f"\n{'turn':<6}{'chunks':>8}{'ttfa':>9}{'worst gap':>11}{'turn':>9}{'audio':>9}")
+    for i, m in enumerate(turns, 1):
+        worst = f"{max(m['gaps']):.3f}" if m["gaps"] else "-"
+        ttfa = f"{m['ttfa']:.3f}" if m["ttfa"] is not None else "-"
+        total = f"{m['turn_time']:.3f}" if m["turn_time"] is not None else "-"
+        print(f"{i:<6}{m['chunks']:>8}{ttfa:>9}{worst:>11}{total:>9}{m['audio']:>9.2f}")
+
+    print()
+    print("time to first audio   ", stats([m["ttfa"] for m in turns if m["ttfa"] is not None]))
+    print("inter-chunk gap       ", stats([g for m in turns for g in m["gaps"]]))
+    print("turn time             ", stats([m["turn_time"] for m in turns if m["turn_time"] is not None]))
+
+    if timeline_path.exists():
+        print("\nmain_chat timeline (seconds since the prompt was read)")
+        print(f"{'stage':<24}{'n':>6}{'p50':>10}{'p95':>10}{'max':>10}")
+        for name, n, p50, p95, worst in summarize(load_records(timeline_path)):
+            print(f"{name:<24}{n:>6}{p50:>10.3f}{p95:>10.3f}{worst:>10.3f}")
+
+
+# ---------------------------
+# Setup
+# ---------------------------
+
+def write_config(workdir: Path, args):
+    """character_config.yaml for main_chat: the real one, pointed at the fakes."""
+    with open(REPO_ROOT / "character_config.yaml", "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    ref_wav = workdir / "ref.wav"
+    header, pcm = make_wav(1.0)
+    ref_wav.write_bytes(header + pcm)
+
+    config["history_file"] = str(workdir / "chat_history.json")
+    sovits = config.setdefault("sovits_ping_config", {})
+    sovits["base_url"] = f"http://127.0.0.1:{args.sovits_port}"
+    sovits["base_urls"] = [f"http://127.0.0.1:{args.sovits_port + i}" for i in range(args.sovits_instances)]
+    sovits["refer_wav_path"] = str(ref_wav)
+    sovits["streaming_mode"] = args.streaming
+    sovits["reference_mode"] = args.reference_mode
+    with open(workdir / "character_config.yaml", "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+
+def tail(path: Path, lines=30):
+    if path.exists():
+        print(f"\n--- last lines of {path} ---")
+        print("\n".join(path.read_text(encoding="utf-8", errors="replace").splitlines()[-lines:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark of main_chat with fake backends")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--prompt", action="append", help="prompt to type (repeatable, cycled over turns)")
+    parser.add_argument("--tokens-per-sec", type=float, default=30.0, help="fake LLM decode speed")
+    parser.add_argument("--ttft", type=float, default=0.3, help="fake LLM time to first token (s)")
+    parser.add_argument("--tts-base-latency", type=float, default=0.15, help="fake SoVITS latency per request (s)")
+    parser.add_argument("--tts-latency-per-char", type=float, default=0.01, help="fake SoVITS latency per character (s)")
+    parser.add_argument("--speech-rate", type=float, default=0.065, help="seconds of audio per character")
+    parser.add_argument("--tts-silence", type=float, default=0.25,
+                        help="dead air at each end of a fake SoVITS clip (s)")
+    parser.add_argument("--streaming", action="store_true", help="sovits_ping_config.streaming_mode")
+    parser.add_argument("--reply-stream", action="store_true",
+                        help="AUDIO_REPLY_STREAM=1: one continuous stream per reply (counts as one clip)")
+    parser.add_argument("--tts-workers", type=int, help="default: what the SoVITS pool can take")
+    parser.add_argument("--sovits-instances", type=int, default=1, help="fake SoVITS servers in the pool (consecutive ports)")
+    parser.add_argument("--tts-serial", action="store_true",
+                        help="each fake SoVITS synthesizes one request at a time, like api.py")
+    parser.add_argument("--tts-reference-latency", type=float, default=0.1,
+                        help="fake SoVITS time to encode the reference audio (s)")
+    parser.add_argument("--reference-mode", choices=("session", "per_request"), default="session",
+                        help="sovits_ping_config.reference_mode")
+    parser.add_argument("--llm-port", type=int, default=18000)
+    parser.add_argument("--sovits-port", type=int, default=19880)
+    parser.add_argument("--turn-timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="also write the per-turn results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (logs, clips)")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="riko_bench_"))
+    (workdir / "client" / "audio").mkdir(parents=True)
+    write_config(workdir, args)
+    timeline_path = workdir / "turn_timeline.jsonl"
+
+    llm = serve_in_thread(FakeLLM(args.llm_port, tokens_per_sec=args.tokens_per_sec, ttft=args.ttft))
+    sovits_servers = [serve_in_thread(FakeSoVITS(
+        args.sovits_port + i,
+        base_latency=args.tts_base_latency,
+        latency_per_char=args.tts_latency_per_char,
+        seconds_per_char=args.speech_rate,
+        serial=args.tts_serial,
+        reference_latency=args.tts_reference_latency,
+        silence=args.tts_silence,
+    )) for i in range(args.sovits_instances)]
+
+    env = dict(os.environ)
+    env.update({
+        "AUDIO_DIR": str(workdir / "client" / "audio"),
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+        "LLM_BACKEND": "local",
+        "LLM_ROUTE": "",
+        "ASR_MODE": "text",
+        "BARGE_IN": "0",
+        # the fake replies repeat: cached clips would hide the synthesis cost
+        "TTS_CACHE": "off",
+        "TURN_TIMELINE_FILE": str(timeline_path),
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.pop("SOVITS_URLS", None)
+    env["AUDIO_REPLY_STREAM"] = "1" if args.reply_stream else "0"
+    if args.tts_workers:
+        env["TTS_WORKERS"] = str(args.tts_workers)
+    else:
+        env.pop("TTS_WORKERS", None)
+
+    server_log = open(workdir / "server.log", "w")
+    chat_log = open(workdir / "main_chat.log", "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(VRM_PORT)],
+        cwd=SERVER_DIR, env=env, stdout=server_log, stderr=subprocess.STDOUT,
+    )
+    chat = None
+    client = HeadlessClient(f"ws://127.0.0.1:{VRM_PORT}/ws", workdir)
+    turns = []
+    try:
+        client.connect(alive=lambda: server.poll() is None)
+        chat = subprocess.Popen(
+            [sys.executable, str(SERVER_DIR / "main_chat.py")],
+            cwd=workdir, env=env, stdin=subprocess.PIPE, stdout=chat_log, stderr=subprocess.STDOUT,
+            text=True, encoding="utf-8",
+        )
+        # main_chat sets "idle" right before it asks for input
+        client.wait_for_state("idle", timeout=60)
+
+        prompts = args.prompt or DEFAULT_PROMPTS
+        for i in range(args.turns):
+            prompt = prompts[i % len(prompts)]
+            since = client.cursor()
+            sent_at = time.monotonic()
+            chat.stdin.write(prompt + "\n")
+            chat.stdin.flush()
+            messages = client.wait_for_state("idle", since=since, timeout=args.turn_timeout)
+            metrics = turn_metrics(sent_at, messages)
+            metrics["prompt"] = prompt
+            turns.append(metrics)
+            print(f"turn {i + 1}/{args.turns}: {metrics['chunks']} chunks, ttfa {metrics['ttfa']}s")
+    except (RuntimeError, TimeoutError) as e:
+        print(f"benchmark aborted: {e}")
+        tail(workdir / "main_chat.log")
+        tail(workdir / "server.log")
+    finally:
+        client.close()
+        for proc in (chat, server):
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        server_log.close()
+        chat_log.close()
+        llm.shutdown()
+        for sovits in sovits_servers:
+            sovits.shutdown()
+
+    if turns:
+        print_report(turns, timeline_path)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "turns": turns}, f, indent=2)
+    if args.keep:
+        print(f"\nwork directory kept: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
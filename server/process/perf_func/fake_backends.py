@@ -0,0 +1,242 @@
+# fake_backends.py - local stand-ins for the LLM server and GPT-SoVITS (used by bench.py)
+#
+# FakeLLM speaks just enough of the OpenAI chat completions API (stream=True, SSE)
+# for main_chat, at a configurable time-to-first-token and token rate.
+# FakeSoVITS answers POST / like api.py from GPT-SoVITS with a real WAV whose length
+# and synthesis latency both scale with the text length, so chunking and
+# concurrency changes show up in the numbers without a GPU. Like api.py it keeps a
+# default reference set by POST /change_refer; a request carrying its own reference
+# pays reference_latency for encoding it, one without any gets a 400.
+import json
+import math
+import struct
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLIES = [
+    "Salut ! Je vais très bien, merci. Aujourd'hui j'ai rangé mes notes, relu deux "
+    "chapitres de mon livre préféré et j'ai même essayé une nouvelle recette de crêpes. "
+    "Et toi, comment s'est passée ta journée ?",
+    "Bonne question ! Pour faire simple, il faut d'abord bien dormir, ensuite boire "
+    "assez d'eau, et enfin prendre le temps de marcher un peu chaque jour. Ce n'est pas "
+    "spectaculaire, mais ça marche vraiment. Tu veux que je t'aide à faire un planning ?",
+    "Oh, j'adore ce sujet. Les étoiles que l'on voit la nuit sont parfois si lointaines "
+    "que leur lumière est partie il y a des milliers d'années. Quand tu regardes le ciel, "
+    "tu regardes donc un peu dans le passé. C'est beau, non ?",
+]
+
+
+def tokenize(text, size=4):
+    """Split text into ~size-character pieces, roughly like an LLM tokenizer would."""
+    tokens = []
+    for word in text.split(" "):
+        piece = word + " "
+        tokens.extend(piece[i:i + size] for i in range(0, len(piece), size))
+    if tokens:
+        tokens[-1] = tokens[-1].rstrip()
+    return tokens
+
+
+_tone_cache = {}
+
+
+def _tone_second(sample_rate):
+    # one second of a quiet 220 Hz tone; a whole number of periods, so it tiles cleanly
+    if sample_rate not in _tone_cache:
+        _tone_cache[sample_rate] = b"".join(
+            struct.pack("<h", int(3000 * math.sin(2 * math.pi * 220 * n / sample_rate)))
+            for n in range(sample_rate)
+        )
+    return _tone_cache[sample_rate]
+
+
+def make_wav(duration, sample_rate=32000, data_size=None, silence=0.0):
+    """
+    Return (header, pcm) for a 16-bit mono WAV tone of `duration` seconds, with
+    `silence` seconds of dead air before and after it like real SoVITS clips.
+    """
+    frames = max(1, int(duration * sample_rate))
+    second = _tone_second(sample_rate)
+    pad = bytes(int(silence * sample_rate) * 2)
+    pcm = pad + (second * (frames // sample_rate + 1))[:frames * 2] + pad
+    size = len(pcm) if data_size is None else data_size
+    header = b"RIFF" + struct.pack("<I", min(0xFFFFFFFF, size + 36)) + b"WAVE"
+    header += b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    header += b"data" + struct.pack("<I", size)
+    return header, bytes(pcm)
+
+
+class _ChunkedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeLLMHandler(_ChunkedHandler):
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        req = self.read_json()
+        server = self.server
+        if server.status != 200:
+            self.send_json(server.status, {"error": {"message": f"fake error {server.status}", "type": "fake"}})
+            return
+        reply = server.next_reply()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = req.get("model", "fake")
+
+        def frame(delta, finish_reason=None):
+            return json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            })
+
+        self.start_chunked("text/event-stream")
+        try:
+            time.sleep(server.ttft)
+            self.write_chunk(f"data: {frame({'role': 'assistant', 'content': ''})}\n\n".encode())
+            for token in tokenize(reply):
+                self.write_chunk(f"data: {frame({'content': token})}\n\n".encode())
+                time.sleep(1.0 / server.tokens_per_sec)
+            self.write_chunk(f"data: {frame({}, 'stop')}\n\n".encode())
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            # client hung up (barge-in): stop "generating"
+            self.close_connection = True
+
+
+class FakeSoVITSHandler(_ChunkedHandler):
+    def do_POST(self):
+        req = self.read_json()
+        server = self.server
+        if self.path.rstrip("/") == "/change_refer":
+            with server.gpu:
+                time.sleep(server.reference_latency)
+            server.default_refer = req.get("refer_wav_path")
+            self.send_json(200, {"code": 0, "message": "Success"})
+            return
+        server.requests += 1
+        if server.status != 200:
+            self.send_json(server.status, {"code": server.status, "message": f"fake error {server.status}"})
+            return
+        text = req.get("text", "")
+        latency = server.base_latency + server.latency_per_char * len(text)
+        if req.get("refer_wav_path"):
+            latency += server.reference_latency
+        elif not server.default_refer:
+            self.send_json(400, {"code": 400, "message": "未指定参考音频且接口无预设"})
+            return
+        duration = max(0.2, server.seconds_per_char * len(text))
+
+        # serial: one synthesis at a time per server, the others wait their turn
+        with server.gpu:
+            self.synthesize(req, server, text, latency, duration)
+
+    def synthesize(self, req, server, text, latency, duration):
+        if not req.get("streaming_mode"):
+            time.sleep(latency)
+            header, pcm = make_wav(duration, server.sample_rate, silence=server.silence)
+            body = header + pcm
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        # streaming: header after the first-segment latency, then the audio in pieces
+        # spread over the rest of the synthesis time, sizes left unknown like the real server
+        header, pcm = make_wav(duration, server.sample_rate, data_size=0xFFFFFFFF, silence=server.silence)
+        pieces = max(1, int(len(text) / 20))
+        step = -(-len(pcm) // pieces)
+        self.start_chunked("audio/wav")
+        try:
+            time.sleep(server.base_latency)
+            self.write_chunk(header)
+            for i in range(0, len(pcm), step):
+                time.sleep(server.latency_per_char * len(text) / pieces)
+                self.write_chunk(pcm[i:i + step])
+            self.end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class FakeLLM(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, tokens_per_sec=30.0, ttft=0.3, replies=None, status=200):
+        super().__init__(("127.0.0.1", port), FakeLLMHandler)
+        # anything but 200: every request gets that HTTP error (failover tests)
+        self.status = status
+        self.tokens_per_sec = tokens_per_sec
+        self.ttft = ttft
+        self.replies = list(replies or DEFAULT_REPLIES)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def next_reply(self):
+        with self._lock:
+            reply = self.replies[self.requests % len(self.replies)]
+            self.requests += 1
+        return reply
+
+
+class FakeSoVITS(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, base_latency=0.15, latency_per_char=0.01,
+                 seconds_per_char=0.065, sample_rate=32000, serial=False, reference_latency=0.1,
+                 silence=0.0, status=200):
+        super().__init__(("127.0.0.1", port), FakeSoVITSHandler)
+        # anything but 200: every synthesis request gets that HTTP error (failover tests)
+        self.status = status
+        self.base_latency = base_latency
+        self.latency_per_char = latency_per_char
+        self.seconds_per_char = seconds_per_char
+        self.sample_rate = sample_rate
+        self.reference_latency = reference_latency
+        self.silence = silence
+        self.default_refer = None
+        self.gpu = threading.Lock() if serial else nullcontext()
+        self.requests = 0
+
+
+def serve_in_thread(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,149 @@
+# timeline.py - per-turn latency timeline for the voice pipeline
+#
+# main_chat creates one TurnTimeline per turn when the user stops speaking, passes it
+# to stream_text_chunks, the synthesis worker and PlaybackWorker, and writes it out as
+# one JSON line when the reply has finished playing.
+#
+# Report over a session:
+#     python -m process.perf_func.timeline logs/turn_timeline.jsonl
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+TIMELINE_FILE = os.getenv("TURN_TIMELINE_FILE", "logs/turn_timeline.jsonl")
+
+# marks in pipeline order (seconds since the end of the user's speech)
+STAGES = [
+    "transcribed",
+    "llm_first_token",
+    "first_chunk",
+    "tts_first_byte",
+    "tts_first_done",
+    "first_talk_cue",
+    "llm_done",
+    "playback_end",
+]
+
+
+class TurnTimeline:
+    """Thread-safe monotonic marks and spans for one conversation turn."""
+
+    def __init__(self, turn_id=None):
+        self.turn_id = turn_id or time.strftime("%Y%m%d-%H%M%S")
+        self.started_at = time.time()
+        self.t0 = time.monotonic()
+        self.marks = {}
+        self.spans = {}
+        self.interrupted = False
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.t0
+
+    def mark(self, name: str, once: bool = True, at: float = None):
+        """
+        Record the time of an event; with once=True only the first occurrence counts.
+
+        `at` is a time.monotonic() value for events scheduled ahead (e.g. a clip's end).
+        """
+        t = round((at if at is not None else time.monotonic()) - self.t0, 4)
+        with self._lock:
+            if once and name in self.marks:
+                return
+            self.marks[name] = t
+
+    def record(self, name: str, duration: float):
+        """Add one duration to a span; repeated spans (one per chunk) are kept as a list."""
+        with self._lock:
+            self.spans.setdefault(name, []).append(round(duration, 4))
+
+    @contextmanager
+    def span(self, name: str):
+        """Time a block and record() it."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    def to_record(self) -> dict:
+        with self._lock:
+            return {
+                "turn": self.turn_id,
+                "started_at": self.started_at,
+                "interrupted": self.interrupted,
+                "marks": dict(self.marks),
+                "spans": {k: list(v) for k, v in self.spans.items()},
+            }
+
+    def write(self, path=None):
+        path = Path(path or TIMELINE_FILE)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.to_record()) + "\n")
+
+
+# ---------------------------
+# Report CLI
+# ---------------------------
+
+def percentile(values, q):
+    """Nearest-rank percentile (q in 0-100) of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100 * len(ordered) + 0.5 - 1e-9)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def load_records(path):
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def summarize(records):
+    """Return [(name, n, p50, p95, max)] for every mark and span found in the records."""
+    series = {}
+    for rec in records:
+        for name, t in rec.get("marks", {}).items():
+            series.setdefault(name, []).append(t)
+        for name, durations in rec.get("spans", {}).items():
+            series.setdefault(f"{name} (each)", []).extend(durations)
+    order = {name: i for i, name in enumerate(STAGES)}
+    names = sorted(series, key=lambda n: (order.get(n, len(order)), n))
+    return [
+        (name, len(series[name]), percentile(series[name], 50), percentile(series[name], 95), max(series[name]))
+        for name in names
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p50/p95 per pipeline stage over a session")
+    parser.add_argument("path", nargs="?", default=TIMELINE_FILE)
+    parser.add_argument("--last", type=int, default=0, help="only the last N turns")
+    args = parser.parse_args()
+
+    records = load_records(args.path)
+    if args.last:
+        records = records[-args.last:]
+    if not records:
+        print(f"No turns in {args.path}")
+        return
+
+    interrupted = sum(1 for r in records if r.get("interrupted"))
+    print(f"{len(records)} turns ({interrupted} interrupted) from {args.path}")
+    print("times are seconds since the end of the user's speech; spans are per chunk\n")
+    print(f"{'stage':<24}{'n':>6}{'p50':>10}{'p95':>10}{'max':>10}")
+    for name, n, p50, p95, worst in summarize(records):
+        print(f"{name:<24}{n:>6}{p50:>10.3f}{p95:>10.3f}{worst:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
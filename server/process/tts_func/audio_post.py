@@ -0,0 +1,127 @@
+# audio_post.py - trim silence and even out loudness of synthesized clips
+#
+# SoVITS clips often start and end with dead air, and the clip duration counts it, so
+# PlaybackWorker waits through it between every sentence. Before a clip is stored,
+# post_process() works on its PCM with NumPy:
+#   - trim: the clip is cut to the first/last TTS_TRIM_WINDOW_MS window whose RMS is
+#     above TTS_TRIM_FLOOR_DB (dBFS), keeping TTS_TRIM_PAD_MS on each side so soft
+#     onsets and word endings aren't clipped
+#   - loudness: the voiced part is scaled to TTS_LOUDNESS_DBFS RMS, so every chunk of
+#     a reply comes out at the same level; the gain is capped at TTS_MAX_GAIN_DB (no
+#     blowing up noise) and the peak is kept under TTS_PEAK_DBFS
+# TTS_POSTPROCESS=0 turns both off; TTS_LOUDNESS_DBFS=off keeps the trim only.
+# Only 16-bit PCM is touched (what SoVITS sends); other formats pass through.
+# Streamed clips (streaming_mode) are already playing when they're complete, so they
+# are left as they are.
+import os
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+
+from process.tts_func.wav_stream import parse_wav_header
+
+TTS_POSTPROCESS = os.getenv("TTS_POSTPROCESS", "1") != "0"
+TTS_TRIM_FLOOR_DB = float(os.getenv("TTS_TRIM_FLOOR_DB", "-45"))
+TTS_TRIM_PAD_MS = float(os.getenv("TTS_TRIM_PAD_MS", "40"))
+TTS_TRIM_WINDOW_MS = float(os.getenv("TTS_TRIM_WINDOW_MS", "10"))
+_loudness = os.getenv("TTS_LOUDNESS_DBFS", "-20").lower()
+TTS_LOUDNESS_DBFS = None if _loudness in ("", "off", "none") else float(_loudness)
+TTS_MAX_GAIN_DB = float(os.getenv("TTS_MAX_GAIN_DB", "12"))
+TTS_PEAK_DBFS = float(os.getenv("TTS_PEAK_DBFS", "-1"))
+
+FULL_SCALE = 32768.0
+
+
+@dataclass
+class PostInfo:
+    duration: float      # seconds, after trimming
+    trimmed: float       # seconds of silence removed
+    gain_db: float = 0.0
+
+
+def wav_header(sample_rate, channels, sample_width, data_size) -> bytes:
+    """Canonical 44-byte PCM header (data_size 0xFFFFFFFF: unknown yet, still streaming)."""
+    header = b"RIFF" + struct.pack("<I", min(0xFFFFFFFF, data_size + 36)) + b"WAVE"
+    header += b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate,
+                                    sample_rate * channels * sample_width,
+                                    channels * sample_width, sample_width * 8)
+    return header + b"data" + struct.pack("<I", data_size)
+
+
+def read_pcm(data: bytes):
+    """
+    (WavInfo, samples) for a complete WAV held in memory: float32 frames x channels in
+    [-1, 1), or None for samples when it isn't 16-bit PCM.
+    """
+    info = parse_wav_header(data[:4096])
+    if info is None:
+        raise ValueError("WAV header not found")
+    data_size = info.data_size
+    if data_size is None or info.data_offset + data_size > len(data):
+        data_size = len(data) - info.data_offset
+    data_size -= data_size % (info.channels * info.sample_width)
+    info.data_size = data_size
+    if info.sample_width != 2:
+        return info, None
+    pcm = np.frombuffer(data, dtype="<i2", count=data_size // 2, offset=info.data_offset)
+    return info, pcm.reshape(-1, info.channels).astype(np.float32) / FULL_SCALE
+
+
+def to_pcm16(samples: np.ndarray) -> bytes:
+    return np.clip(np.round(samples * FULL_SCALE), -FULL_SCALE, FULL_SCALE - 1).astype("<i2").tobytes()
+
+
+def db(value):
+    return 20.0 * np.log10(np.maximum(value, 1e-10))
+
+
+def voiced_range(samples: np.ndarray, sample_rate, floor_db=TTS_TRIM_FLOOR_DB,
+                 window_ms=TTS_TRIM_WINDOW_MS, pad_ms=TTS_TRIM_PAD_MS):
+    """(start, end) frame indices of the clip without its leading/trailing silence."""
+    frames = len(samples)
+    window = max(1, int(sample_rate * window_ms / 1000))
+    n = frames // window
+    if n == 0:
+        return 0, frames
+    # RMS per window over every channel, in dBFS
+    blocks = samples[:n * window].reshape(n, -1)
+    rms = np.sqrt(np.mean(blocks * blocks, axis=1))
+    loud = np.flatnonzero(db(rms) > floor_db)
+    if loud.size == 0:
+        # nothing but silence: leave it alone rather than play nothing
+        return 0, frames
+    pad = int(sample_rate * pad_ms / 1000)
+    start = max(0, loud[0] * window - pad)
+    end = min(frames, (loud[-1] + 1) * window + pad)
+    return start, end
+
+
+def post_process(data: bytes, trim=True, loudness_dbfs=TTS_LOUDNESS_DBFS):
+    """
+    Trim silence and normalize loudness of a complete WAV held in memory.
+
+    Returns (wav bytes, PostInfo). The input comes back unchanged (with trimmed=0)
+    when post-processing is off or the format isn't 16-bit PCM.
+    """
+    info, samples = read_pcm(data)
+    duration = info.data_size / info.byte_rate
+    if not TTS_POSTPROCESS or samples is None or not len(samples):
+        return data, PostInfo(duration=duration, trimmed=0.0)
+
+    start, end = voiced_range(samples, info.sample_rate) if trim else (0, len(samples))
+    samples = samples[start:end]
+
+    gain_db = 0.0
+    if loudness_dbfs is not None and len(samples):
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        peak = float(np.max(np.abs(samples)))
+        # a clip that is all silence isn't worth boosting
+        if db(rms) > TTS_TRIM_FLOOR_DB and peak > 0:
+            gain_db = min(loudness_dbfs - float(db(rms)), TTS_MAX_GAIN_DB, TTS_PEAK_DBFS - float(db(peak)))
+            samples = samples * (10.0 ** (gain_db / 20.0))
+
+    out = to_pcm16(samples)
+    new_duration = len(samples) / info.sample_rate
+    header = wav_header(info.sample_rate, info.channels, info.sample_width, len(out))
+    return header + out, PostInfo(duration=new_duration, trimmed=round(duration - new_duration, 4), gain_db=round(gain_db, 2))
@@ -0,0 +1,225 @@
+# audio_store.py - where synthesized clips are written and how the avatar reaches them
+#
+# Each clip is written exactly once, into AUDIO_STORE_DIR, and cued to the browser as
+# AUDIO_URL/<name>. Duration comes from the WAV header of the bytes we already hold,
+# so nothing is copied or reopened after synthesis.
+#
+# Defaults match the usual setup: client/audio is served by vite as audio/...
+# To keep clips in RAM, point the store and server.py at a tmpfs and let server.py
+# serve them:
+#     AUDIO_STORE_DIR=/dev/shm/riko_audio  AUDIO_DIR=/dev/shm/riko_audio
+#     AUDIO_URL=http://localhost:8001/audio_stream
+#
+# Retention: a clip is deleted AUDIO_KEEP_PLAYED seconds after it finished playing
+# (the browser may still be fetching it), or right away if its reply was cut before
+# it played. Clips nobody played are dropped after AUDIO_STORE_MAX_AGE seconds. Past
+# AUDIO_STORE_MAX_MB, played clips go first, least recently used first. Clips being
+# written, queued for playback or playing are never evicted for size (a queued clip
+# would 404 when its turn comes), so a long queue can briefly go over the limit.
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from process.tts_func.wav_stream import parse_wav_header
+
+AUDIO_STORE_DIR = os.getenv("AUDIO_STORE_DIR", "client/audio")
+AUDIO_URL = os.getenv("AUDIO_URL", "audio").rstrip("/")
+MAX_BYTES = int(float(os.getenv("AUDIO_STORE_MAX_MB", "256")) * 1024 * 1024)
+MAX_AGE = float(os.getenv("AUDIO_STORE_MAX_AGE", "1800"))
+KEEP_PLAYED = float(os.getenv("AUDIO_KEEP_PLAYED", "30"))
+
+# clip states
+PENDING = "pending"   # name reserved, file being written
+READY = "ready"       # complete, waiting for its turn
+PLAYING = "playing"
+PLAYED = "played"
+
+
+@dataclass
+class Clip:
+    name: str
+    path: Path
+    url: str
+    duration: float = 0.0  # seconds, known once the clip is complete
+    size: int = 0          # bytes on disk
+    state: str = PENDING
+    created_at: float = field(default_factory=time.time)
+    played_at: float = 0.0
+    released: bool = False  # dropped before playing; delete as soon as it's written
+
+
+def wav_duration(data: bytes) -> float:
+    """Duration of a complete WAV held in memory (placeholder sizes are tolerated)."""
+    info = parse_wav_header(data[:4096])
+    if info is None:
+        raise ValueError("WAV header not found")
+    data_size = info.data_size
+    if data_size is None or info.data_offset + data_size > len(data):
+        data_size = len(data) - info.data_offset
+    return data_size / info.byte_rate
+
+
+def clip_name(ref) -> str:
+    """Clip name from a Clip, a path or a cue URL (".../audio_stream/output_x.wav")."""
+    if isinstance(ref, Clip):
+        return ref.name
+    return Path(str(ref)).name
+
+
+class AudioStore:
+    def __init__(self, root=AUDIO_STORE_DIR, url=AUDIO_URL,
+                 max_bytes=MAX_BYTES, max_age=MAX_AGE, keep_played=KEEP_PLAYED):
+        self.root = Path(root)
+        self.url = url
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep_played = keep_played
+        # least recently used first
+        self.clips = OrderedDict()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._adopted = False
+
+    def ensure_dir(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        if not self._adopted:
+            self._adopted = True
+            self.adopt(self.root)
+
+    def adopt(self, directory):
+        """Track clips left in `directory` by earlier runs so the limits apply to them too."""
+        directory = Path(directory)
+        if not directory.is_dir():
+            return
+        with self._lock:
+            for path in directory.glob("output_*.wav*"):
+                if path.name.endswith(".part"):
+                    # writer died mid-clip in a previous run
+                    with suppress(OSError):
+                        path.unlink()
+                    continue
+                if path.name in self.clips:
+                    continue
+                with suppress(OSError):
+                    st = path.stat()
+                    clip = Clip(name=path.name, path=path, url=f"{self.url}/{path.name}",
+                                size=st.st_size, state=PLAYED,
+                                created_at=st.st_mtime, played_at=st.st_mtime)
+                    self.clips[clip.name] = clip
+                    self.total_bytes += clip.size
+            # oldest first, so LRU eviction removes them before anything new
+            for clip in sorted(self.clips.values(), key=lambda c: c.played_at):
+                if clip.state == PLAYED:
+                    self.clips.move_to_end(clip.name, last=False)
+        self.sweep()
+
+    # ---------------------------
+    # Writing
+    # ---------------------------
+
+    def new_clip(self) -> Clip:
+        """Reserve a unique name for a clip (the file is written by save() or by a streaming writer)."""
+        name = f"output_{uuid.uuid4().hex}.wav"
+        clip = Clip(name=name, path=self.root / name, url=f"{self.url}/{name}")
+        with self._lock:
+            self.clips[name] = clip
+        return clip
+
+    def save(self, clip: Clip, data: bytes) -> Clip:
+        """Write a complete clip in one go and fill in its duration from the bytes."""
+        self.ensure_dir()
+        with open(clip.path, "wb") as f:
+            f.write(data)
+        clip.duration = wav_duration(data)
+        self._set_size(clip, len(data))
+        self.sweep()
+        return clip
+
+    def put(self, data: bytes) -> Clip:
+        return self.save(self.new_clip(), data)
+
+    def finished(self, ref, duration=0.0):
+        """A streaming writer is done with the clip: record its final size."""
+        clip = self.clips.get(clip_name(ref))
+        if clip is None:
+            return
+        clip.duration = duration or clip.duration
+        with suppress(OSError):
+            self._set_size(clip, clip.path.stat().st_size)
+        self.sweep()
+
+    def _set_size(self, clip: Clip, size: int):
+        with self._lock:
+            self.total_bytes += size - clip.size
+            clip.size = size
+            if clip.state == PENDING:
+                clip.state = READY
+            if clip.released:
+                self._remove(clip)
+
+    # ---------------------------
+    # Playback state
+    # ---------------------------
+
+    def playing(self, ref):
+        with self._lock:
+            clip = self.clips.get(clip_name(ref))
+            if clip is not None:
+                clip.state = PLAYING
+                self.clips.move_to_end(clip.name)
+
+    def played(self, ref):
+        with self._lock:
+            clip = self.clips.get(clip_name(ref))
+            if clip is not None:
+                clip.state = PLAYED
+                clip.played_at = time.time()
+        self.sweep()
+
+    def release(self, ref):
+        """The clip will never be played (its reply was cut): delete it now."""
+        with self._lock:
+            clip = self.clips.get(clip_name(ref))
+            if clip is None or clip.state == PLAYING:
+                return
+            if clip.state == PENDING:
+                # still being written: delete once the writer is done
+                clip.released = True
+                return
+            self._remove(clip)
+
+    # ---------------------------
+    # Eviction
+    # ---------------------------
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            for clip in list(self.clips.values()):
+                if clip.state == PLAYED and now - clip.played_at > self.keep_played:
+                    self._remove(clip)
+                elif clip.state in (READY, PENDING) and now - clip.created_at > self.max_age:
+                    # never played (or its writer gave up)
+                    self._remove(clip)
+
+            # size cap: played clips only, least recently used first
+            for clip in list(self.clips.values()):
+                if self.total_bytes <= self.max_bytes:
+                    return
+                if clip.state == PLAYED:
+                    self._remove(clip)
+
+    def _remove(self, clip: Clip):
+        # caller holds the lock
+        with suppress(OSError):
+            clip.path.unlink()
+        self.clips.pop(clip.name, None)
+        self.total_bytes -= clip.size
+
+
+store = AudioStore()
@@ -0,0 +1,102 @@
+# reply_stream.py - one continuous WAV per reply instead of one clip per chunk
+#
+# With one file per chunk the browser fetches, decodes and starts a new clip for every
+# sentence, which costs a gap each time. With AUDIO_REPLY_STREAM=1, main_chat appends
+# the chunks of a reply, in order, to a single growing WAV; server.py's /audio_stream
+# tails it while the ".part" marker exists (as for streaming_mode), so the avatar gets
+# one talk cue per reply and one audio element plays it start to finish.
+#
+# Consecutive chunks overlap by REPLY_CROSSFADE_MS with a linear crossfade, so there is
+# no click at the joins. The last frames of a chunk are held back until the next chunk
+# (or the end of the reply) arrives to make that possible. append() returns where the
+# chunk starts in the stream; main_chat sends it to the clients as a reply_marker cue
+# with the chunk's text, for subtitles and expressions.
+#
+# A ReplyStream is a WavStream, so PlaybackWorker handles it like a streamed clip.
+import os
+import threading
+from contextlib import suppress
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from process.tts_func.audio_post import read_pcm, to_pcm16, wav_header
+from process.tts_func.wav_stream import WavStream, finalize_wav_header
+
+REPLY_CROSSFADE_MS = float(os.getenv("REPLY_CROSSFADE_MS", "15"))
+
+
+class ReplyStream(WavStream):
+    def __init__(self, path, crossfade_ms=REPLY_CROSSFADE_MS):
+        super().__init__(path)
+        self.crossfade_ms = crossfade_ms
+        self.part_marker = Path(str(self.path) + ".part")
+        self.part_marker.touch()
+        self.frames_written = 0
+        self._held = None   # last frames of the previous chunk, not written yet
+        self._file = None
+        self._lock = threading.Lock()
+
+    def append(self, data: bytes) -> Optional[float]:
+        """
+        Append a complete WAV clip; returns its start in the stream (seconds), or None
+        if the reply is already over (cancelled).
+        """
+        info, samples = read_pcm(data)
+        if samples is None:
+            raise ValueError(f"reply stream needs 16-bit PCM, got {info.sample_width * 8}-bit")
+        with self._lock:
+            if self.done.is_set():
+                return None
+            if self._file is None:
+                self._file = open(self.path, "wb")
+                self._write(wav_header(info.sample_rate, info.channels, 2, 0xFFFFFFFF))
+            elif (info.sample_rate, info.channels) != (self.info.sample_rate, self.info.channels):
+                raise ValueError(
+                    f"chunk is {info.sample_rate} Hz x{info.channels}, the reply stream "
+                    f"{self.info.sample_rate} Hz x{self.info.channels}"
+                )
+
+            held = self._held if self._held is not None else samples[:0]
+            n = min(len(held), len(samples))
+            if n:
+                fade = np.linspace(0.0, 1.0, n, dtype=np.float32)[:, None]
+                joined = held[-n:] * (1.0 - fade) + samples[:n] * fade
+                out = np.concatenate([held[:len(held) - n], joined, samples[n:]])
+            else:
+                out = np.concatenate([held, samples])
+            start = (self.frames_written + len(held) - n) / info.sample_rate
+
+            keep = min(len(out), int(info.sample_rate * self.crossfade_ms / 1000))
+            self._write_frames(out[:len(out) - keep])
+            self._held = out[len(out) - keep:]
+            return start
+
+    def finish(self, error: Optional[BaseException] = None):
+        """End the reply: write what's held back, fix up the header, drop the marker."""
+        with self._lock:
+            if self.done.is_set():
+                return
+            try:
+                if self._file is not None:
+                    if self._held is not None:
+                        self._write_frames(self._held)
+                        self._held = None
+                    self._file.close()
+                    finalize_wav_header(self.path, self.info, self.bytes_written)
+            finally:
+                with suppress(OSError):
+                    self.part_marker.unlink()
+                super().finish(error)
+
+    def _write_frames(self, frames: np.ndarray):
+        # caller holds the lock
+        if len(frames):
+            self._write(to_pcm16(frames))
+            self.frames_written += len(frames)
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+        self.feed(data)
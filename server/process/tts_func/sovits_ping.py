@@ -1,10 +1,15 @@
-import requests
+from process.net_func import http_session
 ### MUST START SERVERS FIRST USING START ALL SERVER SCRIPT
+import os
 import time
 import soundfile as sf 
-import sounddevice as sd
 import yaml
+import requests
 from pathlib import Path
+from contextlib import contextmanager, suppress
+from process.tts_func.wav_stream import WavStream, finalize_wav_header
+from process.tts_func.tts_cache import cache as tts_cache
+from process.tts_func.sovits_pool import pool_from_config
 
 
 # Load YAML config
@@ -21,83 +26,350 @@ def load_char_config():
         return {}
 
 
+class TTSCancelled(RuntimeError):
+    """Raised by sovits_gen when its cancel_event is set (e.g. user barge-in)."""
+
+
+# how often a chunk waiting for a free SoVITS slot checks its cancel_event
+ACQUIRE_POLL = 0.2
+
+
+# every SoVITS instance we can synthesize on (base_urls / SOVITS_URLS, see sovits_pool.py)
+sovits_pool = pool_from_config(char_config.get("sovits_ping_config", {}))
+http_session.set_hosts("sovits", len(sovits_pool.instances))
+
+
 def get_wav_duration(path):
     with sf.SoundFile(path) as f:
         return len(f) / f.samplerate
 
 def play_audio(path):
+    import sounddevice as sd  # only for local playback, synthesis doesn't need an audio device
+
     data, samplerate = sf.read(path)
     sd.play(data, samplerate)
     sd.wait()  # Wait until playback is finished
 
-def sovits_set_default_reference(refer_wav_path, prompt_text, prompt_language="auto"):
-    import os, requests
-    base_url = os.getenv("SOVITS_URL", "http://127.0.0.1:9880").rstrip("/")
-    url = f"{base_url}/change_refer"
-    payload = {
-        "refer_wav_path": refer_wav_path,
-        "prompt_text": prompt_text,
-        "prompt_language": prompt_language,
+# ---------------------------
+# Reference session
+# ---------------------------
+# With the reference in every payload, api.py reloads and re-encodes the reference wav
+# for every chunk. In session mode (sovits_ping_config.reference_mode, default
+# "session") it is registered once per instance with /change_refer and chunks only
+# carry the text. Each pool instance remembers which reference it holds and gets it
+# again when:
+#   - the reference changes (sovits_set_default_reference, or the wav is re-recorded)
+#   - the instance failed (it may come back as a fresh process)
+#   - it answers 400 to a request without reference (restarted without a preset)
+# reference_mode: per_request sends the reference every time as before; servers
+# without /change_refer fall back to that by themselves.
+REFERENCE_FIELDS = ("refer_wav_path", "prompt_text", "prompt_language")
+
+# set by sovits_set_default_reference; None = the one from sovits_ping_config
+_reference_override = None
+# instances that don't know /change_refer
+_no_session = set()
+
+
+def current_reference() -> dict:
+    if _reference_override is not None:
+        return dict(_reference_override)
+    cfg = char_config.get("sovits_ping_config", {})
+    return {
+        "refer_wav_path": cfg.get("refer_wav_path"),
+        "prompt_text": cfg.get("prompt_text", "Bonjour, ceci est un enregistrement de test."),
+        "prompt_language": cfg.get("prompt_language", "auto"),
     }
-    r = requests.post(url, json=payload, timeout=30)
-    if r.status_code != 200:
-        raise RuntimeError(f"change_refer HTTP {r.status_code}: {r.text}")
-    return r.json()
 
 
-def sovits_gen(in_text, output_wav_pth="output.wav"):
+def _reference_key(ref: dict):
+    # re-recording the wav under the same name must register it again
+    stat = None
+    with suppress(OSError, TypeError):
+        st = os.stat(ref["refer_wav_path"])
+        stat = (st.st_size, st.st_mtime_ns)
+    return tuple(ref[k] for k in REFERENCE_FIELDS) + (stat,)
+
+
+def session_mode(instance) -> bool:
+    mode = char_config.get("sovits_ping_config", {}).get("reference_mode", "session")
+    return mode == "session" and instance.base_url not in _no_session
+
+
+def register_reference(instance, force=False) -> bool:
+    """
+    Make sure `instance` holds the current reference (POST /change_refer if it doesn't).
+
+    Returns False if the server can't keep one: it then gets the reference with every
+    request. Connection errors are raised like for a synthesis request.
+    """
+    ref = current_reference()
+    key = _reference_key(ref)
+    with instance.reference_lock:
+        if instance.reference == key and not force:
+            return True
+        start = time.monotonic()
+        r = http_session.post("sovits", f"{instance.base_url}/change_refer", json=ref, timeout=(5.0, 30.0))
+        if r.status_code in (404, 405):
+            print(f"[TTS] {instance.base_url} has no /change_refer, sending the reference with every chunk")
+            _no_session.add(instance.base_url)
+            return False
+        if r.status_code != 200:
+            raise RuntimeError(f"change_refer HTTP {r.status_code}: {r.text[:300]}")
+        instance.reference = key
+    print(f"[TTS] reference registered on {instance.base_url} in {time.monotonic() - start:.2f}s")
+    return True
+
+
+def instance_payload(payload: dict, instance):
+    """
+    (payload, lean) for sending `payload` to this instance: without the reference
+    fields when the instance holds the reference (registering it first if needed).
+    """
+    if not session_mode(instance) or not register_reference(instance):
+        return payload, False
+    return {k: v for k, v in payload.items() if k not in REFERENCE_FIELDS}, True
+
+
+def sovits_set_default_reference(refer_wav_path=None, prompt_text=None, prompt_language="auto"):
+    """
+    Register the voice reference on every SoVITS instance of the pool.
+
+    With a refer_wav_path, it replaces sovits_ping_config's reference for the rest of
+    the session (e.g. switching character); without, the configured one is registered
+    (startup). An instance that can't be reached now gets it with its next chunk.
+    """
+    global _reference_override
+    if refer_wav_path is not None:
+        _reference_override = {
+            "refer_wav_path": refer_wav_path,
+            "prompt_text": prompt_text,
+            "prompt_language": prompt_language,
+        }
+    for instance in sovits_pool.instances:
+        if not session_mode(instance):
+            continue
+        try:
+            register_reference(instance, force=refer_wav_path is not None)
+        except (requests.RequestException, RuntimeError) as e:
+            print(f"[TTS] could not register the reference on {instance.base_url}: {e}")
+
+
+def sovits_request(in_text, streaming=False, base_url=None):
+    """
+    Build the GPT-SoVITS request for in_text from sovits_ping_config.
+
+    Returns (url, payload). Shared by sovits_gen and the async engine so both send
+    exactly the same parameters. `base_url` picks a pool instance (default: base_url).
+    The payload always carries the reference (it's part of the TTS cache key);
+    instance_payload() drops it for an instance that already holds it.
+    """
     import os
-    import json
-    import requests
 
     # --- Charger config YAML (tu l'as déjà dans ce fichier normalement) ---
     # char_config = yaml.safe_load(...)
     # cfg = char_config.get("sovits_ping_config", {})
     cfg = char_config.get("sovits_ping_config", {})  # si ton code existe déjà
 
-    base_url = cfg.get("base_url", "http://127.0.0.1:9880").rstrip("/")
-    refer_wav_path = cfg.get("refer_wav_path")  # ex: E:\riko_project_patreon\audio\test_recording.wav
-    prompt_text = cfg.get("prompt_text", "Bonjour, ceci est un enregistrement de test.")
-    prompt_language = cfg.get("prompt_language", "auto")
+    base_url = (base_url or cfg.get("base_url", "http://127.0.0.1:9880")).rstrip("/")
+    # ex: E:\riko_project_patreon\audio\test_recording.wav (or the one from sovits_set_default_reference)
+    reference = current_reference()
+    refer_wav_path = reference["refer_wav_path"]
     text_language = cfg.get("text_language", "auto")
 
     payload = {
         "text": in_text,
         "text_language": text_language,
-        "refer_wav_path": refer_wav_path,
-        "prompt_text": prompt_text,
-        "prompt_language": prompt_language,
+        **reference,
         "top_k": int(cfg.get("top_k", 15)),
         "top_p": float(cfg.get("top_p", 1.0)),
         "temperature": float(cfg.get("temperature", 1.0)),
         "speed": float(cfg.get("speed", 1.0)),
     }
+    if streaming and cfg.get("streaming_mode", False):
+        payload["streaming_mode"] = True
 
     # Sécurité: si pas de ref dans cfg, le serveur répond 400 "未指定参考音频且接口无预设"
     if not refer_wav_path or not os.path.exists(refer_wav_path):
         raise FileNotFoundError(f"refer_wav_path introuvable: {refer_wav_path}")
 
     # --- Appel API (POST /) ---
-    url = f"{base_url}/"
+    return f"{base_url}/", payload
+
+
+def _acquire(in_text, tried, cancel_event):
+    """sovits_pool.acquire, giving up with TTSCancelled if cancel_event is set while waiting."""
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise TTSCancelled(in_text)
+        try:
+            return sovits_pool.acquire(exclude=tried, timeout=ACQUIRE_POLL)
+        except TimeoutError:
+            continue
+
+
+@contextmanager
+def _sovits_response(in_text, streaming=False, cancel_event=None):
+    """
+    POST the synthesis request to the least busy pool instance and yield the response
+    once it's known to carry audio. The instance's slot is held until the body has been
+    read; an instance that can't be reached or answers 5xx is taken out of the pool
+    and the request moves to the next one. In session mode the payload leaves the
+    reference out (see instance_payload).
+    """
+    import json
+
     headers = {"Content-Type": "application/json"}
+    tried = []
+    reregistered = False
+    while True:
+        instance = _acquire(in_text, tried, cancel_event)
+        failed = False
+        try:
+            url, payload = sovits_request(in_text, streaming=streaming, base_url=instance.base_url)
+            try:
+                payload, lean = instance_payload(payload, instance)
+                r = http_session.post("sovits", url, headers=headers, data=json.dumps(payload), stream=True)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                failed = True
+                tried.append(instance)
+                if len(tried) >= len(sovits_pool.instances):
+                    raise
+                print(f"[TTS] {instance.base_url} unreachable ({e}), trying another instance")
+                continue
 
-    r = requests.post(url, headers=headers, data=json.dumps(payload), stream=True, timeout=300)
+            if r.status_code >= 500 and len(tried) + 1 < len(sovits_pool.instances):
+                failed = True
+                tried.append(instance)
+                print(f"[TTS] {instance.base_url} HTTP {r.status_code}, trying another instance")
+                r.close()
+                continue
 
-    # Si erreur, on affiche le texte au lieu d'écrire un faux wav
-    if r.status_code != 200:
-        raise RuntimeError(f"SoVITS HTTP {r.status_code}: {r.text[:300]}")
+            if lean and r.status_code == 400 and not reregistered:
+                # restarted without our reference ("未指定参考音频且接口无预设"): register it again
+                print(f"[TTS] {instance.base_url} lost the reference (restarted?), retrying")
+                instance.forget_reference()
+                reregistered = True
+                r.close()
+                continue
 
-    # Vérif contenu
-    ctype = (r.headers.get("content-type") or "").lower()
-    if "audio" not in ctype and "wav" not in ctype:
-        # Souvent: erreur JSON renvoyée quand même en 200 selon certaines configs
-        raw = r.content[:300]
-        raise RuntimeError(f"Réponse non-audio (content-type={ctype}). Début={raw!r}")
+            # Si erreur, on affiche le texte au lieu d'écrire un faux wav
+            if r.status_code != 200:
+                raise RuntimeError(f"SoVITS HTTP {r.status_code}: {r.text[:300]}")
 
-    os.makedirs(os.path.dirname(output_wav_pth) or ".", exist_ok=True)
-    with open(output_wav_pth, "wb") as f:
+            # Vérif contenu
+            ctype = (r.headers.get("content-type") or "").lower()
+            if "audio" not in ctype and "wav" not in ctype:
+                # Souvent: erreur JSON renvoyée quand même en 200 selon certaines configs
+                raw = r.content[:300]
+                raise RuntimeError(f"Réponse non-audio (content-type={ctype}). Début={raw!r}")
+
+            try:
+                yield r
+            except requests.RequestException:
+                # the instance died mid-clip
+                failed = True
+                raise
+            finally:
+                r.close()
+            return
+        finally:
+            sovits_pool.release(instance, failed=failed)
+
+
+def _cached_clip(in_text, timeline=None):
+    """(cache key, WAV bytes or None) for in_text from the TTS cache."""
+    key = tts_cache.key(sovits_request(in_text)[1])
+    data = tts_cache.get(key)
+    if data is not None:
+        if timeline is not None:
+            timeline.mark("tts_first_byte")
+        stats = tts_cache.stats()
+        print(f"[tts cache] hit ({stats['hits']} hits / {stats['misses']} misses)")
+    return key, data
+
+
+def sovits_bytes(in_text, cancel_event=None, timeline=None) -> bytes:
+    """
+    Synthesize in_text with GPT-SoVITS and return the WAV bytes without touching disk.
+
+    Cancellation and the "tts_first_byte" timeline mark work as in sovits_gen.
+    Clips already in the TTS cache are returned without calling SoVITS.
+    """
+    key, data = _cached_clip(in_text, timeline)
+    if data is not None:
+        return data
+
+    body = bytearray()
+    with _sovits_response(in_text, cancel_event=cancel_event) as r:
         for chunk in r.iter_content(chunk_size=1024 * 64):
+            if cancel_event is not None and cancel_event.is_set():
+                raise TTSCancelled(in_text)
             if chunk:
-                f.write(chunk)
+                if timeline is not None:
+                    timeline.mark("tts_first_byte")
+                body += chunk
+    tts_cache.put(key, bytes(body))
+    return bytes(body)
+
+
+def sovits_gen(in_text, output_wav_pth="output.wav", stream: WavStream = None, cancel_event=None, timeline=None):
+    """
+    Synthesize in_text with GPT-SoVITS and write the WAV to output_wav_pth.
+
+    If a WavStream is given, the file is written progressively: every received chunk is
+    flushed to disk and fed to the stream (so playback can start on the first bytes),
+    a "<output>.part" marker exists while writing, and the header sizes are fixed up at
+    the end. With sovits_ping_config.streaming_mode the server is also asked to stream.
+
+    If cancel_event is set before the request or while the body is streaming, the
+    connection is dropped and TTSCancelled is raised.
+
+    A TurnTimeline, if given, gets a "tts_first_byte" mark when the body starts arriving.
 
-    return output_wav_pth
\ No newline at end of file
+    Clips already in the TTS cache (tts_cache.py) are written without calling SoVITS.
+    """
+    import os
+
+    if stream is None:
+        data = sovits_bytes(in_text, cancel_event=cancel_event, timeline=timeline)
+        os.makedirs(os.path.dirname(output_wav_pth) or ".", exist_ok=True)
+        with open(output_wav_pth, "wb") as f:
+            f.write(data)
+        return output_wav_pth
+
+    os.makedirs(os.path.dirname(output_wav_pth) or ".", exist_ok=True)
+    key, data = _cached_clip(in_text, timeline)
+    if data is not None:
+        with open(output_wav_pth, "wb") as f:
+            f.write(data)
+        stream.feed(data)
+        stream.finish()
+        return output_wav_pth
+
+    part_marker = output_wav_pth + ".part"
+    Path(part_marker).touch()
+    try:
+        with _sovits_response(in_text, streaming=True, cancel_event=cancel_event) as r, \
+                open(output_wav_pth, "wb") as f:
+            for chunk in r.iter_content(chunk_size=1024 * 4):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise TTSCancelled(in_text)
+                if chunk:
+                    if timeline is not None:
+                        timeline.mark("tts_first_byte")
+                    f.write(chunk)
+                    f.flush()
+                    stream.feed(chunk)
+        if stream.info is None:
+            raise RuntimeError(f"SoVITS stream ended before a WAV header ({stream.bytes_written} bytes)")
+        if stream.info.data_size is None:
+            finalize_wav_header(output_wav_pth, stream.info, stream.bytes_written)
+    finally:
+        with suppress(OSError):
+            os.remove(part_marker)
+    stream.finish()
+    if key is not None:
+        with suppress(OSError):
+            tts_cache.put(key, Path(output_wav_pth).read_bytes())
+    return output_wav_pth
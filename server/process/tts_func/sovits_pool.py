@@ -0,0 +1,151 @@
+# sovits_pool.py - spread synthesis over several GPT-SoVITS instances
+#
+# sovits_ping_config.base_urls (or SOVITS_URLS=url1,url2 in the environment) lists the
+# instances; without it the pool is just base_url. Each chunk goes to the least busy
+# healthy instance, at most max_concurrency requests per instance at once (default 2:
+# one synthesizing and one waiting on the instance, so it never idles between chunks).
+# Playback order is not affected: main_chat's SynthesisWorker hands clips over in
+# chunk order.
+#
+# An instance that fails (connection error, 5xx) is taken out for SOVITS_COOLDOWN
+# seconds and the request moves to another one; a health thread probes it until it
+# answers again.
+import os
+import threading
+import time
+
+import requests
+
+from process.net_func import http_session
+
+SOVITS_COOLDOWN = float(os.getenv("SOVITS_COOLDOWN", "15"))
+HEALTH_INTERVAL = float(os.getenv("SOVITS_HEALTH_INTERVAL", "5"))
+
+
+class Instance:
+    def __init__(self, base_url, max_concurrency=2):
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        # reference registered on the server with /change_refer (see sovits_ping.py)
+        self.reference = None
+        self.reference_lock = threading.Lock()
+
+    def forget_reference(self):
+        # taken like register_reference does, so a registration in flight can't undo it
+        with self.reference_lock:
+            self.reference = None
+
+    def healthy(self, now) -> bool:
+        return now >= self.down_until
+
+    def load(self) -> float:
+        return self.active / self.max_concurrency
+
+
+class SoVITSPool:
+    def __init__(self, base_urls, max_concurrency=2, cooldown=SOVITS_COOLDOWN):
+        self.instances = [Instance(url, max_concurrency) for url in base_urls]
+        self.cooldown = cooldown
+        self._cond = threading.Condition()
+        self._health_thread = None
+
+    @property
+    def capacity(self) -> int:
+        return sum(i.max_concurrency for i in self.instances)
+
+    def acquire(self, exclude=(), timeout=None) -> Instance:
+        """
+        Reserve a slot on the least busy healthy instance, waiting for one to free up.
+
+        Instances in `exclude` (already failed for this request) are skipped unless
+        nothing else is left. If every instance is down they are all tried anyway.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                healthy = [i for i in self.instances if i.healthy(now)] or self.instances
+                candidates = [i for i in healthy if i not in exclude] or healthy
+                free = [i for i in candidates if i.active < i.max_concurrency]
+                if free:
+                    instance = min(free, key=lambda i: (i.load(), i.requests))
+                    instance.active += 1
+                    instance.requests += 1
+                    return instance
+                wait = 0.5 if deadline is None else min(0.5, deadline - now)
+                if wait <= 0:
+                    raise TimeoutError("timed out waiting for a SoVITS slot")
+                # also wakes up periodically in case an instance comes back
+                self._cond.wait(wait)
+
+    def release(self, instance: Instance, failed=False):
+        with self._cond:
+            instance.active -= 1
+            if failed and len(self.instances) > 1:
+                instance.failures += 1
+                instance.down_until = time.monotonic() + self.cooldown
+                print(f"[sovits pool] {instance.base_url} failed, out for {self.cooldown:.0f}s")
+                self._start_health_checks()
+            self._cond.notify_all()
+        if failed:
+            # it may come back as a fresh process without our reference (outside the
+            # pool lock: a registration can hold reference_lock for a while)
+            instance.forget_reference()
+
+    # ---------------------------
+    # Health checks
+    # ---------------------------
+
+    def _start_health_checks(self):
+        # caller holds the lock
+        if len(self.instances) > 1 and (self._health_thread is None or not self._health_thread.is_alive()):
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(HEALTH_INTERVAL)
+            with self._cond:
+                down = [i for i in self.instances if not i.healthy(time.monotonic())]
+            if not down:
+                return
+            for instance in down:
+                if probe(instance.base_url):
+                    instance.forget_reference()
+                    with self._cond:
+                        instance.down_until = 0.0
+                        self._cond.notify_all()
+                    print(f"[sovits pool] {instance.base_url} is back")
+                else:
+                    with self._cond:
+                        instance.down_until = time.monotonic() + self.cooldown
+
+    def stats(self) -> list:
+        with self._cond:
+            now = time.monotonic()
+            return [
+                {"url": i.base_url, "active": i.active, "requests": i.requests,
+                 "failures": i.failures, "healthy": i.healthy(now)}
+                for i in self.instances
+            ]
+
+
+def probe(base_url, timeout=2.0) -> bool:
+    """True if the instance answers HTTP at all (api.py replies 400 to an empty GET)."""
+    try:
+        http_session.get("sovits", f"{base_url}/", timeout=timeout)
+        return True
+    except requests.RequestException:
+        return False
+
+
+def pool_from_config(cfg: dict) -> SoVITSPool:
+    env_urls = [u.strip() for u in os.getenv("SOVITS_URLS", "").split(",") if u.strip()]
+    urls = env_urls or cfg.get("base_urls") or [cfg.get("base_url", "http://127.0.0.1:9880")]
+    if isinstance(urls, str):
+        urls = [urls]
+    return SoVITSPool(urls, max_concurrency=int(cfg.get("max_concurrency", 2)))
@@ -0,0 +1,135 @@
+# tts_cache.py - content-addressed cache of SoVITS clips
+#
+# The same sentences get synthesized over and over (greetings, catchphrases,
+# check_setup's test sentence). A clip is stored under the hash of everything that
+# shapes the audio: the cleaned text, the reference wav (path + size + mtime, so
+# re-recording it invalidates the cache), the prompt text, the languages and
+# top_k / top_p / temperature / speed. A hit returns the stored WAV without calling
+# SoVITS.
+#
+# TTS_CACHE:
+#   on             cache every clip (default; with temperature > 0 the first take
+#                  of a sentence is simply reused)
+#   deterministic  only cache when sampling is deterministic (top_k == 1 or
+#                  temperature == 0)
+#   off            never cache
+# TTS_CACHE_DIR (default cache/tts) is capped at TTS_CACHE_MAX_MB, least recently
+# used clips first. Hits and misses are counted (stats()).
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import suppress
+from pathlib import Path
+
+TTS_CACHE = os.getenv("TTS_CACHE", "on").lower()
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "cache/tts")
+TTS_CACHE_MAX_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+# payload fields that change the audio (streaming_mode only changes the transport)
+KEY_FIELDS = ("text", "text_language", "refer_wav_path", "prompt_text", "prompt_language",
+              "top_k", "top_p", "temperature", "speed")
+
+
+class TTSCache:
+    def __init__(self, root=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES, mode=TTS_CACHE):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        # name -> size, least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def key(self, payload: dict):
+        """Cache key for a SoVITS request payload, or None when it shouldn't be cached."""
+        if self.mode in ("off", "0", "false", "no"):
+            return None
+        if self.mode == "deterministic" and not (
+            int(payload.get("top_k", 15)) == 1 or float(payload.get("temperature", 1.0)) == 0.0
+        ):
+            return None
+        fields = {k: payload.get(k) for k in KEY_FIELDS}
+        ref = payload.get("refer_wav_path")
+        with suppress(OSError, TypeError):
+            st = os.stat(ref)
+            fields["refer_wav_stat"] = [st.st_size, int(st.st_mtime)]
+        return hashlib.sha256(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _load(self):
+        # caller holds the lock
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.root.is_dir():
+            return
+        files = []
+        for path in self.root.glob("*.wav"):
+            with suppress(OSError):
+                st = path.stat()
+                files.append((st.st_mtime, path.name, st.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+
+    def get(self, key):
+        """WAV bytes stored for this key, or None."""
+        if key is None:
+            return None
+        name = f"{key}.wav"
+        with self._lock:
+            self._load()
+            if name not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+        try:
+            data = (self.root / name).read_bytes()
+        except OSError:
+            with self._lock:
+                self.total_bytes -= self.entries.pop(name, 0)
+                self.misses += 1
+            return None
+        # mtime is the LRU order across restarts
+        with suppress(OSError):
+            os.utime(self.root / name)
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data: bytes):
+        if key is None or not data:
+            return
+        name = f"{key}.wav"
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f"{name}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.root / name)
+        with self._lock:
+            self._load()
+            self.total_bytes += len(data) - self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                with suppress(OSError):
+                    (self.root / old).unlink()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "clips": len(self.entries),
+                "mb": round(self.total_bytes / (1024 * 1024), 1),
+            }
+
+
+cache = TTSCache()
@@ -0,0 +1,145 @@
+# wav_stream.py - helpers for WAV audio that arrives progressively from SoVITS
+import struct
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+# Streaming servers don't know the final length when they send the header,
+# so they write one of these placeholders as the data chunk size.
+UNKNOWN_SIZES = (0, 0xFFFFFFFF, 0x7FFFFFFF)
+
+
+@dataclass
+class WavInfo:
+    sample_rate: int
+    channels: int
+    sample_width: int        # bytes per sample
+    data_offset: int         # byte offset of the first PCM sample
+    data_size: Optional[int]  # None when the header doesn't declare it (streaming)
+
+    @property
+    def byte_rate(self):
+        return self.sample_rate * self.channels * self.sample_width
+
+
+def parse_wav_header(buf: bytes) -> Optional[WavInfo]:
+    """
+    Parse a RIFF/WAVE header from the first bytes of a stream.
+
+    Returns None if more bytes are needed, raises ValueError if the bytes are not a WAV.
+    """
+    if len(buf) < 12:
+        return None
+    if buf[:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        raise ValueError(f"Not a RIFF/WAVE stream (starts with {buf[:12]!r})")
+
+    pos = 12
+    fmt = None
+    while pos + 8 <= len(buf):
+        chunk_id = buf[pos:pos + 4]
+        size = struct.unpack("<I", buf[pos + 4:pos + 8])[0]
+        if chunk_id == b"fmt ":
+            if pos + 24 > len(buf):
+                return None
+            _, channels, rate, _, _, bits = struct.unpack("<HHIIHH", buf[pos + 8:pos + 24])
+            fmt = (rate, channels, max(1, bits // 8))
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            rate, channels, width = fmt
+            return WavInfo(
+                sample_rate=rate,
+                channels=channels,
+                sample_width=width,
+                data_offset=pos + 8,
+                data_size=None if size in UNKNOWN_SIZES else size,
+            )
+        pos += 8 + size + (size & 1)
+    return None
+
+
+def finalize_wav_header(path, info: WavInfo, total_bytes: int):
+    """Rewrite the RIFF and data sizes of a streamed WAV so it's a valid file once complete."""
+    data_size = max(0, total_bytes - info.data_offset)
+    with open(path, "r+b") as f:
+        f.seek(4)
+        f.write(struct.pack("<I", min(0xFFFFFFFF, total_bytes - 8)))
+        f.seek(info.data_offset - 4)
+        f.write(struct.pack("<I", min(0xFFFFFFFF, data_size)))
+
+
+class WavStream:
+    """
+    Progress of one WAV clip being written by sovits_gen while it is still streaming.
+
+    The writer calls feed() for every chunk and finish() at the end; consumers wait on
+    header_ready to start playback early and on done (or add_done_callback) to learn
+    the final duration.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.info: Optional[WavInfo] = None
+        self.bytes_written = 0
+        self.error: Optional[BaseException] = None
+        self.header_ready = threading.Event()
+        self.done = threading.Event()
+        self._head = b""
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def feed(self, chunk: bytes):
+        self.bytes_written += len(chunk)
+        if self.info is None:
+            self._head += chunk
+            self.info = parse_wav_header(self._head)
+            if self.info is not None:
+                self._head = b""
+                self.header_ready.set()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.error = error
+        # wake anyone still waiting for the header, even on failure
+        self.header_ready.set()
+        with self._callbacks_lock:
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Call callback(stream) once the clip is complete (right away if it already is)."""
+        with self._callbacks_lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait_ready(self, timeout=None):
+        """Wait for the header (or a failure). Returns True if playback can start."""
+        self.header_ready.wait(timeout)
+        return self.error is None and self.info is not None
+
+    def known_duration(self) -> Optional[float]:
+        """Duration declared by the header, or the final one once done; None if unknown yet."""
+        if self.info is None:
+            return None
+        if self.done.is_set():
+            return self.duration()
+        if self.info.data_size is not None:
+            return self.info.data_size / self.info.byte_rate
+        return None
+
+    def duration(self) -> float:
+        if self.info is None:
+            return 0.0
+        data_bytes = max(0, self.bytes_written - self.info.data_offset)
+        if self.info.data_size is not None:
+            data_bytes = min(data_bytes, self.info.data_size)
+        return data_bytes / self.info.byte_rate
+
+    def wait_duration(self, timeout=None) -> float:
+        """Block until the clip is fully written and return its duration in seconds."""
+        self.done.wait(timeout)
+        return self.duration()
@@ -0,0 +1,65 @@
+# playback_events.py - playback acks from the avatar client, as seen by main_chat
+#
+# The browser reports {"type": "playback_started" | "playback_ended", "clip_id": ...}
+# on /ws; server.py forwards them to main_chat over the /ws_producer channel
+# (vrm_channel). PlaybackWorker uses them to know when a clip really started and
+# ended instead of trusting its own clock. Acks are only relied on once the client
+# has sent one (older pages don't) and while a client is connected.
+import threading
+import time
+
+from process.vrm_func.vrm_channel import add_listener
+
+KEEP_ACKS = 256
+
+
+class PlaybackEvents:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = {}  # clip_id -> time.monotonic() of the ack
+        self._ended = {}
+        self.client_count = 0
+        self.seen_ack = False
+        # called with the event type for every ack (PlaybackWorker wakes up on them)
+        self.on_ack = None
+
+    @property
+    def active(self) -> bool:
+        """True when an ack-capable client is connected, so an ended ack will come."""
+        return self.seen_ack and self.client_count > 0
+
+    def handle(self, event: dict):
+        kind = event.get("type")
+        if kind == "client_count":
+            self.client_count = int(event.get("count") or 0)
+            return
+        if kind == "disconnected":
+            self.client_count = 0
+            return
+        if kind not in ("playback_started", "playback_ended") or not event.get("clip_id"):
+            return
+        now = time.monotonic()
+        with self._lock:
+            target = self._started if kind == "playback_started" else self._ended
+            target.setdefault(event["clip_id"], now)
+            if len(target) > KEEP_ACKS:
+                # acks of clips long gone (dicts keep insertion order)
+                del target[next(iter(target))]
+            self.seen_ack = True
+        if self.on_ack is not None:
+            self.on_ack(kind)
+
+    def started_at(self, clip_id):
+        return self._started.get(clip_id)
+
+    def ended_at(self, clip_id):
+        return self._ended.get(clip_id)
+
+    def forget(self, clip_id):
+        with self._lock:
+            self._started.pop(clip_id, None)
+            self._ended.pop(clip_id, None)
+
+
+playback_events = PlaybackEvents()
+add_listener(playback_events.handle)
@@ -0,0 +1,112 @@
+# vrm_channel.py - persistent cue channel from main_chat to server.py (/ws_producer)
+#
+# Instead of one HTTP POST per avatar cue (request parsing, pydantic validation and a
+# JSON response every time), cues are written as frames on a single WebSocket that
+# server.py fans out to the VRM clients directly. If the channel can't be opened the
+# helpers in vrm_ping / vrm_states_ping fall back to their HTTP endpoints.
+#
+# server.py also uses the channel to send events back (the clients' playback acks);
+# a reader thread hands them to the callbacks registered with add_listener().
+import json
+import os
+import threading
+import time
+from contextlib import suppress
+
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect
+
+PRODUCER_URL = os.getenv("VRM_PRODUCER_URL", "ws://localhost:8001/ws_producer")
+# "ws" (default) uses the persistent channel, "http" keeps one POST per cue
+ENABLED = os.getenv("VRM_EVENT_CHANNEL", "ws").lower() == "ws"
+# after a failed connect, use HTTP for this long before trying again
+RETRY_AFTER = 5.0
+
+
+class VrmChannel:
+    def __init__(self, url: str):
+        self.url = url
+        self._ws = None
+        self._lock = threading.Lock()
+        self._next_attempt = 0.0
+        self.listeners = []
+
+    def send(self, cue: str, payload: dict) -> bool:
+        """Send one cue. Returns False if the channel is unavailable (caller should use HTTP)."""
+        frame = json.dumps({"cue": cue, **payload})
+        with self._lock:
+            # one reconnect attempt if the server dropped an idle connection
+            for _ in range(2):
+                ws = self._connect()
+                if ws is None:
+                    return False
+                try:
+                    ws.send(frame)
+                    return True
+                except (OSError, WebSocketException):
+                    self._drop()
+            return False
+
+    def _connect(self):
+        if self._ws is not None:
+            return self._ws
+        if time.monotonic() < self._next_attempt:
+            return None
+        try:
+            self._ws = connect(self.url, open_timeout=2, close_timeout=1)
+            print(f"[vrm_channel] connected to {self.url}")
+        except (OSError, TimeoutError, WebSocketException) as e:
+            print(f"[vrm_channel] unavailable ({e}), using HTTP for {RETRY_AFTER:.0f}s")
+            self._next_attempt = time.monotonic() + RETRY_AFTER
+            self._ws = None
+            return None
+        threading.Thread(target=self._read, args=(self._ws,), daemon=True).start()
+        return self._ws
+
+    def _read(self, ws):
+        # one reader per connection; ends when the connection is closed or dropped
+        try:
+            for raw in ws:
+                try:
+                    event = json.loads(raw)
+                except ValueError:
+                    continue
+                for listener in list(self.listeners):
+                    try:
+                        listener(event)
+                    except Exception as e:
+                        print(f"[vrm_channel] listener failed: {e}")
+        except (OSError, WebSocketException):
+            pass
+        for listener in list(self.listeners):
+            with suppress(Exception):
+                listener({"type": "disconnected"})
+
+    def _drop(self):
+        if self._ws is not None:
+            try:
+                self._ws.close()
+            except Exception:
+                pass
+        self._ws = None
+
+    def close(self):
+        with self._lock:
+            self._drop()
+
+
+_channel = VrmChannel(PRODUCER_URL) if ENABLED else None
+
+
+def send_cue(cue: str, payload: dict) -> bool:
+    """Send a cue over the shared channel; False means "not sent, use HTTP"."""
+    return _channel is not None and _channel.send(cue, payload)
+
+
+def add_listener(callback):
+    """
+    Call callback(event) for every event server.py sends back on the channel, plus
+    {"type": "disconnected"} when the channel drops. No-op when the channel is disabled.
+    """
+    if _channel is not None:
+        _channel.listeners.append(callback)
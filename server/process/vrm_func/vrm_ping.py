@@ -1,23 +1,60 @@
 # trigger_test.py
-import requests
+from process.net_func import http_session
+from process.vrm_func.vrm_channel import send_cue
 import time
 from pathlib import Path
 import asyncio 
 
 BASE_URL = "http://localhost:8001"
-def vrm_talk(aud_path, expression, audio_text, audio_duraction):
+def vrm_talk(aud_path, expression, audio_text, audio_duraction, start_in=0.0, clip_id=None):
+    """
+    Cue the avatar to play a clip. audio_duraction is in seconds (float);
+    start_in delays playback so a cue sent ahead of time starts on schedule.
+    The client acks playback_started / playback_ended with clip_id.
+    """
     url = "http://localhost:8001/talk"
     payload = {
         "audio_path": aud_path,
         "expression": expression,
         "audio_text": audio_text,
         "audio_duraction": audio_duraction,
+        "start_in": start_in,
+        "clip_id": clip_id,
     }
-    resp = requests.post(url, json=payload)
+    if send_cue("talk", payload):
+        return
+    resp = http_session.post("vrm", url, json=payload)
     print("Status:", resp.status_code)
     print("Response:", resp.json())
 
 
+def vrm_clip_duration(clip_id, duration):
+    """Final duration (seconds) of a streamed clip, once SoVITS has sent its last byte."""
+    url = f"{BASE_URL}/clip_duration"
+    payload = {"clip_id": clip_id, "duration": duration}
+    if send_cue("clip_duration", payload):
+        return None
+    return http_session.post("vrm", url, json=payload)
+
+
+def vrm_reply_marker(clip_id, offset, text, expression="neutral", duration=0.0):
+    """
+    Say where a chunk starts in a reply stream (offset and duration in seconds from
+    the start of clip_id), with its text and expression, for subtitles and expressions.
+    """
+    url = f"{BASE_URL}/reply_marker"
+    payload = {
+        "clip_id": clip_id,
+        "offset": offset,
+        "text": text,
+        "expression": expression,
+        "duration": duration,
+    }
+    if send_cue("reply_marker", payload):
+        return None
+    return http_session.post("vrm", url, json=payload)
+
+
 def vrm_animate(
     animation_type,
     animate_url,
@@ -49,8 +86,19 @@ def vrm_animate(
         "lock_position": lock_position,
         "track_position": track_position,
     }
-    resp = requests.post(url, json=payload)
+    if send_cue("animate", payload):
+        return None
+    resp = http_session.post("vrm", url, json=payload)
     print(f"[animate] Status: {resp.status_code}")
     print(f"[animate] Response: {resp.json()}")
     return resp
 
+
+def vrm_stop_audio():
+    """Stop whatever clip the avatar is playing right now (used for barge-in)."""
+    url = f"{BASE_URL}/stop_audio"
+    if send_cue("stop_audio", {}):
+        return None
+    resp = http_session.post("vrm", url)
+    print(f"[stop_audio] Status: {resp.status_code}")
+    return resp
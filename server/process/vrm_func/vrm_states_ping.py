@@ -2,7 +2,8 @@
 # Updated with tests for new realistic head movement features
 import time
 import sys
-import requests
+from process.net_func import http_session
+from process.vrm_func.vrm_channel import send_cue
 
 BASE_URL = "http://localhost:8001"
 
@@ -23,7 +24,9 @@ def set_vrm_state(state):
     """
     url = f"{BASE_URL}/set_state"
     payload = {"state": state}
-    resp = requests.post(url, json=payload)
+    if send_cue("set_state", payload):
+        return None
+    resp = http_session.post("vrm", url, json=payload)
     print(f"[set_state] Status: {resp.status_code}, State: {state}")
     return resp
 
@@ -38,7 +41,7 @@ def set_movement_lock_duration(duration):
     """
     url = f"{BASE_URL}/set_movement_lock_duration"
     payload = {"duration": duration}
-    resp = requests.post(url, json=payload)
+    resp = http_session.post("vrm", url, json=payload)
     print(f"[set_lock_duration] Status: {resp.status_code}, Duration: {duration}s")
     return resp
 
@@ -55,7 +58,7 @@ def vrm_animate(animation_type, animate_url, play_once=False, lock_position=Fals
         "lock_position": lock_position,
         "track_position": track_position,
     }
-    resp = requests.post(url, json=payload)
+    resp = http_session.post("vrm", url, json=payload)
     print(f"[animate] Status: {resp.status_code}")
     return resp
 
@@ -64,7 +67,7 @@ def vrm_walk_to(x, y, z, speed=1.5):
     """Walk the VRM character to a position."""
     url = f"{BASE_URL}/walk_to"
     payload = {"x": x, "y": y, "z": z, "speed": speed}
-    resp = requests.post(url, json=payload)
+    resp = http_session.post("vrm", url, json=payload)
     print(f"[walk_to] Status: {resp.status_code}, Target: ({x}, {y}, {z})")
     return resp
 
@@ -72,7 +75,7 @@ def vrm_walk_to(x, y, z, speed=1.5):
 def vrm_stop_movement():
     """Stop VRM movement and return to idle."""
     url = f"{BASE_URL}/stop_movement"
-    resp = requests.post(url)
+    resp = http_session.post("vrm", url)
     print(f"[stop_movement] Status: {resp.status_code}")
     return resp
 
@@ -7,13 +7,16 @@ from pathlib import Path
 import os
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 # BASE_DIR = Path(__file__).resolve().parent.parent
 # UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", BASE_DIR / "uploads"))
+BASE_DIR = Path(__file__).resolve().parent.parent
+# where main_chat writes synthesized clips (client/audio, served by vite as audio/...)
+AUDIO_DIR = Path(os.getenv("AUDIO_DIR", BASE_DIR / "client" / "audio"))
 
 
 logging.basicConfig(level=logging.INFO)
@@ -61,6 +64,8 @@ class SetStateRequest(BaseModel):
 # --- Track connections ---
 active_connections: Set[WebSocket] = set()
 status_connections: Set[WebSocket] = set()
+# main_chat connections on /ws_producer; they get the clients' playback acks back
+producer_connections: Set[WebSocket] = set()
 
 # --- Simple status page (optional) ---
 html = """
@@ -92,7 +97,22 @@ class TalkRequest(BaseModel):
     audio_path: str
     expression: str = "neutral"
     audio_text: str
-    audio_duraction: int
+    audio_duraction: float
+    start_in: float = 0.0
+    clip_id: Optional[str] = None
+
+class ClipDurationRequest(BaseModel):
+    """Final duration of a streamed clip, cued before SoVITS had finished it."""
+    clip_id: str
+    duration: float
+
+class ReplyMarkerRequest(BaseModel):
+    """Where a chunk starts in a reply stream (AUDIO_REPLY_STREAM=1 in main_chat)."""
+    clip_id: str
+    offset: float  # seconds from the start of the stream
+    text: str
+    expression: str = "neutral"
+    duration: float = 0.0
 
 # --- Notification logic ---
 async def notify_clients(message: dict):
@@ -113,6 +133,105 @@ async def broadcast_status(count: int):
     msg = json.dumps({"type": "count_update", "count": count})
     coros = [ws.send_text(msg) for ws in list(status_connections)]
     await asyncio.gather(*coros, return_exceptions=True)
+    await notify_producers({"type": "client_count", "count": count})
+
+
+async def notify_producers(message: dict):
+    """Send an event from the VRM clients (playback acks, client count) back to main_chat."""
+    data = json.dumps(message)
+    coros = [ws.send_text(data) for ws in list(producer_connections)]
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    for ws, res in zip(list(producer_connections), results):
+        if isinstance(res, Exception):
+            producer_connections.discard(ws)
+
+# events a VRM client may send on /ws
+CLIENT_EVENTS = ("playback_started", "playback_ended")
+
+# --- Cue builders (shared by the HTTP endpoints and the /ws_producer channel) ---
+VALID_STATES = ["idle", "listening", "thinking", "talking"]
+
+
+def build_talk(p: dict) -> dict:
+    return {
+        "type":        "start_animation",
+        "audio_path":  p["audio_path"],
+        "expression":  p.get("expression", "neutral"),
+        "audio_text":  p.get("audio_text", ""),
+        "audio_duraction":  p.get("audio_duraction", 0),
+        # seconds to wait before playing (cue sent ahead for gapless playback)
+        "start_in":  p.get("start_in", 0.0),
+        # echoed back in the client's playback_started / playback_ended acks
+        "clip_id":  p.get("clip_id")
+    }
+
+
+def build_animate(p: dict) -> dict:
+    # Auto-detect animation type from file extension if set to "auto"
+    anim_type = p["animate_type"]
+    if anim_type == "auto":
+        url_lower = p["animation_url"].lower()
+        if url_lower.endswith(".vrma"):
+            anim_type = "start_vrma"
+        elif url_lower.endswith(".fbx"):
+            anim_type = "start_mixamo"
+        else:
+            # Default to mixamo for unknown extensions
+            anim_type = "start_mixamo"
+        logger.info(f"Auto-detected animation type: {anim_type} for {p['animation_url']}")
+
+    # forward these fields to clients
+    return {
+        "type": anim_type,
+        "animation_url": p["animation_url"],
+        "play_once": p.get("play_once", False),
+        "crop_start": p.get("crop_start", 0.0),
+        "crop_end": p.get("crop_end", 0.0),
+        "lock_position": p.get("lock_position", False),
+        "track_position": p.get("track_position", True),
+    }
+
+
+def build_set_state(p: dict) -> Optional[dict]:
+    if p.get("state") not in VALID_STATES:
+        return None
+    return {
+        "type": "set_state",
+        "state": p["state"]
+    }
+
+
+def build_stop_audio(p: dict) -> dict:
+    return {"type": "stop_audio"}
+
+
+def build_clip_duration(p: dict) -> dict:
+    return {
+        "type": "clip_duration",
+        "clip_id": p["clip_id"],
+        "duration": p.get("duration", 0.0),
+    }
+
+
+def build_reply_marker(p: dict) -> dict:
+    return {
+        "type": "reply_marker",
+        "clip_id": p["clip_id"],
+        "offset": p.get("offset", 0.0),
+        "text": p.get("text", ""),
+        "expression": p.get("expression", "neutral"),
+        "duration": p.get("duration", 0.0),
+    }
+
+
+CUE_BUILDERS = {
+    "talk": build_talk,
+    "reply_marker": build_reply_marker,
+    "clip_duration": build_clip_duration,
+    "animate": build_animate,
+    "set_state": build_set_state,
+    "stop_audio": build_stop_audio,
+}
 
 # --- WebSocket endpoints ---
 @app.websocket("/ws")
@@ -123,8 +242,14 @@ async def ws_endpoint(ws: WebSocket):
     await broadcast_status(len(active_connections))
     try:
         while True:
-            # Keep-alive or handle incoming if needed
-            await ws.receive_text()
+            # keep-alive pings, and playback acks: {"type": "playback_started" | "playback_ended", "clip_id": ...}
+            raw = await ws.receive_text()
+            try:
+                msg = json.loads(raw)
+            except ValueError:
+                continue
+            if isinstance(msg, dict) and msg.get("type") in CLIENT_EVENTS:
+                await notify_producers({"type": msg["type"], "clip_id": msg.get("clip_id")})
     except WebSocketDisconnect:
         active_connections.discard(ws)
         logger.info(f"Client disconnected: {ws.client} (total {len(active_connections)})")
@@ -134,6 +259,43 @@ async def ws_endpoint(ws: WebSocket):
         active_connections.discard(ws)
         await broadcast_status(len(active_connections))
 
+@app.websocket("/ws_producer")
+async def ws_producer(ws: WebSocket):
+    """
+    Persistent cue channel for main_chat.
+
+    Each text frame is {"cue": "talk" | "reply_marker" | "clip_duration" | "animate" | "set_state" | "stop_audio", ...fields}
+    with the same fields as the matching HTTP endpoint. Frames are handled in order and
+    fanned out to the VRM clients directly, without a request/response per cue.
+
+    The other way, the producer receives the clients' playback acks
+    ({"type": "playback_started" | "playback_ended", "clip_id": ...}) and
+    {"type": "client_count", "count": n} whenever a client connects or leaves.
+    """
+    await ws.accept()
+    producer_connections.add(ws)
+    logger.info(f"Producer connected: {ws.client}")
+    await ws.send_text(json.dumps({"type": "client_count", "count": len(active_connections)}))
+    try:
+        while True:
+            try:
+                msg = json.loads(await ws.receive_text())
+                builder = CUE_BUILDERS[msg.pop("cue")]
+                forwarded = builder(msg)
+            except (ValueError, KeyError, AttributeError, TypeError) as e:
+                logger.error(f"Bad producer frame: {e!r}")
+                continue
+            if forwarded is None:
+                logger.error(f"Rejected producer cue: {msg}")
+                continue
+            await notify_clients(forwarded)
+    except WebSocketDisconnect:
+        logger.info(f"Producer disconnected: {ws.client}")
+    except Exception as e:
+        logger.error(f"Producer WS error: {e}")
+    finally:
+        producer_connections.discard(ws)
+
 @app.websocket("/ws_status")
 async def ws_status(ws: WebSocket):
     await ws.accept()
@@ -154,43 +316,14 @@ async def ws_status(ws: WebSocket):
 @app.post("/talk")
 async def talk(req: TalkRequest):
     """Receive audio_path & optional expression, broadcast to VRM clients."""
-    payload = {
-        "type":        "start_animation",
-        "audio_path":  req.audio_path,
-        "expression":  req.expression,
-        "audio_text":  req.audio_text,
-        "audio_duraction":  req.audio_duraction
-    }
+    payload = build_talk(dict(req))
     await notify_clients(payload)
     return {"status": "sent", "payload": payload}
 
 
 @app.post("/animate")
 async def animate(payload: AnimationPayload):
-    # Auto-detect animation type from file extension if set to "auto"
-    anim_type = payload.animate_type
-    if anim_type == "auto":
-        url_lower = payload.animation_url.lower()
-        if url_lower.endswith(".vrma"):
-            anim_type = "start_vrma"
-        elif url_lower.endswith(".fbx"):
-            anim_type = "start_mixamo"
-        else:
-            # Default to mixamo for unknown extensions
-            anim_type = "start_mixamo"
-        logger.info(f"Auto-detected animation type: {anim_type} for {payload.animation_url}")
-
-    # forward these fields to clients
-    forwarded = {
-        "type": anim_type,
-        "animation_url": payload.animation_url,
-        "play_once": payload.play_once,
-        "crop_start": payload.crop_start,
-        "crop_end": payload.crop_end,
-        "lock_position": payload.lock_position,
-        "track_position": payload.track_position,
-    }
-
+    forwarded = build_animate(dict(payload))
     await notify_clients(forwarded)
     return {"status": "sent", "payload": forwarded}
 
@@ -208,6 +341,70 @@ async def animate_and_talk(payload: CombinedPayload):
     return {"status": "combined sent"}
 
 
+@app.post("/stop_audio")
+async def stop_audio():
+    """Cut the clip currently playing on the VRM clients (user barge-in)."""
+    payload = build_stop_audio({})
+    await notify_clients(payload)
+    return {"status": "sent", "payload": payload}
+
+
+@app.post("/clip_duration")
+async def clip_duration(req: ClipDurationRequest):
+    """Forward the final duration of a streamed clip to the VRM clients."""
+    payload = build_clip_duration(dict(req))
+    await notify_clients(payload)
+    return {"status": "sent", "payload": payload}
+
+
+@app.post("/reply_marker")
+async def reply_marker(req: ReplyMarkerRequest):
+    """Forward a chunk's position in a reply stream (text, expression) to the VRM clients."""
+    payload = build_reply_marker(dict(req))
+    await notify_clients(payload)
+    return {"status": "sent", "payload": payload}
+
+
+# ============ PROGRESSIVE AUDIO ============
+
+@app.get("/audio_stream/{filename}")
+async def audio_stream(filename: str):
+    """
+    Stream a clip while sovits_gen is still writing it.
+
+    sovits_gen(stream=...) keeps a "<filename>.part" marker next to the clip until the
+    last byte is written; this tails the file until the marker disappears, so the
+    browser can start playing the first sentence before synthesis has finished.
+    Reply streams (reply_stream.py) are served the same way, for the whole reply.
+    """
+    path = AUDIO_DIR / Path(filename).name
+    part = path.with_name(path.name + ".part")
+
+    # the cue can reach us a moment before the writer has created the file
+    for _ in range(200):
+        if path.exists():
+            break
+        await asyncio.sleep(0.025)
+    else:
+        return HTMLResponse(f"Audio not found: {path.name}", status_code=404)
+
+    async def tail():
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(1024 * 16)
+                if data:
+                    yield data
+                    continue
+                if not part.exists():
+                    rest = f.read()
+                    if rest:
+                        yield rest
+                    break
+                await asyncio.sleep(0.02)
+
+    return StreamingResponse(tail(), media_type="audio/wav")
+
+
 # ============ STATE CONTROL ============
 
 @app.post("/set_state")
@@ -233,18 +430,14 @@ async def set_state(req: SetStateRequest):
             "state": "talking"
         }
     """
-    valid_states = ["idle", "listening", "thinking", "talking"]
-    if req.state not in valid_states:
+    payload = build_set_state(dict(req))
+    if payload is None:
         return {
             "status": "error",
             "message": f"Invalid state: {req.state}",
-            "valid_states": valid_states
+            "valid_states": VALID_STATES
         }
 
-    payload = {
-        "type": "set_state",
-        "state": req.state
-    }
     await notify_clients(payload)
     return {
         "status": "state_set",
@@ -0,0 +1,39 @@
+# Run from server/: python -m pytest tests  (pip install pytest)
+#
+# Modules read character_config.yaml from the working directory (main_chat runs from
+# the repo root), and import `process.` from server/.
+import os
+import socket
+import sys
+from pathlib import Path
+
+import pytest
+
+SERVER = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SERVER))
+os.chdir(SERVER.parent)
+
+from process.perf_func.fake_backends import serve_in_thread
+
+
+@pytest.fixture
+def serve():
+    """Start a fake backend (fake_backends.py) in a thread; stopped after the test."""
+    started = []
+
+    def start(server):
+        started.append(serve_in_thread(server))
+        return server
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def dead_port():
+    # a port nothing listens on
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
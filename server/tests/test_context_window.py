@@ -0,0 +1,23 @@
+# ContextWindow: where the summary goes
+from process.llm_funcs.context_window import ContextWindow
+
+SYSTEM = {"role": "system", "content": "Tu es Riko."}
+
+
+def convo(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "blabla " * 10}
+            for i in range(n)]
+
+
+def test_summary_follows_the_system_prompt():
+    context = ContextWindow(budget=10_000)
+    context.summary, context.summary_upto = "On a parlé de crêpes.", 3
+    messages = [SYSTEM] + convo(10)
+
+    out = context.build(messages)
+
+    assert out[0] == SYSTEM
+    assert out[1] == {"role": "system", "content": "Summary of the earlier conversation:\nOn a parlé de crêpes."}
+    # what the summary covers isn't sent again
+    assert out[2:] == messages[5:]
+
@@ -0,0 +1,62 @@
+# HistoryStore compaction: keep=0, and a crash between the archive append and the log rewrite
+import json
+
+from process.llm_funcs.history_store import HistoryStore
+
+
+def turns(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(n)]
+
+
+def lines(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_compact_keeps_the_last_messages(tmp_path):
+    store = HistoryStore(tmp_path / "chat_history.jsonl", keep=4, compact_bytes=0)
+    store.append(*turns(10))
+
+    store.compact()
+
+    assert lines(store.archive_path) == turns(10)[:6]
+    assert lines(store.path) == turns(10)[6:]
+    assert not store.journal_path.exists()
+
+
+def test_keep_zero_archives_everything(tmp_path):
+    store = HistoryStore(tmp_path / "chat_history.jsonl", keep=0, compact_bytes=0)
+    store.append(*turns(6))
+
+    store.compact()
+
+    assert lines(store.archive_path) == turns(6)
+    assert lines(store.path) == []
+    assert HistoryStore(store.path).position() == 6
+
+
+def test_crash_before_the_log_rewrite_is_rolled_back(tmp_path, monkeypatch):
+    store = HistoryStore(tmp_path / "chat_history.jsonl", keep=2, compact_bytes=0)
+    store.append(*turns(4))
+    store.compact()
+    store.append(*turns(8)[4:])
+
+    def crash(path, messages):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(HistoryStore, "_write_atomic", staticmethod(crash))
+    try:
+        store.compact()
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+    assert store.journal_path.exists()
+
+    # next start: the second archive append is undone, nothing is counted twice
+    restarted = HistoryStore(store.path, keep=2, compact_bytes=0)
+    assert restarted.tail() == turns(8)[2:]
+    assert restarted.position() == 2
+    assert lines(store.archive_path) == turns(8)[:2]
+    assert not store.journal_path.exists()
+
+    restarted.compact()
+    assert lines(store.archive_path) + lines(store.path) == turns(8)
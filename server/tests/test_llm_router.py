@@ -0,0 +1,137 @@
+# LLMRouter against FakeLLM servers: TTFT tracking, hedging, failover
+import threading
+import time
+
+import openai
+import pytest
+
+from process.llm_funcs.llm_backend import LLMBackend
+from process.llm_funcs import llm_router
+from process.llm_funcs.llm_router import LLMRouter
+from process.perf_func.fake_backends import FakeLLM
+
+FAST = "Réponse rapide."
+SLOW = "Réponse lente."
+
+
+@pytest.fixture
+def servers(serve):
+    return lambda **kwargs: serve(FakeLLM(0, tokens_per_sec=200.0, **kwargs))
+
+
+def backend(server_or_port):
+    port = server_or_port if isinstance(server_or_port, int) else server_or_port.server_address[1]
+    return LLMBackend("fake", f"http://127.0.0.1:{port}/v1", "sk-fake", "fake")
+
+
+def complete(router):
+    return router.complete([{"role": "user", "content": "salut"}])
+
+
+def test_records_ttft(servers):
+    server = servers(ttft=0.2, replies=[FAST])
+    router = LLMRouter([backend(server)])
+
+    assert complete(router) == FAST
+    ttft = router.endpoints[0].ttft
+    assert 0.2 <= ttft < 1.0
+
+    complete(router)
+    # moving average of two samples close to 0.2s
+    assert 0.2 <= router.endpoints[0].ttft < 1.0
+
+
+def test_every_endpoint_gets_measured(servers):
+    slow = servers(ttft=0.3, replies=[SLOW])
+    fast = servers(ttft=0.05, replies=[FAST])
+    router = LLMRouter([backend(slow), backend(fast)])
+
+    # no hedging: the first turns still go to each endpoint once
+    assert complete(router) == SLOW
+    assert complete(router) == FAST
+    assert complete(router) == FAST
+    assert (slow.requests, fast.requests) == (1, 2)
+
+
+def test_stale_endpoint_is_tried_again(servers, monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_EXPLORE_AFTER", 0.5)
+    slow = servers(ttft=0.3, replies=[SLOW])
+    fast = servers(ttft=0.05, replies=[FAST])
+    router = LLMRouter([backend(slow), backend(fast)])
+    complete(router)
+    complete(router)
+
+    time.sleep(0.6)
+    # both are stale now: list order again, then the fastest
+    assert complete(router) == SLOW
+    assert router.ranked()[0] is router.endpoints[1]
+
+
+def test_old_ttft_fades(monkeypatch, dead_port):
+    monkeypatch.setattr(llm_router, "LLM_TTFT_HALF_LIFE", 10.0)
+    endpoint = llm_router.Endpoint(backend(dead_port))
+    endpoint.record_ttft(5.0, now=0.0)
+
+    endpoint.record_ttft(0.2, now=1.0)
+    # a fresh average moves by TTFT_ALPHA only
+    assert endpoint.ttft > 3.0
+
+    endpoint.record_ttft(0.2, now=100.0)
+    # ten half-lives later the old samples are all but gone
+    assert endpoint.ttft < 0.25
+
+
+def test_hedge_goes_to_the_fastest(servers):
+    slow = servers(ttft=2.0, replies=[SLOW])
+    fast = servers(ttft=0.05, replies=[FAST])
+    router = LLMRouter([backend(slow), backend(fast)], hedge_after=0.2)
+
+    assert complete(router) == FAST
+    slow_ep, fast_ep = router.endpoints
+    assert fast_ep.ttft < slow_ep.ttft
+    # the next turn goes straight to the winner
+    assert router.ranked()[0] is fast_ep
+    assert complete(router) == FAST
+    assert slow.requests == 1
+
+
+def test_fails_over_from_a_dead_url(servers, dead_port):
+    live = servers(ttft=0.05, replies=[FAST])
+    router = LLMRouter([backend(dead_port), backend(live)])
+
+    assert complete(router) == FAST
+    dead_ep, live_ep = router.endpoints
+    assert dead_ep.failures == 1
+    assert router.ranked() == [live_ep, dead_ep]
+
+
+def test_fails_over_on_server_error(servers):
+    broken = servers(status=503)
+    live = servers(ttft=0.05, replies=[FAST])
+    router = LLMRouter([backend(broken), backend(live)])
+
+    assert complete(router) == FAST
+    assert router.endpoints[0].failures == 1
+
+
+@pytest.mark.parametrize("status", [400, 404, 422])
+def test_client_error_is_raised_without_failover(servers, status):
+    refusing = servers(status=status)
+    live = servers(ttft=0.05, replies=[FAST])
+    router = LLMRouter([backend(refusing), backend(live)])
+
+    with pytest.raises(openai.APIStatusError) as error:
+        complete(router)
+    assert error.value.status_code == status
+    assert live.requests == 0
+    assert all(e.failures == 0 for e in router.endpoints)
+
+
+def test_cancel_while_the_server_stalls(servers):
+    stalled = servers(ttft=5.0, replies=[SLOW])
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+
+    start = time.monotonic()
+    assert backend(stalled).complete([{"role": "user", "content": "salut"}], cancel_event=cancel) == ""
+    assert time.monotonic() - start < 1.0
@@ -0,0 +1,196 @@
+# sovits_ping's synthesis requests against FakeSoVITS pools: load split, concurrency
+# cap, failover (unreachable, 5xx), reference re-registration, cancel, recovery
+import threading
+import time
+
+import pytest
+import requests
+
+from process.perf_func.fake_backends import FakeSoVITS, make_wav
+from process.tts_func import sovits_ping
+from process.tts_func import sovits_pool as pool_module
+from process.tts_func.sovits_pool import SoVITSPool
+
+
+@pytest.fixture
+def servers(serve):
+    def start(port=0, **kwargs):
+        kwargs.setdefault("latency_per_char", 0.0)
+        kwargs.setdefault("seconds_per_char", 0.01)
+        kwargs.setdefault("reference_latency", 0.0)
+        return serve(FakeSoVITS(port, **kwargs))
+
+    return start
+
+
+@pytest.fixture
+def use_pool(monkeypatch, tmp_path):
+    """Point sovits_ping at a pool of the given servers, with a reference wav that exists."""
+    ref = tmp_path / "ref.wav"
+    header, pcm = make_wav(0.5, 32000)
+    ref.write_bytes(header + pcm)
+    monkeypatch.setattr(sovits_ping, "_reference_override",
+                        {"refer_wav_path": str(ref), "prompt_text": "Bonjour.", "prompt_language": "auto"})
+
+    def use(*urls, **kwargs):
+        pool = SoVITSPool(list(urls), **kwargs)
+        monkeypatch.setattr(sovits_ping, "sovits_pool", pool)
+        return pool
+
+    return use
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def synthesize(text="Bonjour.", cancel_event=None):
+    with sovits_ping._sovits_response(text, cancel_event=cancel_event) as r:
+        return r.content
+
+
+def run_parallel(n, target):
+    threads = [threading.Thread(target=target) for _ in range(n)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.monotonic() - start
+
+
+def test_splits_chunks_over_instances(servers, use_pool):
+    a = servers(base_latency=0.3, serial=True)
+    b = servers(base_latency=0.3, serial=True)
+    pool = use_pool(url(a), url(b), max_concurrency=2)
+
+    elapsed = run_parallel(4, synthesize)
+
+    assert (a.requests, b.requests) == (2, 2)
+    # two rounds per serial GPU instead of four on one
+    assert elapsed < 4 * 0.3
+    assert all(i.active == 0 for i in pool.instances)
+
+
+def test_caps_requests_per_instance(servers):
+    server = servers(base_latency=0.3)
+    pool = SoVITSPool([url(server)], max_concurrency=2)
+    peak = []
+
+    def chunk():
+        instance = pool.acquire()
+        try:
+            peak.append(instance.active)
+            requests.post(f"{instance.base_url}/", json={"text": "Salut.", "refer_wav_path": "ref.wav"}, timeout=5)
+        finally:
+            pool.release(instance)
+
+    elapsed = run_parallel(6, chunk)
+
+    assert max(peak) == 2
+    # six chunks, two at a time: three rounds of 0.3s
+    assert elapsed >= 3 * 0.3
+    assert server.requests == 6
+
+
+def test_acquire_times_out_when_full(servers):
+    server = servers()
+    pool = SoVITSPool([url(server)], max_concurrency=1)
+    held = pool.acquire()
+
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.2)
+    pool.release(held)
+    pool.release(pool.acquire(timeout=0.2))
+
+
+def test_fails_over_to_a_live_instance(servers, use_pool, dead_port):
+    live = servers(base_latency=0.05)
+    pool = use_pool(f"http://127.0.0.1:{dead_port}", url(live), cooldown=60)
+    dead_instance, live_instance = pool.instances
+
+    assert synthesize()
+    assert live.requests == 1
+    assert dead_instance.failures == 1
+    assert not dead_instance.healthy(time.monotonic())
+
+    # while it's out, chunks go straight to the live one
+    for _ in range(3):
+        synthesize()
+    assert live.requests == 4
+    assert dead_instance.failures == 1
+    assert live_instance.active == 0
+
+
+def test_fails_over_on_server_error(servers, use_pool):
+    broken = servers(status=503)
+    live = servers(base_latency=0.05)
+    pool = use_pool(url(broken), url(live), cooldown=60)
+
+    assert synthesize()
+    assert (broken.requests, live.requests) == (1, 1)
+    assert pool.instances[0].failures == 1
+
+
+def test_server_error_on_the_last_instance_is_raised(servers, use_pool):
+    broken = servers(status=503)
+    use_pool(url(broken))
+
+    with pytest.raises(RuntimeError, match="HTTP 503"):
+        synthesize()
+    assert broken.requests == 1
+
+
+def test_registers_the_reference_again_after_a_restart(servers, use_pool):
+    server = servers(base_latency=0.05)
+    instance, = use_pool(url(server)).instances
+
+    synthesize()
+    assert server.default_refer == sovits_ping._reference_override["refer_wav_path"]
+    assert instance.reference is not None
+
+    # restarted without a preset: the lean request gets a 400, the reference is sent again
+    server.default_refer = None
+    assert synthesize()
+    assert server.requests == 3
+    assert server.default_refer == sovits_ping._reference_override["refer_wav_path"]
+
+
+def test_cancel_while_waiting_for_a_slot(servers, use_pool):
+    server = servers()
+    pool = use_pool(url(server), max_concurrency=1)
+    held = pool.acquire()
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+
+    start = time.monotonic()
+    with pytest.raises(sovits_ping.TTSCancelled):
+        synthesize(cancel_event=cancel)
+    assert time.monotonic() - start < 0.3 + 2 * sovits_ping.ACQUIRE_POLL
+    assert server.requests == 0
+    pool.release(held)
+
+
+def test_health_loop_brings_an_instance_back(servers, use_pool, dead_port, monkeypatch):
+    monkeypatch.setattr(pool_module, "HEALTH_INTERVAL", 0.1)
+    live = servers(base_latency=0.05)
+    pool = use_pool(f"http://127.0.0.1:{dead_port}", url(live), cooldown=60)
+    revived = pool.instances[0]
+    revived.reference = "ref.wav"
+
+    synthesize()
+    assert not revived.healthy(time.monotonic())
+    assert revived.reference is None
+
+    # the instance restarts: the health loop notices well before the cooldown ends
+    restarted = servers(port=dead_port, base_latency=0.05)
+    deadline = time.monotonic() + 5
+    while not revived.healthy(time.monotonic()) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert revived.healthy(time.monotonic())
+
+    # and it takes chunks again, with the reference registered anew
+    run_parallel(4, synthesize)
+    assert restarted.requests > 0
+    assert restarted.default_refer is not None
+    assert revived.failures == 1
@@ -0,0 +1,23 @@
+# TextChunker boundaries: abbreviations that are also plain words
+from process.llm_funcs.text_chunker import TextChunker
+
+
+def chunks(text):
+    chunker = TextChunker(min_len=5, first_min_len=5)
+    return chunker.feed(text) + chunker.flush()
+
+
+def test_no_before_a_number_is_an_abbreviation():
+    assert chunks("Prends la ligne no. 5 jusqu'au bout.") == ["Prends la ligne no. 5 jusqu'au bout."]
+
+
+def test_no_ending_a_sentence_is_cut():
+    assert chunks("She just said no. Then she left.") == ["She just said no.", "Then she left."]
+
+
+def test_me_before_a_name_is_an_abbreviation():
+    assert chunks("Demande conseil à Me. Dupont demain.") == ["Demande conseil à Me. Dupont demain."]
+
+
+def test_me_ending_a_sentence_is_cut():
+    assert chunks("Tu peux le dire à me. après on verra.") == ["Tu peux le dire à me.", "après on verra."]